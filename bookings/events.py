@@ -0,0 +1,279 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.authtoken.models import Token
+
+from bookings.models import Booking
+from bookings import queue
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'booking-queue:{0}'           # seller id
+CHANNEL_PATTERN = 'booking-queue:*'
+
+# Every process keeps one registry of the streams waiting on a seller, woken from any thread:
+# seller id -> {event loop: Watch}.
+listeners = {}
+listeners_lock = threading.Lock()
+subscriber = None
+client = None
+
+
+def database_sync_to_async(function):
+    """sync_to_async that drops stale connections before and after, like a request does."""
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run)
+
+
+class Watch:
+    """The streams of one event loop waiting on a seller, which share one load per queue move."""
+
+    def __init__(self):
+        self.streams = {}   # asyncio.Event -> booking id
+        self.bookings = None
+
+    def moved(self):
+        with listeners_lock:
+            streams = dict(self.streams)
+        if streams:
+            self.bookings = asyncio.ensure_future(load_bookings(set(streams.values())))
+        for event in streams:
+            event.set()
+
+
+def dispatch(seller_id):
+    """Wakes every stream of this process waiting on the seller."""
+    with listeners_lock:
+        waiting = list(listeners.get(seller_id, {}).items())
+    for loop, watch in waiting:
+        loop.call_soon_threadsafe(watch.moved)
+
+
+def redis_client():
+    # publish() runs after the commit of a request, a hung redis mustn't hold it up.
+    global client
+    with listeners_lock:
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(
+                settings.QUEUE_EVENTS_REDIS_URL, socket_timeout=settings.QUEUE_EVENTS_REDIS_TIMEOUT,
+                socket_connect_timeout=settings.QUEUE_EVENTS_REDIS_TIMEOUT)
+    return client
+
+
+def publish(seller_id):
+    """
+    Tells the streams of every process that the queue of a seller moved. Without redis, or
+    while it's down, only the streams of this process hear about it.
+    """
+    if settings.QUEUE_EVENTS_REDIS_URL:
+        try:
+            redis_client().publish(CHANNEL.format(seller_id), '')
+            return
+        except Exception as error:
+            logger.warning('Publishing the queue of seller %s failed, notifying this process only: %s', seller_id, error)
+    dispatch(seller_id)
+
+
+def subscribe():
+    """
+    Receives the queue changes of every seller from redis, one connection per process. Changes
+    published while the connection was down are lost, so once subscribed again every stream
+    loads its booking again.
+    """
+    import redis
+    reconnecting = False
+    while True:
+        try:
+            # Its own connection without a read timeout, the subscription is idle most of the time.
+            pubsub = redis.Redis.from_url(
+                settings.QUEUE_EVENTS_REDIS_URL, socket_connect_timeout=settings.QUEUE_EVENTS_REDIS_TIMEOUT,
+                socket_keepalive=True).pubsub()
+            pubsub.psubscribe(CHANNEL_PATTERN)
+            for message in pubsub.listen():
+                if message['type'] == 'pmessage':
+                    dispatch(int(message['channel'].decode().rsplit(':', 1)[1]))
+                elif message['type'] == 'psubscribe' and reconnecting:
+                    with listeners_lock:
+                        seller_ids = list(listeners)
+                    for seller_id in seller_ids:
+                        dispatch(seller_id)
+        except Exception:
+            logger.exception('Queue event subscription lost, reconnecting.')
+            reconnecting = True
+            time.sleep(settings.QUEUE_EVENTS_RECONNECT)
+
+
+def start_subscriber():
+    global subscriber
+    with listeners_lock:
+        if subscriber is None and settings.QUEUE_EVENTS_REDIS_URL:
+            subscriber = threading.Thread(target=subscribe, name='queue-events', daemon=True)
+            subscriber.start()
+
+
+@contextmanager
+def listen(seller_id, booking_id):
+    """
+    (watch, asyncio.Event) of a booking, the event set whenever the queue of the seller moves
+    while inside the block. The booking is then among watch.bookings.
+    """
+    start_subscriber()
+    loop, event = asyncio.get_running_loop(), asyncio.Event()
+    with listeners_lock:
+        watch = listeners.setdefault(seller_id, {}).setdefault(loop, Watch())
+        watch.streams[event] = booking_id
+    try:
+        yield watch, event
+    finally:
+        with listeners_lock:
+            del watch.streams[event]
+            if not watch.streams:
+                del listeners[seller_id][loop]
+                if not listeners[seller_id]:
+                    del listeners[seller_id]
+
+
+@database_sync_to_async
+def authorize(booking_id, key):
+    """(status code, seller id) of a request for the events of a booking."""
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return 401, None
+    booking = Booking.objects.filter(pk=booking_id).values('user', 'seller').first()
+    if booking is None:
+        return 404, None
+    if booking['user'] != token.user_id and not token.user.is_superuser:
+        return 403, None
+    return 200, booking['seller']
+
+
+@database_sync_to_async
+def load_bookings(booking_ids):
+    """Bookings with the counters of their seller, one query however many streams wait on them."""
+    return Booking.objects.select_related('seller').in_bulk(booking_ids)
+
+
+def queue_state(booking):
+    """State sent to the client, and what must change for the queue to have moved for this booking."""
+    people, seconds = queue.position(booking, booking.seller)
+    return {'status': booking.status, 'people': people, 'time': seconds}, (booking.status, people, booking.seller.serving_ticket)
+
+
+async def next_state(booking_id, watch, changed):
+    """
+    queue_state() of the booking as of the last queue move, its own load at first. (None, None)
+    once the booking was deleted.
+    """
+    if changed is None:
+        bookings = await load_bookings([booking_id])
+    else:
+        changed.clear()
+        bookings = await watch.bookings
+    booking = bookings.get(booking_id)
+    return queue_state(booking) if booking else (None, None)
+
+
+async def send_json(send, status, content):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(content).encode()})
+
+
+async def wait_for(event, disconnect, timeout):
+    """Waits for the event until timeout, False if the client went away first."""
+    waiter = asyncio.ensure_future(event.wait())
+    await asyncio.wait({waiter, disconnect}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
+    return not disconnect.done()
+
+
+async def disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def queue_events(scope, receive, send, booking_id):
+    """
+    Queue position and ETA of a booking, pushed when the seller's queue moves instead of polled.
+
+    Clients accepting text/event-stream get Server-Sent Events until the booking leaves the
+    queue or is deleted, the rest a long poll: the state is returned once it differs from the people and
+    status query parameters, or after QUEUE_EVENTS_LONG_POLL seconds. EventSource can't set
+    headers, so the token may also come as a query parameter. The ETA counts down client side.
+    """
+    query = parse_qs(scope['query_string'].decode())
+    headers = dict(scope['headers'])
+    key = headers.get(b'authorization', b'').decode().partition('Token ')[2] or query.get('token', [''])[0]
+    code, seller_id = await authorize(booking_id, key)
+    if code != 200:
+        return await send_json(send, code, {'message': 'Booking not available to this user.'})
+
+    disconnect = asyncio.ensure_future(disconnected(receive))
+    try:
+        with listen(seller_id, booking_id) as (watch, changed):
+            if b'text/event-stream' in headers.get(b'accept', b''):
+                await stream(send, booking_id, watch, changed, disconnect)
+            else:
+                known = {'people': query.get('people', [None])[0], 'status': query.get('status', [None])[0]}
+                await long_poll(send, booking_id, watch, changed, disconnect, known)
+    finally:
+        disconnect.cancel()
+
+
+async def stream(send, booking_id, watch, changed, disconnect):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no'),
+    ]})
+    sent = None
+    state, moved = await next_state(booking_id, watch, None)
+    while state is not None:
+        # Changes behind this booking, like a later cancel, don't move it.
+        if moved != sent:
+            await send({'type': 'http.response.body', 'body': 'data: {0}\n\n'.format(json.dumps(state)).encode(), 'more_body': True})
+            sent = moved
+        if state['status'] != 'booked':
+            break
+        # Wakes up on queue moves only, with a comment now and then so proxies keep the connection.
+        while not changed.is_set():
+            if not await wait_for(changed, disconnect, settings.QUEUE_EVENTS_HEARTBEAT):
+                return
+            if not changed.is_set():
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+        state, moved = await next_state(booking_id, watch, changed)
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def long_poll(send, booking_id, watch, changed, disconnect, known):
+    deadline = time.monotonic() + settings.QUEUE_EVENTS_LONG_POLL
+    state, moved = await next_state(booking_id, watch, None)
+    while state is not None:
+        if known != {'people': str(state['people']), 'status': state['status']}:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await wait_for(changed, disconnect, remaining):
+            break
+        if not changed.is_set():
+            break
+        state, moved = await next_state(booking_id, watch, changed)
+    if disconnect.done():
+        return
+    if state is None:
+        await send_json(send, 404, {'message': 'Booking not available to this user.'})
+    else:
+        await send_json(send, 200, state)
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_booking_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='scored',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(scored=False), fields=['status'], name='booking_unscored_idx'),
+        ),
+    ]
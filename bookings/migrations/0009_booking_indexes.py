@@ -0,0 +1,33 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_booking_scored'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['seller', 'status', 'started_time', 'booked_time'], name='booking_seller_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['seller', 'status', 'booked_time'], name='booking_seller_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', 'status', 'booked_time'], name='booking_user_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['table', 'reserved_time', 'status'], name='booking_table_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'started_time'], name='booking_started_idx'),
+        ),
+    ]
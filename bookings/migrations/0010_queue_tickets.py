@@ -0,0 +1,51 @@
+# Generated by Django 3.1.6 on 2026-10-18 14:11
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def number_queues(apps, schema_editor):
+    Seller = apps.get_model('services', 'Seller')
+    Booking = apps.get_model('bookings', 'Booking')
+    now = datetime.now()
+
+    queues = {}
+    # The started booking first, then the waiting ones in the order they were booked.
+    bookings = Booking.objects.filter(status='booked').order_by(
+        'seller', F('started_time').asc(nulls_last=True), 'booked_time', 'pk')
+    for booking in bookings:
+        queues.setdefault(booking.seller_id, []).append(booking)
+
+    for seller, bookings in queues.items():
+        for ticket, booking in enumerate(bookings, 1):
+            booking.ticket = ticket
+            # Exactly one booking per seller is started, a stuck queue starts now.
+            booking.started_time = (booking.started_time or now) if ticket == 1 else None
+        Booking.objects.bulk_update(bookings, ['ticket', 'started_time'], batch_size=1000)
+        Seller.objects.filter(pk=seller).update(
+            next_ticket=len(bookings), serving_ticket=1, active_bookings=len(bookings),
+            serving_started_time=bookings[0].started_time,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0009_booking_indexes'),
+        ('services', '0020_queue_tickets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='ticket',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['seller', 'status', 'ticket'], name='booking_ticket_idx'),
+        ),
+        migrations.RunPython(number_queues, migrations.RunPython.noop),
+    ]
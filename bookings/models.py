@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 from users.models import User
 from services.models import Seller, Product
@@ -51,6 +51,24 @@ class Booking(models.Model):
     booked_time = models.DateTimeField(auto_now=True)
     started_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(choices=BOOKING_STATUS, max_length=10, default='booked')
+    # Place in the seller's queue, see bookings.queue.
+    ticket = models.IntegerField(null=True, editable=False)
+    # Set once a paid booking has been added to product popularity.
+    scored = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], condition=models.Q(scored=False), name='booking_unscored_idx'),
+            # Queue position, active booking and next in line of a seller.
+            models.Index(fields=['seller', 'status', 'started_time', 'booked_time'], name='booking_seller_queue_idx'),
+            models.Index(fields=['seller', 'status', 'booked_time'], name='booking_seller_history_idx'),
+            models.Index(fields=['user', 'status', 'booked_time'], name='booking_user_history_idx'),
+            models.Index(fields=['table', 'reserved_time', 'status'], name='booking_table_idx'),
+            # Next booking to start, and the waiting ones ahead of a booking once tickets were skipped.
+            models.Index(fields=['seller', 'status', 'ticket'], name='booking_ticket_idx'),
+            # Started bookings of every seller, swept by check_booking_status.
+            models.Index(fields=['status', 'started_time'], name='booking_started_idx'),
+        ]
 
     def __str__(self):
         if self.table:
@@ -73,4 +91,9 @@ class Review(models.Model):
     # note = models.TextField(null=True, blank=True)
 
     def __str__(self):
-        return "{0}->{1}".format(self.user.full_name, self.seller.name)
\ No newline at end of file
+        return "{0}->{1}".format(self.user.full_name, self.seller.name)
+
+    def save(self, *args, **kwargs):
+        # Keeps the seller rating aggregate updated by post_save in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
@@ -0,0 +1,210 @@
+import logging
+from datetime import datetime, timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+
+from bookings.models import Booking
+from bookings import events
+from core.celery import app
+from services.models import Seller
+
+
+logger = logging.getLogger(__name__)
+
+EXPIRE_TASK = 'services.tasks.expire_bookings'
+CHUNK_SIZE = 500    # sellers expired per transaction
+
+
+# Every booking of a seller takes the seller's next ticket when it's created, and tickets are never
+# reused. The waiting bookings hold the tickets after the one being served, except those left by
+# waiting bookings that were canceled or deleted, counted in skipped_tickets until the queue moves
+# past them. Without such gaps a queue position is the difference of two integers. Every transition
+# locks the seller row first, which puts concurrent bookings of one seller in a strict order and
+# keeps the counters in step with the bookings. A booking that starts schedules its own expiry,
+# check_booking_status only sweeps up what those tasks missed.
+
+
+def lock_seller(seller_id, **changes):
+    """
+    Applies changes to the counters of a seller and reads them back. Writing first takes the row
+    lock on PostgreSQL and the database write lock on SQLite, where select_for_update() does
+    nothing and transactions that read before writing fail with "database is locked".
+    """
+    Seller.objects.filter(pk=seller_id).update(**changes)
+    return Seller.objects.only('wait_time', *Seller.QUEUE_FIELDS).get(pk=seller_id)
+
+
+def enqueue(seller, **kwargs):
+    """Creates a booking at the end of the seller's queue, started right away if the queue was empty."""
+    with transaction.atomic():
+        seller = lock_seller(seller.pk, next_ticket=F('next_ticket') + 1, active_bookings=F('active_bookings') + 1)
+        if seller.active_bookings == 1:
+            kwargs['started_time'] = datetime.now()
+            Seller.objects.filter(pk=seller.pk).update(
+                serving_ticket=seller.next_ticket, serving_started_time=kwargs['started_time'], skipped_tickets=0)
+            schedule_expiry(seller.pk, kwargs['started_time'] + timedelta(minutes=seller.wait_time))
+        return Booking.objects.create(seller=seller, ticket=seller.next_ticket, **kwargs)
+
+
+def finish(booking, status):
+    """
+    Takes a booking out of the queue as paid, expired or canceled. Returns False if the
+    booking had left the queue already, e.g. paid while the expiry sweep ran.
+    """
+    now = datetime.now()
+    with transaction.atomic():
+        seller = lock_seller(booking.seller_id, active_bookings=F('active_bookings') - 1)
+        booking.refresh_from_db(fields=['status', 'started_time', 'ticket'])
+        if booking.status != 'booked':
+            transaction.set_rollback(True)
+            return False
+
+        # booked_time records the last change, update() skips auto_now.
+        Booking.objects.filter(pk=booking.pk).update(status=status, booked_time=now)
+        leave(seller, booking, now)
+
+    booking.status, booking.booked_time = status, now
+    return True
+
+
+def remove(booking):
+    """
+    Takes a deleted booking out of the queue, e.g. one deleted with its order or user, which
+    never went through finish(). Nothing to do if the seller is being deleted too.
+    """
+    if booking.status != 'booked':
+        return
+    with transaction.atomic():
+        try:
+            seller = lock_seller(booking.seller_id, active_bookings=F('active_bookings') - 1)
+        except Seller.DoesNotExist:
+            return
+        leave(seller, booking, datetime.now())
+
+
+def leave(seller, booking, now):
+    """
+    Moves the queue of a locked seller once a booking has left it. The booking being served lets
+    the first waiting ticket start, a waiting one leaves a gap the queue skips later.
+    """
+    if booking.ticket != seller.serving_ticket:
+        values = {'skipped_tickets': seller.skipped_tickets + 1}
+    elif seller.active_bookings:
+        ticket = seller.serving_ticket + 1
+        if seller.skipped_tickets:
+            ticket = Booking.objects.filter(seller=seller, status='booked', ticket__gt=seller.serving_ticket).order_by(
+                'ticket').values_list('ticket', flat=True)[0]
+        Booking.objects.filter(seller=seller, status='booked', ticket=ticket).update(started_time=now, booked_time=now)
+        values = {
+            'serving_ticket': ticket, 'serving_started_time': now,
+            'skipped_tickets': seller.skipped_tickets - (ticket - seller.serving_ticket - 1),
+        }
+        schedule_expiry(seller.pk, now + timedelta(minutes=seller.wait_time))
+    else:
+        values = {'serving_started_time': None, 'skipped_tickets': 0}
+    Seller.objects.filter(pk=seller.pk).update(**values)
+
+    transaction.on_commit(lambda: events.publish(seller.pk))
+
+
+def schedule_expiry(seller_id, deadline):
+    """
+    Sends the expiry task of the booking a seller just started, to run at its deadline once the
+    transaction commits. A task that can't be sent, runs early or finds the booking gone is
+    harmless, the sweep expires what is left.
+    """
+    def send():
+        try:
+            app.send_task(EXPIRE_TASK, args=[[seller_id]], eta=deadline, retry=False)
+        except Exception as error:
+            logger.warning('Scheduling the expiry of seller %s failed, left to the sweep: %s', seller_id, error)
+
+    transaction.on_commit(send)
+
+
+def overdue_sellers(now, seller_ids=None):
+    """Sellers whose booking being served is past their wait time, one indexed range per wait time."""
+    sellers = Seller.objects.filter(serving_started_time__isnull=False).order_by()
+    if seller_ids is not None:
+        sellers = sellers.filter(pk__in=seller_ids)
+    overdue = []
+    for wait_time in list(sellers.values_list('wait_time', flat=True).distinct()):
+        overdue += sellers.filter(
+            wait_time=wait_time, serving_started_time__lte=now - timedelta(minutes=wait_time)
+        ).values_list('pk', flat=True)
+    return overdue
+
+
+def expire_overdue(seller_ids=None, now=None):
+    """
+    Expires the overdue booking of every seller, or of the given ones, and starts their next
+    tickets. Returns the number of bookings expired.
+    """
+    now = now or datetime.now()
+    candidates = overdue_sellers(now, seller_ids)
+    expired = 0
+    for start in range(0, len(candidates), CHUNK_SIZE):
+        expired += expire_sellers(candidates[start:start + CHUNK_SIZE], now)
+    return expired
+
+
+def expire_sellers(seller_ids, now):
+    """
+    Bulk version of finish(booking, 'expired') for the served bookings of many sellers, with
+    the same number of queries however many there are. Deadlines are checked again under the
+    lock, so overlapping sweeps, expiry tasks and payments never expire a booking twice.
+    """
+    with transaction.atomic():
+        # A write that changes nothing, to take the locks like lock_seller().
+        Seller.objects.filter(pk__in=seller_ids).update(next_ticket=F('next_ticket'))
+        sellers = Seller.objects.filter(pk__in=seller_ids, serving_started_time__isnull=False).values_list(
+            'pk', 'wait_time', 'active_bookings', 'serving_started_time')
+        overdue = [seller for seller in sellers if seller[3] <= now - timedelta(minutes=seller[1])]
+        if not overdue:
+            return 0
+        expired = [pk for pk, wait_time, active, started in overdue]
+        advancing = {pk: wait_time for pk, wait_time, active, started in overdue if active > 1}
+
+        Booking.objects.filter(seller__in=expired, status='booked', started_time__isnull=False).update(
+            status='expired', booked_time=now)
+        # The first waiting ticket, past the gaps of canceled ones.
+        next_ticket = Subquery(Booking.objects.filter(
+            seller=OuterRef('pk'), status='booked', ticket__gt=OuterRef('serving_ticket')
+        ).order_by('ticket').values('ticket')[:1])
+        Seller.objects.filter(pk__in=advancing).update(
+            skipped_tickets=F('skipped_tickets') - (next_ticket - F('serving_ticket') - 1), serving_ticket=next_ticket,
+            serving_started_time=now, active_bookings=F('active_bookings') - 1)
+        Seller.objects.filter(pk__in=set(expired) - set(advancing)).update(
+            serving_started_time=None, active_bookings=F('active_bookings') - 1, skipped_tickets=0)
+        serving_ticket = Subquery(Seller.objects.filter(pk=OuterRef('seller')).values('serving_ticket')[:1])
+        Booking.objects.filter(seller__in=advancing, status='booked', ticket=serving_ticket).update(
+            started_time=now, booked_time=now)
+
+        for pk in expired:
+            transaction.on_commit(partial(events.publish, pk))
+        for pk, wait_time in advancing.items():
+            schedule_expiry(pk, now + timedelta(minutes=wait_time))
+    return len(expired)
+
+
+def position(booking, seller, now=None):
+    """
+    (people ahead, seconds to wait) of a booking, from the counters of its seller alone unless
+    canceled tickets left gaps in the queue, which an indexed count of the waiting ones skips.
+    """
+    if booking.status != 'booked':
+        return 0, 0
+
+    wait_time = seller.wait_time * 60
+    people = 0 if booking.started_time else booking.ticket - seller.serving_ticket - 1
+    if people and seller.skipped_tickets:
+        people = Booking.objects.filter(
+            seller_id=booking.seller_id, status='booked', ticket__gt=seller.serving_ticket, ticket__lt=booking.ticket
+        ).count()
+    seconds = people * wait_time
+    if seller.serving_started_time:
+        elapsed = ((now or datetime.now()) - seller.serving_started_time).total_seconds()
+        seconds += max(wait_time - int(elapsed), 0)
+    return people, seconds
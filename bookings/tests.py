@@ -0,0 +1,503 @@
+import json
+import re
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from core.testing import FixturesMixin, run_on_commit
+from bookings.models import Booking, Order, OrderItem
+from bookings import events, queue
+from core.asgi import application
+from core.celery import app
+from services.models import Seller
+from services.tasks import check_booking_status
+from variants.models import Table
+
+
+FULL_SCAN_RE = re.compile(r'\bSCAN (TABLE )?bookings_booking\b')
+# Composite booking indexes are named booking_*, the single column foreign key ones bookings_booking_*.
+INDEX_RE = re.compile(r'\bbookings_booking USING (?:COVERING )?INDEX (\w+)')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax.')
+class BookingQueryPlanTests(FixturesMixin, TestCase):
+    """
+    Runs the booking endpoints and tasks, then explains every select and update they sent to the
+    bookings table, so a change that drops or bypasses an index fails here instead of in production.
+    """
+    def setUp(self):
+        super().setUp()
+        service = self.create_service()
+        self.seller = self.create_seller(service, 'barber')
+        self.restaurant = self.create_seller(service, 'restaurant')
+        self.table = Table.objects.create(seller=self.restaurant, row=1, col=1, seats=4)
+        self.haircut = self.create_product(self.seller, None, 'haircut', price=10)
+        self.dinner = self.create_product(self.restaurant, None, 'dinner', price=30)
+        self.users = [self.create_user('user{0}@example.com'.format(i)) for i in range(3)]
+
+    def book(self, user, **data):
+        order = Order.objects.create(user=user, seller=self.table.seller if 'table' in data else self.seller)
+        OrderItem.objects.create(order=order, product=self.dinner if 'table' in data else self.haircut)
+        data.setdefault('seller', None if 'table' in data else self.seller.slug)
+        response = self.api_client(user).post('/api/v1/booking/', {k: v for k, v in data.items() if v is not None}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return Booking.objects.get(pk=response.json()['id'])
+
+    def assertIndexed(self, queries):
+        plans = []
+        for query in queries:
+            sql = query['sql']
+            if 'bookings_booking' not in sql or not sql.lstrip().upper().startswith(('SELECT', 'UPDATE')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+            plans.append(plan)
+            self.assertIsNone(FULL_SCAN_RE.search(plan), 'Full scan of bookings_booking:\n{0}\n{1}'.format(sql, plan))
+            for index in INDEX_RE.findall(plan):
+                self.assertTrue(index.startswith('booking_'), 'No composite index used:\n{0}\n{1}'.format(sql, plan))
+        self.assertTrue(plans, 'No booking queries were captured.')
+
+    def test_booking_a_seller(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.book(self.users[0])
+            self.book(self.users[1])
+        self.assertIndexed(queries)
+
+    def test_booking_a_table(self):
+        reserved_time = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d %H:%M')
+        with CaptureQueriesContext(connection) as queries:
+            self.book(self.users[0], table=self.table.pk, reserved_time=reserved_time, guests=2)
+            response = self.api_client(self.users[1]).post(
+                '/api/v1/booking/', {'table': self.table.pk, 'reserved_time': reserved_time, 'guests': 2}, format='json',
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIndexed(queries)
+
+    def test_queue_position(self):
+        self.book(self.users[0])
+        waiting = self.book(self.users[1])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api_client(self.users[1]).get('/api/v1/booking/{0}/queue/'.format(waiting.pk))
+        self.assertEqual(response.json()['people'], 0)
+        self.assertIndexed(queries)
+
+    def test_paying_starts_the_next_booking(self):
+        active = self.book(self.users[0])
+        waiting = self.book(self.users[1])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api_client(self.users[0]).post('/api/v1/booking/pay/', {'id': active.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        waiting.refresh_from_db()
+        self.assertIsNotNone(waiting.started_time)
+        self.assertIndexed(queries)
+
+    def test_booking_history(self):
+        self.book(self.users[0])
+        client = self.api_client(self.users[0])
+        with CaptureQueriesContext(connection) as queries:
+            client.get('/api/v1/booking/active/list/')
+            client.get('/api/v1/booking/previous/list/')
+        self.assertIndexed(queries)
+
+    def test_expiring_started_bookings(self):
+        active = self.book(self.users[0])
+        waiting = self.book(self.users[1])
+        started_time = datetime.now() - timedelta(hours=2)
+        Booking.objects.filter(pk=active.pk).update(started_time=started_time)
+        Seller.objects.filter(pk=self.seller.pk).update(serving_started_time=started_time)
+        with CaptureQueriesContext(connection) as queries:
+            check_booking_status()
+        self.assertEqual(Booking.objects.get(pk=active.pk).status, 'expired')
+        self.assertIsNotNone(Booking.objects.get(pk=waiting.pk).started_time)
+        self.assertIndexed(queries)
+
+    def test_canceling_a_waiting_booking(self):
+        self.book(self.users[0])
+        waiting = self.book(self.users[1])
+        self.book(self.users[2])
+        with CaptureQueriesContext(connection) as queries:
+            queue.finish(waiting, 'canceled')
+        self.assertIndexed(queries)
+
+
+class BookingQueueTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = self.create_seller(self.create_service(), 'barber', wait_time=10)
+        self.haircut = self.create_product(self.seller, None, 'haircut', price=10)
+        self.users = [self.create_user('user{0}@example.com'.format(i)) for i in range(4)]
+
+    def enqueue(self, user):
+        order = Order.objects.create(user=user, seller=self.seller, complete=True)
+        OrderItem.objects.create(order=order, product=self.haircut)
+        return queue.enqueue(self.seller, user=user, order=order)
+
+    def counters(self):
+        return Seller.objects.values_list(*Seller.QUEUE_FIELDS[:3]).get(pk=self.seller.pk)
+
+    def positions(self, bookings):
+        seller = Seller.objects.get(pk=self.seller.pk)
+        return [queue.position(Booking.objects.get(pk=booking.pk), seller)[0] for booking in bookings]
+
+    def test_tickets(self):
+        bookings = [self.enqueue(user) for user in self.users]
+        self.assertEqual([booking.ticket for booking in bookings], [1, 2, 3, 4])
+        self.assertIsNotNone(bookings[0].started_time)
+        self.assertEqual([booking.started_time for booking in bookings[1:]], [None] * 3)
+        self.assertEqual(self.counters(), (4, 1, 4))
+        # People waiting ahead, the time left of the started booking is added to the wait.
+        self.assertEqual(self.positions(bookings), [0, 0, 1, 2])
+
+        seller = Seller.objects.get(pk=self.seller.pk)
+        people, seconds = queue.position(bookings[2], seller, now=seller.serving_started_time)
+        self.assertEqual((people, seconds), (1, 2 * 10 * 60))
+
+    def test_finishing_starts_the_next_ticket(self):
+        bookings = [self.enqueue(user) for user in self.users[:3]]
+        self.assertTrue(queue.finish(bookings[0], 'paid'))
+        self.assertFalse(queue.finish(bookings[0], 'expired'))
+
+        self.assertEqual(Booking.objects.get(pk=bookings[0].pk).status, 'paid')
+        self.assertIsNotNone(Booking.objects.get(pk=bookings[1].pk).started_time)
+        self.assertEqual(self.counters(), (3, 2, 2))
+        self.assertEqual(self.positions(bookings), [0, 0, 0])
+
+    def test_canceling_a_waiting_booking_skips_its_ticket(self):
+        bookings = [self.enqueue(user) for user in self.users[:3]]
+        # The same statements however long the queue, none for the bookings behind.
+        with self.assertNumQueries(7):
+            queue.finish(bookings[1], 'canceled')
+        later = self.enqueue(self.users[3])
+
+        # Tickets are never renumbered or reused, the gap is counted instead.
+        self.assertEqual(Booking.objects.get(pk=bookings[2].pk).ticket, 3)
+        self.assertEqual(later.ticket, 4)
+        self.assertEqual(self.counters(), (4, 1, 3))
+        self.assertEqual(Seller.objects.get(pk=self.seller.pk).skipped_tickets, 1)
+        self.assertEqual(self.positions([bookings[2], later]), [0, 1])
+
+        # Serving moves past the gap.
+        queue.finish(bookings[0], 'paid')
+        self.assertIsNotNone(Booking.objects.get(pk=bookings[2].pk).started_time)
+        self.assertEqual(self.counters(), (4, 3, 2))
+        self.assertEqual(Seller.objects.get(pk=self.seller.pk).skipped_tickets, 0)
+        self.assertEqual(self.positions([bookings[2], later]), [0, 0])
+
+    def test_deleted_bookings_leave_the_queue(self):
+        bookings = [self.enqueue(user) for user in self.users[:3]]
+        bookings[1].order.delete()
+        self.assertEqual(self.counters(), (3, 1, 2))
+        self.assertEqual(self.positions([bookings[2]]), [0])
+
+        self.users[0].delete()
+        self.assertIsNotNone(Booking.objects.get(pk=bookings[2].pk).started_time)
+        self.assertEqual(self.counters(), (3, 3, 1))
+        self.assertEqual(Seller.objects.get(pk=self.seller.pk).skipped_tickets, 0)
+
+    def test_empty_queue_starts_the_next_booking_right_away(self):
+        first = self.enqueue(self.users[0])
+        queue.finish(first, 'expired')
+        self.assertEqual(self.counters(), (1, 1, 0))
+        self.assertIsNone(Seller.objects.get(pk=self.seller.pk).serving_started_time)
+
+        second = self.enqueue(self.users[1])
+        self.assertEqual(second.ticket, 2)
+        self.assertIsNotNone(second.started_time)
+        self.assertEqual(self.counters(), (2, 2, 1))
+
+    def test_saving_a_stale_seller_keeps_the_counters(self):
+        stale = Seller.objects.get(pk=self.seller.pk)
+        self.enqueue(self.users[0])
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assertEqual(Seller.objects.get(pk=self.seller.pk).name, 'Renamed')
+
+    def test_position_counts_nothing(self):
+        self.enqueue(self.users[0])
+        self.enqueue(self.users[1])
+        waiting = self.enqueue(self.users[2])
+        client = self.api_client(self.users[2])
+        with self.assertNumQueries(1):
+            response = client.get('/api/v1/booking/{0}/queue/'.format(waiting.pk))
+        self.assertEqual(response.json()['people'], 1)
+
+
+@override_settings(QUEUE_EVENTS_REDIS_URL=None)
+@run_on_commit()
+class BookingExpiryTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.create_service()
+        self.now = datetime.now()
+        send_task = mock.patch.object(app, 'send_task')
+        self.send_task = send_task.start()
+        self.addCleanup(send_task.stop)
+
+    def queue(self, name, wait_time, people, minutes_ago=None):
+        """Seller with people booked, the first started minutes_ago or just now."""
+        seller = self.create_seller(self.service, name, wait_time=wait_time)
+        bookings = []
+        for i in range(people):
+            user = self.create_user('{0}{1}@example.com'.format(name, i))
+            bookings.append(queue.enqueue(seller, user=user, order=Order.objects.create(user=user, seller=seller, complete=True)))
+        if minutes_ago is not None:
+            started_time = self.now - timedelta(minutes=minutes_ago)
+            Booking.objects.filter(pk=bookings[0].pk).update(started_time=started_time)
+            Seller.objects.filter(pk=seller.pk).update(serving_started_time=started_time)
+        return seller, bookings
+
+    def statuses(self, bookings):
+        return [(booking.status, booking.started_time is not None) for booking in Booking.objects.filter(pk__in=[b.pk for b in bookings]).order_by('ticket')]
+
+    def test_starting_a_booking_schedules_its_expiry(self):
+        seller, bookings = self.queue('barber', 10, 2)
+        started_time = Booking.objects.get(pk=bookings[0].pk).started_time
+        self.send_task.assert_called_once_with(
+            queue.EXPIRE_TASK, args=[[seller.pk]], eta=started_time + timedelta(minutes=10), retry=False)
+
+        self.send_task.reset_mock()
+        queue.finish(bookings[0], 'paid')
+        started_time = Booking.objects.get(pk=bookings[1].pk).started_time
+        self.send_task.assert_called_once_with(
+            queue.EXPIRE_TASK, args=[[seller.pk]], eta=started_time + timedelta(minutes=10), retry=False)
+
+    def test_broker_errors_are_left_to_the_sweep(self):
+        self.send_task.side_effect = ConnectionError('broker down')
+        with self.assertLogs('bookings.queue', 'WARNING'):
+            seller, bookings = self.queue('barber', 10, 1)
+        self.assertEqual(Booking.objects.get(pk=bookings[0].pk).status, 'booked')
+
+    def test_expire_overdue(self):
+        busy, busy_bookings = self.queue('busy', 10, 3, 11)
+        idle, idle_bookings = self.queue('idle', 30, 1, 31)
+        fresh, fresh_bookings = self.queue('fresh', 10, 2, 5)
+        self.send_task.reset_mock()
+
+        self.assertEqual(queue.expire_overdue(now=self.now), 2)
+        self.assertEqual(self.statuses(busy_bookings), [('expired', True), ('booked', True), ('booked', False)])
+        self.assertEqual(self.statuses(idle_bookings), [('expired', True)])
+        self.assertEqual(self.statuses(fresh_bookings), [('booked', True), ('booked', False)])
+
+        counters = dict((pk, values) for pk, *values in Seller.objects.values_list('pk', *Seller.QUEUE_FIELDS))
+        self.assertEqual(counters[busy.pk], [3, 2, 2, self.now, 0])
+        self.assertEqual(counters[idle.pk], [1, 1, 0, None, 0])
+        self.assertEqual(counters[fresh.pk][:3], [2, 1, 2])
+        self.send_task.assert_called_once_with(
+            queue.EXPIRE_TASK, args=[[busy.pk]], eta=self.now + timedelta(minutes=10), retry=False)
+
+        # Overlapping sweeps and the expiry tasks of bookings already gone find nothing left.
+        self.assertEqual(queue.expire_overdue(now=self.now), 0)
+        self.assertEqual(queue.expire_overdue([busy.pk, idle.pk], now=self.now), 0)
+
+    def test_expiry_skips_canceled_tickets(self):
+        seller, bookings = self.queue('barber', 10, 4, 11)
+        queue.finish(bookings[1], 'canceled')
+        queue.finish(bookings[2], 'canceled')
+        self.assertEqual(queue.expire_overdue(now=self.now), 1)
+        self.assertEqual(Booking.objects.get(pk=bookings[3].pk).started_time, self.now)
+        self.assertEqual(
+            Seller.objects.values_list(*Seller.QUEUE_FIELDS).get(pk=seller.pk), (4, 4, 1, self.now, 0))
+
+    def test_stale_candidates_are_checked_again(self):
+        seller, bookings = self.queue('barber', 10, 2, 11)
+        # Paid between the search for overdue sellers and the lock.
+        queue.finish(bookings[0], 'paid')
+        self.assertEqual(queue.expire_sellers([seller.pk], self.now), 0)
+        self.assertEqual(self.statuses(bookings), [('paid', True), ('booked', True)])
+
+    def test_queries_dont_grow_with_the_sellers(self):
+        for i in range(2):
+            self.queue('first{0}'.format(i), 10, 2, 11)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(queue.expire_overdue(now=self.now), 2)
+        for i in range(6):
+            self.queue('second{0}'.format(i), 10, 2, 11)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(queue.expire_overdue(now=self.now), 6)
+        self.assertEqual(len(few), len(many))
+
+
+@override_settings(QUEUE_EVENTS_REDIS_URL=None, QUEUE_EVENTS_HEARTBEAT=0.05, QUEUE_EVENTS_LONG_POLL=0.3)
+@run_on_commit()
+@mock.patch.object(app, 'send_task', mock.Mock())
+# Closing the connection would end the test transaction.
+@mock.patch('bookings.events.close_old_connections', lambda: None)
+class QueueEventsTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = self.create_seller(self.create_service(), 'barber', wait_time=10)
+        self.haircut = self.create_product(self.seller, None, 'haircut', price=10)
+        self.users = [self.create_user('user{0}@example.com'.format(i)) for i in range(3)]
+        self.bookings = []
+        for user in self.users:
+            order = Order.objects.create(user=user, seller=self.seller, complete=True)
+            self.bookings.append(queue.enqueue(self.seller, user=user, order=order))
+        self.keys = {user: Token.objects.create(user=user).key for user in self.users}
+
+    def request(self, booking, user, accept='text/event-stream', query=''):
+        key = self.keys[user]
+        return ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': '/api/v1/booking/{0}/queue/events/'.format(booking.pk),
+            'query_string': query.encode(), 'headers': [(b'accept', accept.encode()), (b'authorization', b'Token ' + key.encode())],
+        })
+
+    async def events(self, communicator, count):
+        found = []
+        while len(found) < count:
+            body = (await communicator.receive_output(1)).get('body', b'')
+            if body.startswith(b'data: '):
+                found.append(json.loads(body[6:]))
+        return found
+
+    async def response(self, communicator):
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(1)
+        body = await communicator.receive_output(1)
+        return start['status'], json.loads(body['body'])
+
+    def test_stream_pushes_when_the_queue_moves(self):
+        async def run():
+            communicator = self.request(self.bookings[2], self.users[2])
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(1)
+            self.assertEqual((start['status'], dict(start['headers'])[b'content-type']), (200, b'text/event-stream'))
+            [event] = await self.events(communicator, 1)
+            self.assertEqual((event['people'], event['status']), (1, 'booked'))
+
+            # Idle streams only get keepalive comments.
+            self.assertEqual((await communicator.receive_output(1))['body'], b': keepalive\n\n')
+
+            await sync_to_async(queue.finish)(self.bookings[0], 'paid')
+            [event] = await self.events(communicator, 1)
+            self.assertEqual(event['people'], 0)
+
+            await sync_to_async(queue.finish)(self.bookings[1], 'paid')
+            await sync_to_async(queue.finish)(self.bookings[2], 'paid')
+            events_left = await self.events(communicator, 2)
+            self.assertEqual(events_left[-1]['status'], 'paid')
+            self.assertEqual((await communicator.receive_output(1))['body'], b'')
+            await communicator.wait(1)
+
+        async_to_sync(run)()
+        self.assertEqual(events.listeners, {})
+
+    def test_one_load_per_move(self):
+        loads = mock.Mock(wraps=events.load_bookings)
+
+        async def run():
+            communicators = [self.request(booking, user) for booking, user in zip(self.bookings[1:], self.users[1:])]
+            for communicator in communicators:
+                await communicator.send_input({'type': 'http.request'})
+                await self.events(communicator, 1)
+            self.assertEqual(loads.call_count, 2)
+
+            await sync_to_async(queue.finish)(self.bookings[0], 'paid')
+            people = [(await self.events(communicator, 1))[0]['people'] for communicator in communicators]
+            self.assertEqual(people, [0, 0])
+            self.assertEqual(loads.call_count, 3)
+            self.assertEqual(loads.call_args, mock.call({self.bookings[1].pk, self.bookings[2].pk}))
+            for communicator in communicators:
+                await communicator.send_input({'type': 'http.disconnect'})
+                await communicator.wait(1)
+
+        with mock.patch.object(events, 'load_bookings', loads):
+            async_to_sync(run)()
+        self.assertEqual(events.listeners, {})
+
+    def test_closes_old_connections(self):
+        async def run():
+            return await self.response(self.request(self.bookings[0], self.users[0], 'application/json'))
+
+        with mock.patch('bookings.events.close_old_connections') as close:
+            self.assertEqual(async_to_sync(run)()[0], 200)
+        # Before and after authorize() and load_bookings().
+        self.assertEqual(close.call_count, 4)
+
+    def test_deleted_booking_closes_the_stream(self):
+        async def run():
+            communicator = self.request(self.bookings[2], self.users[2])
+            await communicator.send_input({'type': 'http.request'})
+            await self.events(communicator, 1)
+            await sync_to_async(self.bookings[2].order.delete)()
+            self.assertEqual((await communicator.receive_output(1))['body'], b'')
+            await communicator.wait(1)
+
+        async_to_sync(run)()
+        self.assertEqual(events.listeners, {})
+
+    def test_resubscribing_reloads_the_streams(self):
+        def lost():
+            yield {'type': 'psubscribe', 'channel': b'booking-queue:*'}
+            raise ConnectionError('redis restarted')
+
+        class Stop(BaseException):
+            pass
+
+        pubsub = mock.Mock()
+        pubsub.listen.side_effect = [lost(), iter([
+            {'type': 'psubscribe', 'channel': b'booking-queue:*'},
+            {'type': 'pmessage', 'channel': b'booking-queue:7'},
+        ]), ConnectionError('redis down')]
+        with mock.patch('redis.Redis.from_url') as from_url, mock.patch.object(events, 'dispatch') as dispatch, \
+                mock.patch.dict(events.listeners, {self.seller.pk: {}}), \
+                mock.patch('bookings.events.time.sleep', side_effect=[None, Stop]), \
+                self.assertLogs('bookings.events', 'ERROR'), self.assertRaises(Stop):
+            from_url.return_value.pubsub.return_value = pubsub
+            events.subscribe()
+        # Only the second subscription reloads, the moves missed in between are unknown.
+        self.assertEqual(dispatch.call_args_list, [mock.call(self.seller.pk), mock.call(7)])
+
+    def test_disconnect(self):
+        async def run():
+            communicator = self.request(self.bookings[1], self.users[1])
+            await communicator.send_input({'type': 'http.request'})
+            await self.events(communicator, 1)
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(1)
+
+        async_to_sync(run)()
+        self.assertEqual(events.listeners, {})
+
+    def test_long_poll(self):
+        async def run():
+            # Nothing known yet, answered right away.
+            status, state = await self.response(self.request(self.bookings[2], self.users[2], 'application/json'))
+            self.assertEqual((status, state['people']), (200, 1))
+
+            # Unchanged until the poll times out.
+            status, state = await self.response(
+                self.request(self.bookings[2], self.users[2], 'application/json', 'people=1&status=booked'))
+            self.assertEqual(state['people'], 1)
+
+            communicator = self.request(self.bookings[2], self.users[2], 'application/json', 'people=1&status=booked')
+            await communicator.send_input({'type': 'http.request'})
+            self.assertTrue(await communicator.receive_nothing(0.1))
+            await sync_to_async(queue.finish)(self.bookings[0], 'paid')
+            await communicator.receive_output(1)
+            self.assertEqual(json.loads((await communicator.receive_output(1))['body'])['people'], 0)
+
+        async_to_sync(run)()
+
+    @override_settings(QUEUE_EVENTS_REDIS_URL='redis://127.0.0.1:1/0')
+    @mock.patch('bookings.events.dispatch')
+    def test_publish_without_redis(self, dispatch):
+        self.addCleanup(setattr, events, 'client', None)
+        with self.assertLogs('bookings.events', 'WARNING'):
+            queue.finish(self.bookings[0], 'paid')
+        dispatch.assert_called_once_with(self.seller.pk)
+
+    def test_other_users_booking(self):
+        async def run():
+            return await self.response(self.request(self.bookings[0], self.users[1], 'application/json'))
+
+        self.assertEqual(async_to_sync(run)()[0], 403)
@@ -1,5 +1,3 @@
-from datetime import datetime
-
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.views.generic.base import View
@@ -8,6 +6,7 @@ from django.views.generic.list import ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 
 from bookings.models import Booking, Review, Order
+from bookings import queue
 from bookings.filters import ReviewFilter, BookingFilter, BookingHistoryFilter, OrderFilter
 from users.views import AdminRequiredMixin
 from core.utils import PAGINATE_BY
@@ -89,15 +88,7 @@ class BookingCancelView(AdminRequiredMixin, View):
 
     def post(self, request, **kwargs):
         booking = self.get_object(**kwargs)
-        if booking.started_time:
-            next_booking_qs = Booking.objects.filter(status='booked', seller=booking.seller).exclude(id=booking.id)
-            if next_booking_qs.exists():
-                next_booking = next_booking_qs.latest('booked_time')
-                next_booking.started_time = datetime.now()
-                next_booking.save()
-
-        booking.status = 'canceled'
-        booking.save()
+        queue.finish(booking, 'canceled')
         return redirect('booking-list')
     
     def get_object(self, **kwargs):
@@ -8,9 +8,24 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up.
+from bookings.events import queue_events
+
+QUEUE_EVENTS_RE = re.compile(r'^/api/v1/booking/(\d+)/queue/events/$')
+
+
+async def application(scope, receive, send):
+    # Streams stay open for minutes, so they are served here rather than by a Django view.
+    if scope['type'] == 'http':
+        match = QUEUE_EVENTS_RE.match(scope['path'])
+        if match:
+            return await queue_events(scope, receive, send, int(match.group(1)))
+    return await django_application(scope, receive, send)
@@ -0,0 +1,62 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+VERSION_KEY = 'version:{0}'
+RESPONSE_KEY = 'response:{0}'
+NAVIGATION_KEY = 'navigation:{0}'                     # navigation version
+
+# Version scopes of the catalog, bumped from services.signals.
+SERVICES_SCOPE = 'services'
+SERVICE_SELLERS_SCOPE = 'service-sellers:{0}'         # service slug
+SERVICE_CATEGORIES_SCOPE = 'service-categories:{0}'   # service slug
+SERVICE_PRODUCTS_SCOPE = 'service-products:{0}'       # service slug, covers product browsing
+SELLER_SCOPE = 'seller:{0}'                           # seller slug, covers its products, tables and timeslots
+NAVIGATION_SCOPE = 'navigation'                       # names and slugs of services in the admin navbar
+
+
+def initial_version():
+    # Time based so a counter that got evicted never restarts below a value already used.
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """Current version counter of every scope, creating the missing ones."""
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    """
+    Invalidates everything cached under the given scopes once the current transaction commits.
+    Bumping earlier would let a concurrent request cache the old rows under the new version.
+    """
+    def bump():
+        for scope in set(scopes):
+            key = VERSION_KEY.format(scope)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, initial_version(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def response_fingerprint(request, scopes, variant=()):
+    """
+    Digest identifying a response without rendering it: request, negotiated format and
+    the current versions of the scopes its content depends on.
+    """
+    versions = get_versions(*scopes)
+    parts = [request.get_host(), request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+    parts += ['{0}={1}'.format(scope, version) for scope, version in zip(scopes, versions)]
+    parts += list(variant)
+    return hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
@@ -1,4 +1,15 @@
+from django.core.cache import cache
+
+from core.cache import get_versions, NAVIGATION_SCOPE, NAVIGATION_KEY
 from services.models import Service
 
+
 def services(request):
-    return {"services": Service.objects.all()}
\ No newline at end of file
+    # Rendered into the navbar of every admin page, so it's cached until a service changes.
+    version, = get_versions(NAVIGATION_SCOPE)
+    key = NAVIGATION_KEY.format(version)
+    navigation = cache.get(key)
+    if navigation is None:
+        navigation = list(Service.objects.order_by('pk').values('name', 'slug'))
+        cache.set(key, navigation, timeout=None)
+    return {"services": navigation}
@@ -0,0 +1,122 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from core import nplusone
+
+
+logger = logging.getLogger('profiling')
+
+
+class QueryTimer:
+    """Database execute wrapper adding up the number and duration of queries."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class ProfilingMiddleware:
+    """
+    Times a sampled fraction of requests (PROFILING_SAMPLE_RATE) and the ones of staff members
+    sending the PROFILING_HEADER: total, SQL and render time go to a Server-Timing header and a
+    JSON line on the "profiling" logger. Requests that aren't profiled only cost the check.
+
+    The view segment includes serialization, DRF serializers are evaluated inside the view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = self.profile_reason(request)
+        if reason is None:
+            return self.get_response(request)
+
+        request._profile = profile = {'render': 0.0}
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        timings = {
+            'total': total,
+            'db': timer.duration,
+            'render': profile['render'],
+            'view': total - profile['render'],
+        }
+        response['Server-Timing'] = ', '.join(
+            '{0};dur={1:.1f}{2}'.format(name, duration * 1000, ';desc="{0} queries"'.format(timer.count) if name == 'db' else '')
+            for name, duration in timings.items()
+        )
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': match.route if match else None,
+            'status': response.status_code,
+            'reason': reason,
+            'queries': timer.count,
+            **{'{0}_ms'.format(name): round(duration * 1000, 2) for name, duration in timings.items()},
+        }))
+        return response
+
+    def process_template_response(self, request, response):
+        # Called right before the response is rendered, the callback right after.
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                profile['render'] += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def profile_reason(self, request):
+        if request.META.get(settings.PROFILING_HEADER) == '1' and self.is_staff(request):
+            return 'header'
+        if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return 'sample'
+        return None
+
+    def is_staff(self, request):
+        if request.user.is_authenticated:
+            return request.user.is_staff
+        # API clients authenticate with a token inside the view, which runs later.
+        try:
+            credentials = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return credentials is not None and credentials[0].is_staff
+
+
+class NPlusOneMiddleware:
+    """Reports requests repeating a select NPLUSONE_THRESHOLD times, per NPLUSONE_MODE (off, log or raise)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.NPLUSONE_MODE == 'off':
+            return self.get_response(request)
+        with nplusone.detect('{0} {1}'.format(request.method, request.get_full_path()), settings.NPLUSONE_MODE):
+            return self.get_response(request)
@@ -1,6 +1,55 @@
 from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.cache import cache
+from django.utils.http import parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.cache import RESPONSE_KEY, response_fingerprint
+from core.utils import API_CACHE_TIMEOUT
 
 
 class SuperuserRequiredMixin(UserPassesTestMixin):
     def test_func(self):
-        return self.request.user.is_superuser
\ No newline at end of file
+        return self.request.user.is_superuser
+
+
+class VersionedCacheMixin:
+    """
+    Caches successful GET responses of an API view under its version scopes and tags them
+    with a strong ETag derived from the same versions.
+
+    Views return their scopes from get_cache_scopes(), None skips the cache. Writes bump
+    the scopes (see core.cache.bump_versions), which makes every stale entry unreachable.
+    A matching If-None-Match is answered with 304 before anything is serialized.
+    """
+    cache_timeout = API_CACHE_TIMEOUT
+
+    def get_cache_scopes(self):
+        raise NotImplementedError
+
+    def get_cache_variant(self):
+        """Extra key parts for content that changes without a write, like opening hours."""
+        return ()
+
+    def get(self, request, *args, **kwargs):
+        scopes = self.get_cache_scopes()
+        if scopes is None:
+            return super().get(request, *args, **kwargs)
+
+        fingerprint = response_fingerprint(request, scopes, self.get_cache_variant())
+        etag = '"{0}"'.format(fingerprint)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        key = RESPONSE_KEY.format(fingerprint)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, status=status.HTTP_200_OK, headers={'ETag': etag})
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.cache_timeout)
+            response['ETag'] = etag
+        return response
@@ -0,0 +1,88 @@
+import logging
+import os
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from core.sqlstats import fingerprint
+
+
+logger = logging.getLogger('nplusone')
+
+# Execute wrappers, their frames are never the call site of a query.
+WRAPPERS = ('core/middleware.py', 'core/nplusone.py', 'core/sqlstats.py')
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def call_site():
+    """Innermost frame of project code below the database layer, as path:line in function."""
+    root = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and 'site-packages' not in filename:
+            path = os.path.relpath(filename, root)
+            if path not in WRAPPERS:
+                return '{0}:{1} in {2}'.format(path, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryTracker:
+    """
+    Database execute wrapper counting selects per fingerprint and the call sites they came
+    from. A fingerprint seen threshold times or more is almost always a lazy load in a loop.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            key, normalized = fingerprint(sql)
+            sql_sites = self.statements.setdefault(key, (normalized, Counter()))
+            sql_sites[1][call_site()] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """(count, sql, Counter of call sites) of every statement over the threshold."""
+        return [
+            (sum(sites.values()), sql, sites)
+            for sql, sites in self.statements.values()
+            if sum(sites.values()) >= self.threshold
+        ]
+
+    def report(self, label):
+        lines = ['N+1 queries in {0}:'.format(label)]
+        for count, sql, sites in self.repeated():
+            lines.append('  {0} x {1}'.format(count, sql))
+            lines += ['    from {0} ({1} x)'.format(site, calls) for site, calls in sites.most_common()]
+        return '\n'.join(lines)
+
+    def check(self, mode, label):
+        if mode == 'off' or not self.repeated():
+            return
+        if mode == 'raise':
+            raise NPlusOneError(self.report(label))
+        logger.warning(self.report(label))
+
+
+@contextmanager
+def detect(label='block', mode='raise', threshold=None):
+    """
+    Tracks the selects of every connection inside the block, then raises NPlusOneError
+    (mode 'raise') or logs a warning (mode 'log') if a fingerprint repeated.
+    """
+    tracker = QueryTracker(threshold or settings.NPLUSONE_THRESHOLD)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(tracker))
+        yield tracker
+    tracker.check(mode, label)
@@ -0,0 +1,22 @@
+from rest_framework import pagination
+
+from core.utils import API_PAGE_SIZE, API_MAX_PAGE_SIZE
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination with an opaque cursor, so deep pages cost the same as the first.
+    Clients can ask for ?page_size= up to API_MAX_PAGE_SIZE.
+    """
+    page_size = API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = API_MAX_PAGE_SIZE
+    ordering = 'pk'
+
+
+class BookingCursorPagination(CursorPagination):
+    ordering = ('-booked_time', '-pk')
+
+
+class TimeslotCursorPagination(CursorPagination):
+    ordering = ('start', 'pk')
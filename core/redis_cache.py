@@ -0,0 +1,96 @@
+import pickle
+
+import redis
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+# Increments a counter only if it exists, so an evicted one raises like other backends
+# instead of restarting from 1 below versions already used.
+INCR_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return false
+"""
+
+
+class RedisCache(BaseCache):
+    """
+    Django cache backend on redis, which Django 3.1 doesn't ship. add() and incr() are atomic
+    across processes, so concurrent version bumps are never lost, and redis evicts keys itself
+    under its maxmemory-policy instead of culling. Integers are stored as they are for
+    INCRBY, everything else pickled. OPTIONS are passed on to redis.Redis.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        self.client = redis.Redis.from_url(server, **params.get('OPTIONS', {}))
+        self.incr_script = self.client.register_script(INCR_SCRIPT)
+
+    def key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def expiry(self, timeout):
+        """Seconds to keep a key for, None for ever."""
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else max(int(timeout), 0)
+
+    @staticmethod
+    def encode(value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def decode(value):
+        try:
+            return int(value)
+        except ValueError:
+            return pickle.loads(value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        expiry = self.expiry(timeout)
+        if expiry == 0:
+            return False
+        return bool(self.client.set(self.key(key, version), self.encode(value), ex=expiry, nx=True))
+
+    def get(self, key, default=None, version=None):
+        value = self.client.get(self.key(key, version))
+        return default if value is None else self.decode(value)
+
+    def get_many(self, keys, version=None):
+        keys = {self.key(key, version): key for key in keys}
+        values = self.client.mget(list(keys))
+        return {keys[key]: self.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        expiry = self.expiry(timeout)
+        if expiry == 0:
+            self.delete(key, version)
+        else:
+            self.client.set(self.key(key, version), self.encode(value), ex=expiry)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, expiry = self.key(key, version), self.expiry(timeout)
+        if expiry is None:
+            return bool(self.client.persist(key)) or bool(self.client.exists(key))
+        return bool(self.client.expire(key, expiry))
+
+    def delete(self, key, version=None):
+        return bool(self.client.delete(self.key(key, version)))
+
+    def has_key(self, key, version=None):
+        return bool(self.client.exists(self.key(key, version)))
+
+    def incr(self, key, delta=1, version=None):
+        value = self.incr_script(keys=[self.key(key, version)], args=[delta])
+        if value is None:
+            raise ValueError("Key '{0}' not found".format(key))
+        return value
+
+    def clear(self):
+        # The cache gets a redis database of its own, see CACHES.
+        self.client.flushdb()
@@ -58,6 +58,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.NPlusOneMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -152,6 +154,32 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 # Login URL
 LOGIN_URL = '/user/login'
 
+# Request profiling, see core.middleware.ProfilingMiddleware
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))   # fraction of requests profiled
+PROFILING_HEADER = 'HTTP_X_PROFILE'                                         # staff ask for a profile with X-Profile: 1
+
+# N+1 query detection, see core.nplusone
+NPLUSONE_MODE = os.environ.get('NPLUSONE_MODE', 'off')   # off, log or raise
+NPLUSONE_THRESHOLD = 3                                   # identical selects that make an N+1
+
+# SQL statement statistics, see core.sqlstats
+SQL_STATS_ENABLED = os.environ.get('SQL_STATS_ENABLED') == '1'
+SQL_STATS_DIR = os.environ.get('SQL_STATS_DIR', os.path.join(BASE_DIR, 'sqlstats'))  # one file per process
+SQL_STATS_FLUSH_INTERVAL = 60                                                         # seconds
+SQL_STATS_MAX_STATEMENTS = 5000                                                       # fingerprints kept per process
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'nplusone': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # Rest framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -167,6 +195,14 @@ REST_FRAMEWORK = {
 }
 
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
+
+# Queue position pushes, see bookings.events. Without a redis URL only streams served by the
+# process that changed the queue are notified.
+QUEUE_EVENTS_REDIS_URL = os.environ.get('QUEUE_EVENTS_REDIS_URL', CELERY_BROKER_URL)
+QUEUE_EVENTS_HEARTBEAT = 15     # seconds between keepalive comments of idle streams
+QUEUE_EVENTS_LONG_POLL = 25     # seconds a long poll waits for the queue to move
+QUEUE_EVENTS_RECONNECT = 5      # seconds between redis reconnects
+QUEUE_EVENTS_REDIS_TIMEOUT = 1  # seconds publishing waits for redis, it runs after a request commits
 # CELERY_ACCEPT_CONTENT = ['json']
 
 # CELERY_BEAT_SCHEDULE = {
@@ -182,6 +218,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'services.tasks.check_booking_status',
         'schedule': 60.0,
     },
+    'product_popularity': {
+        'task': 'services.tasks.update_product_popularity',
+        'schedule': 300.0,
+    },
+    'dashboard_snapshot': {
+        'task': 'services.tasks.refresh_dashboard',
+        'schedule': 300.0,
+    },
 }
 
 # CELERY_RESULT_BACKEND = 'django-db'
@@ -195,6 +239,18 @@ CELERY_BEAT_SCHEDULE = {
 #     }
 # }
 
+# API responses are cached under version counters bumped by services.signals, so the cache
+# must be shared by every web and celery process and increment atomically. It takes its own
+# database of the celery redis, cache.clear() flushes it. Give redis a maxmemory with an
+# allkeys-lru policy to evict old responses. Tests use LocMemCache instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'core.redis_cache.RedisCache',
+        'LOCATION': os.environ.get('CACHE_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        'OPTIONS': {'socket_timeout': 1, 'socket_connect_timeout': 1},
+    }
+}
+
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -0,0 +1,152 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from django.db.backends.signals import connection_created
+
+
+# Literals and placeholders become ?, lists of them collapse so that a query with three ids and
+# one with thirty share a fingerprint.
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+IN_LIST_RE = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+VALUES_RE = re.compile(r'(\((?:\?, )*\?\))(?:, \((?:\?, )*\?\))+')
+SPACE_RE = re.compile(r'\s+')
+
+OTHER = 'other'     # fingerprint of statements seen after the table filled up
+
+stats = None        # QueryStats of this process once installed
+
+
+def normalize(sql):
+    sql = SPACE_RE.sub(' ', sql).strip()
+    sql = LITERAL_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return VALUES_RE.sub(r'\1, ...', sql)
+
+
+def fingerprint(sql):
+    """Returns (fingerprint, normalized sql) of a statement."""
+    normalized = normalize(sql)
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+class QueryStats:
+    """
+    Database execute wrapper aggregating calls, total and max time and rows per fingerprint,
+    like pg_stat_statements. Every process keeps its own totals and rewrites them to its own
+    file in directory at most every flush_interval seconds.
+    """
+
+    def __init__(self, directory, flush_interval=60, max_statements=5000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_statements = max_statements
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, '{0}-{1}.json'.format(socket.gethostname(), os.getpid()))
+
+    def reset(self):
+        with self.lock:
+            self.statements = {}
+            self.last_flush = time.monotonic()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # rowcount is -1 for selects on SQLite, PostgreSQL reports the rows returned.
+            self.record(sql, time.perf_counter() - start, max(context['cursor'].rowcount, 0))
+
+    def record(self, sql, duration, rows):
+        key, normalized = fingerprint(sql)
+        with self.lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                if len(self.statements) >= self.max_statements:
+                    key, normalized = OTHER, 'statements seen after the table filled up'
+                entry = self.statements.setdefault(key, {'sql': normalized, 'calls': 0, 'total': 0.0, 'max': 0.0, 'rows': 0})
+            entry['calls'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['rows'] += rows
+            due = time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.monotonic()
+            content = json.dumps(self.statements)
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as output:
+            output.write(content)
+        os.replace(temporary, self.path)
+
+
+def add_wrapper(sender, connection, **kwargs):
+    if stats not in connection.execute_wrappers:
+        connection.execute_wrappers.append(stats)
+
+
+def install(directory, flush_interval=60, max_statements=5000):
+    """Starts collecting statistics of every database connection this process opens."""
+    global stats
+    stats = QueryStats(directory, flush_interval, max_statements)
+    connection_created.connect(add_wrapper)
+    # Forked workers start over instead of counting the parent's statements again.
+    os.register_at_fork(after_in_child=stats.reset)
+    atexit.register(stats.flush)
+
+
+def load(directory):
+    """
+    Totals of every process that flushed to directory, the current one flushed first, as a list
+    of dicts with fingerprint, sql, calls, total, max, mean and rows, times in milliseconds.
+    """
+    if stats is not None and stats.directory == directory:
+        stats.flush()
+
+    merged = {}
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    for name in sorted(names):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(directory, name)) as source:
+            statements = json.load(source)
+        for key, entry in statements.items():
+            total = merged.setdefault(key, {'fingerprint': key, 'sql': entry['sql'], 'calls': 0, 'total': 0.0, 'max': 0.0, 'rows': 0})
+            total['calls'] += entry['calls']
+            total['total'] += entry['total'] * 1000
+            total['max'] = max(total['max'], entry['max'] * 1000)
+            total['rows'] += entry['rows']
+
+    for entry in merged.values():
+        entry['mean'] = entry['total'] / entry['calls']
+    return list(merged.values())
+
+
+ORDERS = ('total', 'mean', 'max', 'calls', 'rows')     # what top() can sort by
+
+
+def top(directory, order='total', limit=20):
+    return sorted(load(directory), key=lambda entry: entry[order], reverse=True)[:limit]
+
+
+def clear(directory):
+    """Forgets the statistics of every process."""
+    if stats is not None:
+        stats.reset()
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(directory, name))
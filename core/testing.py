@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from core import nplusone
+from users.models import User
+from services.models import Service, Seller, Category, Product
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+def run_on_commit():
+    """
+    Runs transaction.on_commit() callbacks right away, for a test class, method or with block.
+    TestCase never commits, so cache version bumps and queue events would never happen.
+    """
+    return mock.patch('django.db.transaction.on_commit', lambda callback: callback())
+
+
+def image_file(name='image.png'):
+    """Small PNG upload, models resize their images on save so they must be real."""
+    content = io.BytesIO()
+    Image.new('RGB', (20, 20)).save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+
+class FixturesMixin:
+    """
+    Runs a TestCase against a temporary MEDIA_ROOT and an empty in-memory cache, with requests
+    failing on N+1 queries, and builds catalog objects with the fields the tests don't care about filled in.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(cls.media_root, 'users'))
+        shutil.copy(os.path.join(settings.BASE_DIR, 'avatar.png'), os.path.join(cls.media_root, 'users'))
+        cls.fixture_settings = override_settings(
+            MEDIA_ROOT=cls.media_root, CACHES=LOCMEM_CACHES, NPLUSONE_MODE='raise')
+        cls.fixture_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.fixture_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def assertNoNPlusOne(self, label='block', threshold=None):
+        """Fails the test if a select repeats inside the with block, e.g. around serializer.data."""
+        return nplusone.detect(label, 'raise', threshold)
+
+    @classmethod
+    def create_user(cls, email='user@example.com', **kwargs):
+        return User.objects.create_user(email, kwargs.pop('full_name', 'Test User'), 'password', **kwargs)
+
+    @classmethod
+    def api_client(cls, user=None):
+        client = APIClient()
+        client.force_authenticate(user or cls.create_user())
+        return client
+
+    @classmethod
+    def create_service(cls, name='Food', **kwargs):
+        return Service.objects.create(name=name, image=image_file(), **kwargs)
+
+    @classmethod
+    def create_category(cls, service, name, **kwargs):
+        return Category.objects.create(service=service, name=name, image=image_file(), **kwargs)
+
+    @classmethod
+    def create_seller(cls, service, slug, **kwargs):
+        kwargs.setdefault('name', slug.title())
+        kwargs.setdefault('address', 'Main Street 1')
+        kwargs.setdefault('phone', '123456')
+        return Seller.objects.create(service=service, slug=slug, image=image_file(), **kwargs)
+
+    @classmethod
+    def create_product(cls, seller, category, slug, **kwargs):
+        kwargs.setdefault('name', slug.title())
+        return Product.objects.create(seller=seller, category=category, slug=slug, image=image_file(), **kwargs)
@@ -0,0 +1,394 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, time as clock, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import hashers
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import nplusone, sqlstats
+from core.context_processors import services as navigation
+from core.redis_cache import RedisCache
+from core.testing import FixturesMixin, run_on_commit
+from services import urls as services_urls
+from users import urls as users_urls
+from users.models import User
+from services.models import Product
+from services.serializers import ProductSerializer, OrderSerializer
+from bookings.models import Booking, Order, OrderItem, Review
+from bookings import queue as booking_queue
+from variants.models import Table, TimeSlot, Variation, ProductVariation
+
+
+# Wall-time budgets are several times the measured timings, as single requests vary between
+# machines and runs. API_BUDGET_TIME_SCALE multiplies them on slower machines.
+TIME_SCALE = float(os.environ.get('API_BUDGET_TIME_SCALE') or 1)
+
+# (route, method, path, data, max queries, max ms) of every API route, measured with a cold
+# response cache. Paths and string data are formatted with the test case as f, so they can
+# point at fixture objects. Read routes come first, routes changing the fixture last.
+# Authentication is forced, so token lookups aren't counted. Password hashing is slow by design.
+BUDGETS = (
+    ('api/v1/services/', 'get', '/api/v1/services/', None, 1, 100),
+    ('api/v1/categories/<slug:slug>/', 'get', '/api/v1/categories/{f.food.slug}/', None, 1, 100),
+    ('api/v1/sellers/<slug:service_slug>/', 'get', '/api/v1/sellers/{f.food.slug}/', None, 1, 100),
+    ('api/v1/sellers/<slug:service_slug>/', 'get', '/api/v1/sellers/{f.food.slug}/?open_now=1', None, 1, 100),
+    ('api/v1/sellers/<slug:service_slug>/nearby/', 'get',
+     '/api/v1/sellers/{f.food.slug}/nearby/?lat=52.52&lng=13.40&radius=10', None, 3, 100),
+    ('api/v1/seller/<slug:seller_slug>/detail/', 'get', '/api/v1/seller/{f.pizzeria.slug}/detail/', None, 6, 100),
+    ('api/v1/<slug:category_slug>/products/popular/', 'get', '/api/v1/{f.pizza.slug}/products/popular/', None, 2, 100),
+    ('api/v1/products/search/', 'post', '/api/v1/products/search/', {'keyword': 'margherita'}, 3, 100),
+    ('api/v1/products/batch/', 'post', '/api/v1/products/batch/',
+     {'slugs': ['{f.margherita.slug}', '{f.cola.slug}', 'missing']}, 4, 100),
+    ('api/v1/products/<slug:service_slug>/browse/', 'get', '/api/v1/products/{f.food.slug}/browse/?category={f.pizza.slug}',
+     None, 2, 100),
+    ('api/v1/product/<slug:product_slug>/detail/', 'get', '/api/v1/product/{f.margherita.slug}/detail/', None, 5, 100),
+    ('api/v1/order/list/', 'get', '/api/v1/order/list/', None, 4, 100),
+    ('api/v1/seller/<slug:slug>/order/', 'get', '/api/v1/seller/{f.pizzeria.slug}/order/', None, 5, 100),
+    ('api/v1/booking/<str:status>/list/', 'get', '/api/v1/booking/active/list/', None, 3, 100),
+    ('api/v1/booking/<str:status>/list/', 'get', '/api/v1/booking/previous/list/', None, 3, 100),
+    ('api/v1/booking/<int:pk>/queue/', 'get', '/api/v1/booking/{f.waiting.pk}/queue/', None, 1, 100),
+    ('api/v1/seller/<slug:seller_slug>/tables/', 'get', '/api/v1/seller/{f.pizzeria.slug}/tables/', None, 5, 100),
+    ('api/v1/seller/<slug:seller_slug>/timeslots/', 'get', '/api/v1/seller/{f.barber.slug}/timeslots/', None, 2, 100),
+    ('api/v1/order/', 'post', '/api/v1/order/',
+     {'slug': '{f.margherita.slug}', 'variations': ['{f.large.pk}']}, 10, 200),
+    ('api/v1/order/increase/', 'post', '/api/v1/order/increase/', {'id': '{f.cart_item.pk}'}, 2, 100),
+    ('api/v1/order/decrease/', 'post', '/api/v1/order/decrease/', {'id': '{f.cart_item.pk}'}, 2, 100),
+    ('api/v1/booking/', 'post', '/api/v1/booking/', {'seller': '{f.barber.slug}'}, 10, 200),
+    ('api/v1/booking/pay/', 'post', '/api/v1/booking/pay/', {'id': '{f.active.pk}'}, 9, 200),
+    ('api/v1/auth/login/', 'post', '/api/v1/auth/login/', {'email': '{f.user.email}', 'password': 'password'}, 2, 1000),
+    ('api/v1/auth/register/', 'post', '/api/v1/auth/register/',
+     {'email': 'new@example.com', 'full_name': 'New User', 'password': 'Correct-Horse-9'}, 3, 1000),
+    ('api/v1/auth/update/', 'post', '/api/v1/auth/update/', {'full_name': 'Renamed', 'password': 'Correct-Horse-9'}, 2, 1000),
+    ('api/v1/auth/reset/', 'post', '/api/v1/auth/reset/', {'email': '{f.other.email}', 'password': 'Correct-Horse-9'}, 3, 1000),
+    ('api/v1/auth/verify/', 'post', '/api/v1/auth/verify/', {'email': '{f.verifying.email}', 'code': '1234'}, 3, 100),
+    ('api/v1/auth/logout/', 'post', '/api/v1/auth/logout/', None, 2, 100),
+)
+
+
+def api_routes(*modules):
+    return {str(pattern.pattern) for module in modules for pattern in module.urlpatterns if str(pattern.pattern).startswith('api/')}
+
+
+def fill(value, case):
+    if isinstance(value, str):
+        return value.format(f=case)
+    if isinstance(value, list):
+        return [fill(item, case) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, case) for key, item in value.items()}
+    return value
+
+
+class APIBudgetTests(FixturesMixin, TestCase):
+    """Query count, and optionally wall-time, budget of every API route against a realistic catalog."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('customer@example.com')
+        cls.other = cls.create_user('other@example.com')
+        cls.verifying = cls.create_user('verifying@example.com', verify_code='1234', new_password=hashers.make_password('x'))
+        Token.objects.create(user=cls.user)
+
+        cls.food = cls.create_service('Food')
+        beauty = cls.create_service('Beauty')
+        categories = [cls.create_category(cls.food, name) for name in ('Pizza', 'Drinks', 'Desserts')]
+        cls.pizza = categories[0]
+        salon = cls.create_category(beauty, 'Hair')
+
+        sellers = []
+        for i in range(8):
+            seller = cls.create_seller(cls.food, 'restaurant-{0}'.format(i), latitude=52.52 + i * 0.01, longitude=13.40)
+            sellers.append(seller)
+            for j in range(6):
+                product = cls.create_product(
+                    seller, categories[j % 3], 'dish-{0}-{1}'.format(i, j),
+                    name='Margherita {0}'.format(j) if j % 3 == 0 else 'Dish {0}'.format(j), price=Decimal(5 + j * 7),
+                )
+                variation = Variation.objects.create(product=product, name='size')
+                for value in ('small', 'large'):
+                    ProductVariation.objects.create(variation=variation, value=value)
+            for k in range(3):
+                Review.objects.create(user=cls.other, seller=seller, rating=Decimal(3 + k % 3))
+        cls.pizzeria = sellers[0]
+        cls.margherita = cls.pizzeria.products.get(slug='dish-0-0')
+        cls.cola = cls.pizzeria.products.get(slug='dish-0-1')
+        cls.large = ProductVariation.objects.get(variation__product=cls.margherita, value='large')
+        for row in range(1, 3):
+            for col in range(1, 4):
+                Table.objects.create(seller=cls.pizzeria, row=row, col=col, seats=4)
+
+        cls.barber = cls.create_seller(beauty, 'barber')
+        haircut = cls.create_product(cls.barber, salon, 'haircut', price=Decimal(20))
+        for hour in range(9, 18):
+            TimeSlot.objects.create(seller=cls.barber, start=clock(hour), end=clock(hour, 45))
+
+        # A cart at the pizzeria, and a queue at the barber: one active booking, two waiting, some history.
+        cart = Order.objects.create(user=cls.user, seller=cls.pizzeria)
+        cls.cart_item = OrderItem.objects.create(order=cart, product=cls.margherita, quantity=2)
+        cls.cart_item.product_variations.add(cls.large)
+        OrderItem.objects.create(order=cart, product=cls.cola)
+        OrderItem.objects.create(order=Order.objects.create(user=cls.user, seller=cls.barber), product=haircut)
+
+        for status in ('paid', 'expired', 'canceled'):
+            order = Order.objects.create(user=cls.user, seller=cls.barber, complete=True)
+            OrderItem.objects.create(order=order, product=haircut)
+            Booking.objects.create(user=cls.user, seller=cls.barber, order=order, status=status)
+        queue = []
+        for user in (cls.user, cls.other, cls.user):
+            order = Order.objects.create(user=user, seller=cls.barber, complete=True)
+            OrderItem.objects.create(order=order, product=haircut)
+            queue.append(booking_queue.enqueue(user=user, seller=cls.barber, order=order))
+        cls.active, cls.waiting = queue[0], queue[2]
+
+    def test_routes_have_budgets(self):
+        self.assertEqual({route for route, *rest in BUDGETS}, api_routes(services_urls, users_urls))
+
+    @mock.patch('users.views.send_email_task.delay')
+    def test_budgets(self, send_email):
+        client = self.api_client(self.user)
+        for route, method, path, data, max_queries, max_ms in BUDGETS:
+            path, data = fill(path, self), fill(data, self)
+            with self.subTest(path=path, method=method):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = getattr(client, method)(path, data, format='json' if method == 'post' else None)
+                    elapsed = (time.perf_counter() - start) * 1000
+
+                self.assertLess(response.status_code, 300, response.content)
+                self.assertLessEqual(len(queries), max_queries, '\n'.join(query['sql'] for query in queries))
+                self.assertLessEqual(elapsed, max_ms * TIME_SCALE)
+
+
+class ProfilingMiddlewareTests(FixturesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = cls.create_service()
+        cls.user = cls.create_user()
+        cls.staff = cls.create_user('staff@example.com', is_staff=True)
+
+    def get(self, user, **headers):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=user)[0].key, **headers)
+        return client.get('/api/v1/sellers/{0}/'.format(self.food.slug))
+
+    @mock.patch('core.middleware.logger')
+    def test_not_profiled_by_default(self, logger):
+        response = self.get(self.staff)
+        self.assertNotIn('Server-Timing', response)
+        self.assertFalse(logger.info.called)
+
+    def test_header_of_staff(self):
+        with self.assertLogs('profiling') as logs:
+            response = self.get(self.staff, HTTP_X_PROFILE='1')
+
+        self.assertEqual(
+            [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')], ['total', 'db', 'render', 'view'])
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['route'], 'api/v1/sellers/<slug:service_slug>/')
+        self.assertEqual((line['status'], line['reason']), (200, 'header'))
+        self.assertIn(';desc="{0} queries"'.format(line['queries']), response['Server-Timing'])
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['render_ms'], 0)
+
+    def test_header_must_be_1(self):
+        for value in ('0', '', 'true'):
+            with self.subTest(value=value):
+                self.assertNotIn('Server-Timing', self.get(self.staff, HTTP_X_PROFILE=value))
+
+    def test_header_ignored_for_other_users(self):
+        response = self.get(self.user, HTTP_X_PROFILE='1')
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_sampled(self):
+        with self.assertLogs('profiling') as logs:
+            response = self.get(self.user)
+        self.assertIn('Server-Timing', response)
+        self.assertEqual(json.loads(logs.records[0].getMessage())['reason'], 'sample')
+
+
+class SQLStatsTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.stats = sqlstats.QueryStats(self.directory)
+        self.settings = override_settings(SQL_STATS_DIR=self.directory)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_normalize(self):
+        self.assertEqual(
+            sqlstats.normalize("SELECT  *\n FROM t WHERE id IN (%s, %s, %s) AND name = 'it''s' LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(sqlstats.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)'),
+                         'INSERT INTO t (a, b) VALUES (?, ?), ...')
+        self.assertEqual(sqlstats.normalize('SELECT "t2"."col_1" FROM "t2"'), 'SELECT "t2"."col_1" FROM "t2"')
+
+    def test_aggregates_per_fingerprint(self):
+        self.create_user()
+        with connection.execute_wrapper(self.stats):
+            list(User.objects.filter(pk__in=[1, 2]))
+            list(User.objects.filter(pk__in=[1, 2, 3, 4]))
+            User.objects.filter(pk=1).update(full_name='Renamed')
+
+        self.assertEqual(len(self.stats.statements), 2)
+        select, update = sorted(self.stats.statements.values(), key=lambda entry: entry['sql'])
+        self.assertEqual((select['calls'], update['calls'], update['rows']), (2, 1, 1))
+        self.assertGreaterEqual(select['total'], select['max'])
+
+    def test_merges_processes(self):
+        self.stats.record('SELECT 1', 0.002, 1)
+        self.stats.flush()
+        with open(os.path.join(self.directory, 'other-1.json'), 'w') as other:
+            json.dump({sqlstats.fingerprint('SELECT 2')[0]: {'sql': 'SELECT ?', 'calls': 3, 'total': 0.009, 'max': 0.005, 'rows': 3}}, other)
+
+        [entry] = sqlstats.load(self.directory)
+        self.assertEqual((entry['sql'], entry['calls'], entry['rows']), ('SELECT ?', 4, 4))
+        self.assertAlmostEqual(entry['total'], 11)
+        self.assertAlmostEqual(entry['max'], 5)
+        self.assertAlmostEqual(entry['mean'], 2.75)
+
+        sqlstats.clear(self.directory)
+        self.assertEqual(sqlstats.load(self.directory), [])
+
+    def test_full_table(self):
+        stats = sqlstats.QueryStats(self.directory, max_statements=1)
+        stats.record('SELECT 1 FROM a', 0.001, 0)
+        stats.record('SELECT 1 FROM b', 0.001, 0)
+        stats.record('SELECT 1 FROM c', 0.001, 0)
+        self.assertEqual(stats.statements[sqlstats.OTHER]['calls'], 2)
+
+    def test_report(self):
+        self.stats.record('SELECT * FROM services_product WHERE id = 1', 0.004, 1)
+        self.stats.record('SELECT * FROM services_seller', 0.001, 10)
+        self.stats.flush()
+
+        self.client.force_login(self.create_user('staff@example.com', is_staff=True))
+        response = self.client.get('/queries/?order=rows')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['sql'] for entry in response.context['statements']],
+                         ['SELECT * FROM services_seller', 'SELECT * FROM services_product WHERE id = ?'])
+
+        output = io.StringIO()
+        call_command('sql_stats', stdout=output)
+        self.assertLess(output.getvalue().index('services_product'), output.getvalue().index('services_seller'))
+
+    def test_report_is_staff_only(self):
+        self.client.force_login(self.create_user())
+        self.assertRedirects(self.client.get('/queries/'), '/user/profile/', fetch_redirect_response=False)
+
+
+class NPlusOneTests(FixturesMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.food = cls.create_service()
+        cls.user = cls.create_user()
+        pizza = cls.create_category(cls.food, 'Pizza')
+        for i in range(3):
+            seller = cls.create_seller(cls.food, 'seller-{0}'.format(i))
+            cls.create_product(seller, pizza, 'product-{0}'.format(i))
+
+    def test_reports_call_site(self):
+        with self.assertRaises(nplusone.NPlusOneError) as raised, self.assertNoNPlusOne('products'):
+            ProductSerializer(Product.objects.all(), many=True).data
+
+        report = str(raised.exception)
+        self.assertIn('N+1 queries in products:', report)
+        self.assertIn('3 x SELECT', report)
+        self.assertIn('from services/serializers.py:', report)
+        self.assertIn('in get_seller (3 x)', report)
+
+    def test_select_related(self):
+        with self.assertNoNPlusOne():
+            ProductSerializer(Product.objects.select_related('seller'), many=True).data
+
+    def test_log_mode(self):
+        with self.assertLogs('nplusone', 'WARNING') as logs, nplusone.detect('orders', 'log'):
+            OrderSerializer(
+                [Order.objects.create(user=self.user, seller=seller) for seller in self.food.sellers.all()], many=True
+            ).data
+        self.assertIn('in get_order_items', logs.output[0])
+
+    @override_settings(NPLUSONE_THRESHOLD=1)
+    def test_middleware(self):
+        with self.assertRaises(nplusone.NPlusOneError) as raised:
+            self.api_client(self.user).get('/api/v1/services/')
+        self.assertIn('N+1 queries in GET /api/v1/services/', str(raised.exception))
+
+
+@run_on_commit()
+class NavigationCacheTests(FixturesMixin, TestCase):
+    def navigation(self, queries=0):
+        with self.assertNumQueries(queries):
+            return [service['name'] for service in navigation(RequestFactory().get('/'))['services']]
+
+    def test_cached_until_a_service_changes(self):
+        food = self.create_service('Food')
+        self.assertEqual(self.navigation(1), ['Food'])
+        self.assertEqual(self.navigation(), ['Food'])
+
+        food.name = 'Restaurants'
+        food.save()
+        self.assertEqual(self.navigation(1), ['Restaurants'])
+        taxi = self.create_service('Taxi')
+        self.assertEqual(self.navigation(1), ['Restaurants', 'Taxi'])
+        taxi.delete()
+        self.assertEqual(self.navigation(1), ['Restaurants'])
+
+    def test_admin_pages(self):
+        self.create_service('Food')
+        self.client.force_login(self.create_user('admin@example.com', is_staff=True, is_superuser=True))
+        self.client.get('/user/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/user/')
+        self.assertEqual(response.context['services'], [{'name': 'Food', 'slug': 'food'}])
+        self.assertFalse([query['sql'] for query in queries if 'services_service' in query['sql']])
+
+
+@unittest.skipUnless(os.environ.get('TEST_REDIS_URL'), 'Set TEST_REDIS_URL to a redis database the tests may flush.')
+class RedisCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = RedisCache(os.environ['TEST_REDIS_URL'], {})
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    def test_values(self):
+        self.cache.set('menu', {'pizza': [1, 2]})
+        self.assertFalse(self.cache.add('menu', 'other'))
+        self.assertTrue(self.cache.add('version', 5, timeout=None))
+        self.assertEqual(self.cache.get_many(['menu', 'version', 'missing']), {'menu': {'pizza': [1, 2]}, 'version': 5})
+        self.cache.set('menu', 'gone', timeout=0)
+        self.assertIsNone(self.cache.get('menu'))
+
+    def test_increments_are_atomic(self):
+        self.cache.set('version', 10)
+
+        def bump():
+            for i in range(100):
+                self.cache.incr('version')
+
+        threads = [threading.Thread(target=bump) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('version'), 810)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
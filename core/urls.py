@@ -19,7 +19,7 @@ from django.conf.urls import include
 from django.conf.urls.static import static
 from django.conf import settings
 
-from users.views import DashboardView
+from users.views import DashboardView, QueryStatsView
 
 admin.site.site_header = "BOOKING Administrator"
 admin.site.site_title = "BOOKING Administrator"
@@ -27,6 +27,7 @@ admin.site.index_title = "Welcome to BOOKING Administrator"
 
 urlpatterns = [
     path('', DashboardView.as_view(), name="dashboard"),
+    path('queries/', QueryStatsView.as_view(), name="query-stats"),
     path('', include('users.urls')),
     path('', include('services.urls')),
     path('', include('variants.urls')),
@@ -4,6 +4,13 @@ from PIL import Image
 from django.core.files import File
 
 PAGINATE_BY = 10
+SEARCH_PAGE_SIZE = 20
+POPULAR_PAGE_SIZE = 9
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+API_CACHE_TIMEOUT = 60 * 60 * 24
+NEARBY_RADIUS = 5          # km
+NEARBY_MAX_RADIUS = 50
 THUMBNAIL_SIZE = (100, 100)
 
 def resize_image(image, size=(100, 100), thumbnail=False):
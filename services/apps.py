@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ServicesConfig(AppConfig):
@@ -6,3 +7,7 @@ class ServicesConfig(AppConfig):
 
     def ready(self):
         import services.signals
+
+        if settings.SQL_STATS_ENABLED:
+            from core import sqlstats
+            sqlstats.install(settings.SQL_STATS_DIR, settings.SQL_STATS_FLUSH_INTERVAL, settings.SQL_STATS_MAX_STATEMENTS)
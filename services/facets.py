@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from services.models import Product, DELIVERY_TYPES
+
+
+# (key, lowest price, price the band ends before), the last band is open ended.
+PRICE_BANDS = (
+    ('0-10', Decimal('0'), Decimal('10')),
+    ('10-25', Decimal('10'), Decimal('25')),
+    ('25-50', Decimal('25'), Decimal('50')),
+    ('50+', Decimal('50'), None),
+)
+
+MAX_FACET_VALUES = 20   # values listed per facet, the most frequent ones and the selected ones
+
+# Facet name: (column of the grouped rows holding the value, column holding its label)
+FACETS = {
+    'category': ('category__slug', 'category__name'),
+    'seller': ('seller__slug', 'seller__name'),
+    'price': ('price_band', 'price_band'),
+    'delivery': ('seller__delivery', 'seller__delivery'),
+}
+
+
+def price_band_condition(key):
+    for band, low, high in PRICE_BANDS:
+        if band == key:
+            return Q(price__gte=low) & Q(price__lt=high) if high is not None else Q(price__gte=low)
+    return None
+
+
+def price_band():
+    return Case(
+        *[When(price_band_condition(band), then=Value(band)) for band, low, high in PRICE_BANDS],
+        output_field=CharField(),
+    )
+
+
+def facet_filter(selected):
+    """Q matching products with one of the selected values in every facet that has a selection."""
+    condition = Q()
+    for facet, values in selected.items():
+        if facet == 'price':
+            bands = Q()
+            for value in values:
+                bands |= price_band_condition(value) or Q(pk__in=[])
+            condition &= bands
+        else:
+            condition &= Q(**{'{0}__in'.format(FACETS[facet][0]): values})
+    return condition
+
+
+def facet_counts(products, selected):
+    """
+    Counts of every facet value in one GROUP BY over the products, returns (total, facets).
+
+    Like most shops, the counts of a facet apply the selections of all other facets but not
+    its own, so they tell how many products picking another value of it would add. Only the
+    MAX_FACET_VALUES most frequent values of a facet are listed, plus its selected ones.
+    """
+    columns = sorted({column for pair in FACETS.values() for column in pair})
+    rows = list(products.annotate(price_band=price_band()).values(*columns).annotate(n=Count('pk')).order_by())
+
+    def matches(row, skip=None):
+        return all(row[FACETS[facet][0]] in values for facet, values in selected.items() if facet != skip)
+
+    delivery_labels = dict(DELIVERY_TYPES)
+    facets = {}
+    for facet, (value_column, label_column) in FACETS.items():
+        counts = {}
+        for row in rows:
+            if row[value_column] is not None and matches(row, skip=facet):
+                value = row[value_column]
+                label = delivery_labels.get(value, value) if facet == 'delivery' else row[label_column]
+                counts.setdefault(value, [label, 0])[1] += row['n']
+        if facet == 'price':
+            order = [band for band, low, high in PRICE_BANDS]
+            ordered = sorted(counts.items(), key=lambda item: order.index(item[0]))
+        else:
+            ordered = sorted(counts.items(), key=lambda item: (-item[1][1], item[1][0]))
+            chosen = selected.get(facet, ())
+            ordered = ordered[:MAX_FACET_VALUES] + [item for item in ordered[MAX_FACET_VALUES:] if item[0] in chosen]
+        facets[facet] = [{'value': value, 'label': label, 'count': count} for value, (label, count) in ordered]
+
+    total = sum(row['n'] for row in rows if matches(row))
+    return total, facets
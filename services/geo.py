@@ -0,0 +1,79 @@
+import math
+
+
+EARTH_RADIUS = 6371.0088        # km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+CELL_SIZE = 0.05                # degrees, about 5.5 km of latitude per grid cell
+
+
+def grid_cell(latitude, longitude):
+    """Integer (row, column) of the grid bucket a point falls into."""
+    return int(math.floor(latitude / CELL_SIZE)), int(math.floor(longitude / CELL_SIZE))
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km (haversine)."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cells_within(latitude, longitude, radius):
+    """Row and column ranges of the grid buckets covering a circle, columns may wrap at 180 degrees."""
+    lat_delta = radius / KM_PER_DEGREE
+    min_row = grid_cell(max(latitude - lat_delta, -90), 0)[0]
+    max_row = grid_cell(min(latitude + lat_delta, 90), 0)[0]
+
+    # A degree of longitude shrinks towards the poles, measured at the latitude closest to one.
+    cos_lat = math.cos(math.radians(min(abs(latitude) + lat_delta, 90)))
+    if cos_lat < 1e-6 or radius / (KM_PER_DEGREE * cos_lat) >= 180:
+        return (min_row, max_row), [(grid_cell(0, -180)[1], grid_cell(0, 180)[1])]
+
+    lng_delta = radius / (KM_PER_DEGREE * cos_lat)
+    west, east = longitude - lng_delta, longitude + lng_delta
+    if west < -180:
+        columns = [(grid_cell(0, west + 360)[1], grid_cell(0, 180)[1]), (grid_cell(0, -180)[1], grid_cell(0, east)[1])]
+    elif east > 180:
+        columns = [(grid_cell(0, west)[1], grid_cell(0, 180)[1]), (grid_cell(0, -180)[1], grid_cell(0, east - 360)[1])]
+    else:
+        columns = [(grid_cell(0, west)[1], grid_cell(0, east)[1])]
+    return (min_row, max_row), columns
+
+
+def candidates(queryset, latitude, longitude, radius):
+    """(pk, distance) of sellers in queryset within radius km, read from the grid index alone."""
+    (min_row, max_row), columns = cells_within(latitude, longitude, radius)
+    found = []
+    for min_column, max_column in columns:
+        rows = queryset.filter(
+            grid_row__gte=min_row, grid_row__lte=max_row, grid_column__gte=min_column, grid_column__lte=max_column,
+        ).values_list('pk', 'latitude', 'longitude')
+        for pk, lat, lng in rows:
+            km = distance(latitude, longitude, lat, lng)
+            if km <= radius:
+                found.append((pk, km))
+    return found
+
+
+def nearest_sellers(queryset, latitude, longitude, radius, limit):
+    """
+    The limit sellers of queryset closest to a point within radius km, nearest first, each
+    with a distance attribute. The search starts one grid cell wide and doubles until it has
+    limit sellers or covers the radius, so dense areas never read the whole circle.
+    """
+    search_radius = min(radius, CELL_SIZE * KM_PER_DEGREE)
+    while True:
+        found = candidates(queryset, latitude, longitude, search_radius)
+        if len(found) >= limit or search_radius >= radius:
+            break
+        search_radius = min(radius, search_radius * 2)
+
+    found.sort(key=lambda pair: (pair[1], pair[0]))
+    found = found[:limit]
+    sellers = queryset.in_bulk([pk for pk, km in found])
+    nearest = []
+    for pk, km in found:
+        seller = sellers[pk]
+        seller.distance = km
+        nearest.append(seller)
+    return nearest
@@ -0,0 +1,147 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from users.models import User
+from services.models import Service, Seller, Category, Product
+
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives the main API endpoints in-process with the test client from a thread pool and prints '
+        'latency percentiles, throughput and queries per request as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run, spread over the endpoints.')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=100, help='Requests sent before measuring.')
+        parser.add_argument('--endpoints', help='Comma separated endpoint names to run, all by default.')
+        parser.add_argument('--user', help='Email of the user to authenticate as, the first user by default.')
+        parser.add_argument('--sample', type=int, default=200, help='Sellers, products and categories requests pick from.')
+        parser.add_argument('--no-cache', action='store_true', help='Run with a dummy cache, every request a miss.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options['user']) if options['user'] else User.objects.order_by('pk')
+        user = user.first()
+        if user is None:
+            raise CommandError('No user to authenticate as, generate a dataset first.')
+        self.token = Token.objects.get_or_create(user=user)[0].key
+
+        rng = random.Random(options['seed'])
+        endpoints = self.endpoints(options['sample'])
+        if options['endpoints']:
+            names = options['endpoints'].split(',')
+            unknown = set(names) - set(endpoints)
+            if unknown:
+                raise CommandError('Unknown endpoints: {0}. Known: {1}.'.format(', '.join(sorted(unknown)), ', '.join(endpoints)))
+            endpoints = {name: endpoints[name] for name in names}
+        plan = [rng.choice(list(endpoints)) for i in range(options['warmup'] + options['requests'])]
+        plan = [(name, endpoints[name](rng)) for name in plan]
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], **({'CACHES': DUMMY_CACHES} if options['no_cache'] else {})):
+            self.run(plan[:options['warmup']], options['threads'])
+            start = time.perf_counter()
+            results = self.run(plan[options['warmup']:], options['threads'])
+            elapsed = time.perf_counter() - start
+
+        report = {
+            'config': {key: options[key] for key in ('requests', 'threads', 'warmup', 'no_cache', 'seed', 'sample')},
+            'total': dict(self.summarize(results), throughput=round(len(results) / elapsed, 1), seconds=round(elapsed, 2)),
+            'endpoints': {
+                name: self.summarize([result for result in results if result[0] == name])
+                for name in sorted({result[0] for result in results})
+            },
+        }
+        report = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def endpoints(self, sample):
+        """Name: function(rng) returning (method, path, data) of a request."""
+        services = list(Service.objects.values_list('slug', flat=True)[:sample])
+        sellers = list(Seller.objects.order_by('pk').values_list('slug', 'service__slug', 'latitude', 'longitude')[:sample])
+        categories = list(Category.objects.values_list('slug', flat=True)[:sample])
+        products = list(Product.objects.order_by('pk').values_list('slug', 'name')[:sample])
+        if not (services and sellers and categories and products):
+            raise CommandError('The database needs services, sellers, categories and products, generate a dataset first.')
+
+        def nearby(rng):
+            slug, service, latitude, longitude = rng.choice(sellers)
+            return 'get', '/api/v1/sellers/{0}/nearby/?lat={1}&lng={2}&radius=5'.format(service, latitude or 0, longitude or 0), None
+
+        return {
+            'services': lambda rng: ('get', '/api/v1/services/', None),
+            'categories': lambda rng: ('get', '/api/v1/categories/{0}/'.format(rng.choice(services)), None),
+            'sellers': lambda rng: ('get', '/api/v1/sellers/{0}/'.format(rng.choice(services)), None),
+            'sellers_open_now': lambda rng: ('get', '/api/v1/sellers/{0}/?open_now=1'.format(rng.choice(services)), None),
+            'sellers_nearby': nearby,
+            'seller_detail': lambda rng: ('get', '/api/v1/seller/{0}/detail/'.format(rng.choice(sellers)[0]), None),
+            'popular': lambda rng: ('get', '/api/v1/{0}/products/popular/'.format(rng.choice(categories)), None),
+            'search': lambda rng: ('post', '/api/v1/products/search/', {'keyword': rng.choice(products)[1]}),
+            'browse': lambda rng: ('get', '/api/v1/products/{0}/browse/'.format(rng.choice(services)), None),
+            'product_detail': lambda rng: ('get', '/api/v1/product/{0}/detail/'.format(rng.choice(products)[0]), None),
+            'product_batch': lambda rng: ('post', '/api/v1/products/batch/', {'slugs': [slug for slug, name in rng.sample(products, min(len(products), 10))]}),
+            'tables': lambda rng: ('get', '/api/v1/seller/{0}/tables/'.format(rng.choice(sellers)[0]), None),
+            'timeslots': lambda rng: ('get', '/api/v1/seller/{0}/timeslots/'.format(rng.choice(sellers)[0]), None),
+            'orders': lambda rng: ('get', '/api/v1/order/list/', None),
+            'bookings': lambda rng: ('get', '/api/v1/booking/{0}/list/'.format(rng.choice(('active', 'previous'))), None),
+        }
+
+    def run(self, plan, threads):
+        local = threading.local()
+
+        def send(request):
+            name, (method, path, data) = request
+            if not hasattr(local, 'client'):
+                local.client = APIClient()
+                local.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(local.client, method)(path, data, format='json' if method == 'post' else None)
+                elapsed = (time.perf_counter() - start) * 1000
+            return name, elapsed, len(queries), response.status_code
+
+        def close(request):
+            connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(send, plan))
+            # Every worker thread opened its own database connection.
+            list(executor.map(close, range(threads)))
+        return results
+
+    def summarize(self, results):
+        timings = sorted(elapsed for name, elapsed, queries, status in results)
+        queries = [queries for name, elapsed, queries, status in results]
+        return {
+            'requests': len(results),
+            'errors': sum(1 for name, elapsed, count, status in results if status >= 400),
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+        }
@@ -0,0 +1,104 @@
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from bookings.models import Booking, Order
+from bookings import queue
+from core.middleware import QueryTimer
+from users.models import User
+from services.models import Service, Seller
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_sweep():
+    """check_booking_status before expiry tasks: loads every started booking each minute."""
+    now = datetime.now()
+    for booking in Booking.objects.filter(status='booked', started_time__isnull=False).select_related('seller'):
+        if int((now - booking.started_time).total_seconds()) >= booking.seller.wait_time * 60:
+            queue.finish(booking, 'expired')
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates sellers with a started booking each inside a transaction that is rolled back, then times '
+        'the old full sweep against the bulk sweep and the per-seller expiry tasks, printed as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=100000)
+        parser.add_argument('--waiting', type=int, default=1, help='Bookings waiting behind the started one, per seller.')
+        parser.add_argument('--overdue', type=float, default=0.01, help='Fraction of started bookings past their wait time.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        report = {}
+        try:
+            with transaction.atomic():
+                overdue = self.create_queues(options)
+                report['sellers'], report['overdue'] = options['sellers'], len(overdue)
+                report['legacy_sweep'] = self.measure(legacy_sweep)
+                report['bulk_sweep'] = self.measure(queue.expire_overdue)
+                report['expiry_tasks'] = self.measure(lambda: [queue.expire_overdue([pk]) for pk in overdue])
+                # Every minute once the tasks did their job.
+                queue.expire_overdue()
+                report['idle_sweep'] = self.measure(queue.expire_overdue, rollback=False)
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def measure(self, run, rollback=True):
+        timer = QueryTimer()
+        sid = transaction.savepoint()
+        with connection.execute_wrapper(timer):
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+        if rollback:
+            transaction.savepoint_rollback(sid)
+        return {'seconds': round(seconds, 3), 'queries': timer.count, 'db_seconds': round(timer.duration, 3)}
+
+    def create_queues(self, options):
+        rng = random.Random(options['seed'])
+        now = datetime.now()
+        service = Service.objects.order_by('pk').first() or Service.objects.create(name='Benchmark')
+        user = User.objects.order_by('pk').first() or User.objects.create_user('benchmark-expiry@example.com', 'Benchmark', 'password')
+        start = (Seller.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        people = options['waiting'] + 1
+
+        sellers, overdue = [], []
+        for pk in range(start, start + options['sellers']):
+            wait_time = rng.choice((10, 15, 30))
+            if rng.random() < options['overdue']:
+                started_time = now - timedelta(minutes=wait_time + rng.randint(1, 5))
+                overdue.append(pk)
+            else:
+                started_time = now - timedelta(seconds=rng.randint(0, wait_time * 60 - 60))
+            sellers.append(Seller(
+                pk=pk, service=service, name='Expiry {0}'.format(pk), slug='benchmark-expiry-{0}'.format(pk),
+                wait_time=wait_time, next_ticket=people, serving_ticket=1, active_bookings=people,
+                serving_started_time=started_time,
+            ))
+        Seller.objects.bulk_create(sellers, batch_size=2000)
+
+        # Explicit keys, SQLite doesn't return them from bulk_create().
+        first_order = (Order.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        orders, bookings = [], []
+        for index, seller in enumerate(sellers):
+            for ticket in range(1, people + 1):
+                order = Order(pk=first_order + index * people + ticket - 1, user=user, seller_id=seller.pk, complete=True)
+                orders.append(order)
+                bookings.append(Booking(
+                    user=user, seller_id=seller.pk, order=order, ticket=ticket,
+                    started_time=seller.serving_started_time if ticket == 1 else None,
+                ))
+        Order.objects.bulk_create(orders, batch_size=2000)
+        Booking.objects.bulk_create(bookings, batch_size=2000)
+        return overdue
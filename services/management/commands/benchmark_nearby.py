@@ -0,0 +1,80 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from services.models import Service, Seller
+from services.geo import KM_PER_DEGREE, distance, grid_cell, nearest_sellers
+
+
+class Command(BaseCommand):
+    help = (
+        'Times nearby seller searches against a full scan over generated sellers. '
+        'Everything runs in a transaction that is rolled back, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--radius', type=float, default=5, help='Search radius in km.')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--area', type=float, default=100, help='Side of the square sellers are spread over, in km.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        center = (52.52, 13.40)
+        half_lat = options['area'] / 2 / KM_PER_DEGREE
+        half_lng = half_lat / math.cos(math.radians(center[0]))
+
+        def point():
+            return center[0] + rng.uniform(-half_lat, half_lat), center[1] + rng.uniform(-half_lng, half_lng)
+
+        with transaction.atomic():
+            Service.objects.bulk_create([Service(name='Nearby benchmark', image='services/benchmark.png')])
+            service = Service.objects.get(name='Nearby benchmark')
+            sellers = []
+            for i in range(options['sellers']):
+                latitude, longitude = point()
+                row, column = grid_cell(latitude, longitude)
+                sellers.append(Seller(
+                    service=service, name='Seller {0}'.format(i), slug='nearby-benchmark-{0}'.format(i),
+                    image='sellers/benchmark.png', address='-', phone='-',
+                    latitude=latitude, longitude=longitude, grid_row=row, grid_column=column,
+                ))
+            Seller.objects.bulk_create(sellers, batch_size=1000)
+
+            queryset = Seller.objects.filter(service=service)
+            points = [point() for i in range(options['queries'])]
+            radius, limit = options['radius'], options['limit']
+
+            def full_scan(latitude, longitude):
+                found = [
+                    (distance(latitude, longitude, lat, lng), pk)
+                    for pk, lat, lng in queryset.values_list('pk', 'latitude', 'longitude')
+                ]
+                found = sorted(pair for pair in found if pair[0] <= radius)[:limit]
+                return list(queryset.in_bulk([pk for km, pk in found]).values())
+
+            for label, search in (
+                ('grid index', lambda lat, lng: nearest_sellers(queryset, lat, lng, radius, limit)),
+                ('full scan', full_scan),
+            ):
+                timings = []
+                for latitude, longitude in points:
+                    start = time.perf_counter()
+                    search(latitude, longitude)
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write('{0:<12} mean {1:8.2f} ms   p50 {2:8.2f} ms   p95 {3:8.2f} ms'.format(
+                    label, sum(timings) / len(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)],
+                ))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{0} sellers over {1:g} km x {1:g} km, {2} queries, radius {3:g} km, limit {4}.'.format(
+                options['sellers'], options['area'], options['queries'], radius, limit)
+        ))
@@ -0,0 +1,274 @@
+import os
+import random
+import time
+from datetime import datetime, time as clock, timedelta
+from decimal import Decimal
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from users.models import User
+from users.dashboard import take_snapshot
+from services.models import (
+    Service, ServiceStatistics, Seller, OpeningInterval, Category, CategorySeller, Product, WEEKDAYS,
+)
+from services.geo import grid_cell
+from services.opening import compile_intervals
+from services.search import index_products
+from services.popularity import update_popularity
+from bookings.models import Order, OrderItem, Booking, Review
+from variants.models import Table, TimeSlot, Variation, ProductVariation
+
+
+IMAGE = 'dataset/image.png'
+CITIES = ((52.52, 13.40), (48.86, 2.35), (40.71, -74.01), (35.68, 139.69), (-33.87, 151.21))
+WORDS = (
+    'pizza', 'pasta', 'burger', 'sushi', 'ramen', 'salad', 'curry', 'taco', 'steak', 'soup', 'cake', 'coffee',
+    'tea', 'juice', 'haircut', 'shave', 'massage', 'manicure', 'facial', 'spicy', 'classic', 'vegan', 'large',
+    'family', 'special', 'house', 'grilled', 'fresh', 'sweet', 'deluxe',
+)
+BOOKING_STATUSES = (('paid', 85), ('canceled', 7), ('expired', 7), ('booked', 1))
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a deterministic synthetic dataset with bulk inserts, then builds the denormalized '
+        'statistics, search index and popularity from it. Meant for local benchmarking only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--services', type=int, default=50)
+        parser.add_argument('--categories', type=int, default=8, help='Categories per service.')
+        parser.add_argument('--sellers', type=int, default=20000)
+        parser.add_argument('--products', type=int, default=500000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--bookings', type=int, default=1000000)
+        parser.add_argument('--reviews', type=int, default=200000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='ds', help='Prefix of generated names, slugs and emails.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        if options['sellers'] < options['services'] or options['products'] < options['sellers']:
+            raise CommandError('Every service needs a seller and every seller a product.')
+        if Service.objects.filter(name__startswith='{0} '.format(self.prefix)).exists():
+            raise CommandError('A dataset with prefix "{0}" exists already, pick another --prefix.'.format(self.prefix))
+
+        self.write_images()
+        self.step('users', self.create_users)
+        self.step('services and categories', self.create_services)
+        self.step('sellers', self.create_sellers)
+        self.step('products and variations', self.create_products)
+        self.step('tables and timeslots', self.create_layouts)
+        self.step('orders and bookings', self.create_bookings)
+        self.step('reviews', self.create_reviews)
+        self.step('statistics', self.build_statistics)
+        self.step('search index', self.build_search_index)
+        self.step('popularity', update_popularity)
+        self.step('dashboard', take_snapshot)
+        # Generated rows never sent signals, so cached responses don't know about them.
+        cache.clear()
+
+        self.stdout.write(self.style.SUCCESS('Dataset "{0}" generated.'.format(self.prefix)))
+
+    def step(self, label, function):
+        start = time.perf_counter()
+        function()
+        self.stdout.write('{0:<26} {1:8.1f} s'.format(label, time.perf_counter() - start))
+
+    def write_images(self):
+        """One placeholder image and thumbnail that every generated object points at."""
+        for path in (IMAGE, os.path.join(os.path.dirname(IMAGE), 'thumbnail', os.path.basename(IMAGE))):
+            path = os.path.join(settings.MEDIA_ROOT, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not os.path.exists(path):
+                Image.new('RGB', (100, 100), (200, 120, 60)).save(path)
+
+    def next_pk(self, model):
+        # SQLite doesn't return ids from bulk inserts, so ids are assigned up front.
+        return (model.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+
+    def insert(self, model, objects):
+        """Bulk inserts objects from an iterable in batches, one transaction per batch."""
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+
+    def words(self, count):
+        return ' '.join(self.rng.choice(WORDS) for i in range(count))
+
+    def create_users(self):
+        password = hashers.make_password('password')
+        start = self.next_pk(User)
+        self.users = list(range(start, start + self.options['users']))
+        self.insert(User, (
+            User(pk=pk, email='{0}-user-{1}@example.com'.format(self.prefix, pk), full_name='User {0}'.format(pk), password=password)
+            for pk in self.users
+        ))
+
+    def create_services(self):
+        start = self.next_pk(Service)
+        self.services = list(range(start, start + self.options['services']))
+        self.insert(Service, (
+            Service(pk=pk, name='{0} service {1}'.format(self.prefix, pk), image=IMAGE) for pk in self.services
+        ))
+
+        start = self.next_pk(Category)
+        self.categories = {}
+        categories = []
+        for service in self.services:
+            self.categories[service] = []
+            for i in range(self.options['categories']):
+                pk = start + len(categories)
+                self.categories[service].append(pk)
+                categories.append(Category(
+                    pk=pk, service_id=service, name='{0} category {1}'.format(self.prefix, pk), image=IMAGE,
+                ))
+        self.insert(Category, categories)
+
+    def create_sellers(self):
+        start = self.next_pk(Seller)
+        self.sellers = {}
+        sellers, intervals = [], []
+        daily = compile_intervals([(weekday, clock(9), clock(22)) for weekday, name in WEEKDAYS])
+        for i in range(self.options['sellers']):
+            pk = start + i
+            service = self.services[i % len(self.services)]
+            self.sellers[pk] = service
+            city = self.rng.choice(CITIES)
+            latitude, longitude = city[0] + self.rng.gauss(0, 0.1), city[1] + self.rng.gauss(0, 0.1)
+            row, column = grid_cell(latitude, longitude)
+            sellers.append(Seller(
+                pk=pk, service_id=service, name='{0} {1}'.format(self.words(2).title(), pk),
+                slug='{0}-seller-{1}'.format(self.prefix, pk), image=IMAGE, address='{0} Main Street'.format(i),
+                phone='555-{0:06d}'.format(i), description=self.words(12), wait_time=self.rng.choice((10, 15, 30)),
+                delivery=self.rng.choice('FP'), latitude=latitude, longitude=longitude, grid_row=row, grid_column=column,
+            ))
+            intervals += [OpeningInterval(seller_id=pk, start=begin, end=end) for begin, end in daily]
+        self.insert(Seller, sellers)
+        self.insert(OpeningInterval, intervals)
+
+    def create_products(self):
+        start = self.first_product = self.next_pk(Product)
+        variation_start = self.next_pk(Variation)
+        sellers = list(self.sellers)
+        self.products = {}
+        products, variations, values = [], [], []
+        for i in range(self.options['products']):
+            pk = start + i
+            # Every seller gets a product first, the rest go to sellers at random.
+            seller = sellers[i] if i < len(sellers) else self.rng.choice(sellers)
+            self.products.setdefault(seller, []).append(pk)
+            products.append(Product(
+                pk=pk, seller_id=seller, category_id=self.rng.choice(self.categories[self.sellers[seller]]),
+                name=self.words(3).title(), slug='{0}-product-{1}'.format(self.prefix, pk), image=IMAGE,
+                price=Decimal(self.rng.randint(100, 9000)) / 100, description=self.words(20),
+            ))
+            if i % 3 == 0:
+                variation = variation_start + len(variations)
+                variations.append(Variation(pk=variation, product_id=pk, name='size'))
+                values += [ProductVariation(variation_id=variation, value=value) for value in ('small', 'medium', 'large')]
+        self.insert(Product, products)
+        self.insert(Variation, variations)
+        self.insert(ProductVariation, values)
+
+    def create_layouts(self):
+        tables, timeslots = [], []
+        for i, seller in enumerate(self.sellers):
+            if i % 4 == 0:
+                tables += [Table(seller_id=seller, row=row, col=col, seats=self.rng.choice((2, 4, 6))) for row in range(1, 4) for col in range(1, 5)]
+            else:
+                timeslots += [TimeSlot(seller_id=seller, start=clock(hour), end=clock(hour, 45)) for hour in range(9, 21)]
+        self.insert(Table, tables)
+        self.insert(TimeSlot, timeslots)
+
+    def create_bookings(self):
+        order_start = self.next_pk(Order)
+        sellers = list(self.sellers)
+        statuses = [status for status, weight in BOOKING_STATUSES for i in range(weight)]
+        now = datetime.now()
+        tickets = {}
+
+        # booked_time is auto_now, which would give every generated booking the same time.
+        booked_time = Booking._meta.get_field('booked_time')
+        booked_time.auto_now = False
+        try:
+            for offset in range(0, self.options['bookings'], self.batch_size):
+                orders, items, bookings = [], [], []
+                for i in range(offset, min(offset + self.batch_size, self.options['bookings'])):
+                    order, seller, user = order_start + i, self.rng.choice(sellers), self.rng.choice(self.users)
+                    status = self.rng.choice(statuses)
+                    # Booked ones queue up behind the first, which is being served.
+                    ticket = None
+                    if status == 'booked':
+                        ticket = tickets[seller] = tickets.get(seller, 0) + 1
+                    started_time = now if ticket == 1 else None
+                    orders.append(Order(pk=order, user_id=user, seller_id=seller, complete=True))
+                    for product in self.rng.sample(self.products[seller], min(len(self.products[seller]), self.rng.randint(1, 3))):
+                        items.append(OrderItem(order_id=order, product_id=product, quantity=self.rng.randint(1, 3)))
+                    bookings.append(Booking(
+                        user_id=user, seller_id=seller, order_id=order, status=status, started_time=started_time, ticket=ticket,
+                        booked_time=now - timedelta(seconds=self.rng.randint(0, 90 * 24 * 3600)) if status != 'booked' else now,
+                    ))
+                with transaction.atomic():
+                    Order.objects.bulk_create(orders)
+                    OrderItem.objects.bulk_create(items)
+                    Booking.objects.bulk_create(bookings)
+        finally:
+            booked_time.auto_now = True
+
+        Seller.objects.bulk_update([
+            Seller(pk=seller, next_ticket=count, serving_ticket=1, active_bookings=count, serving_started_time=now)
+            for seller, count in tickets.items()
+        ], Seller.QUEUE_FIELDS, batch_size=self.batch_size)
+
+    def create_reviews(self):
+        sellers = list(self.sellers)
+        self.insert(Review, (
+            Review(user_id=self.rng.choice(self.users), seller_id=self.rng.choice(sellers), rating=Decimal(self.rng.randint(2, 10)) / 2)
+            for i in range(self.options['reviews'])
+        ))
+
+    def build_search_index(self):
+        # Only the generated products, rebuild_search_index would redo the whole catalog.
+        products = Product.objects.select_related('seller', 'category').filter(pk__gte=self.first_product).order_by('pk')
+        last_pk = 0
+        while True:
+            batch = list(products.filter(pk__gt=last_pk)[:self.batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                index_products(batch)
+            last_pk = batch[-1].pk
+
+    def build_statistics(self):
+        """What services.signals would have maintained, computed in bulk for the generated rows."""
+        counters = ServiceStatistics.compute()
+        ServiceStatistics.objects.filter(service__in=self.services).delete()
+        self.insert(ServiceStatistics, (ServiceStatistics(service_id=pk, **counters[pk]) for pk in self.services))
+
+        ratings = Seller.compute_ratings()
+        sellers = [Seller(pk=pk, **ratings[pk]) for pk in self.sellers]
+        Seller.objects.bulk_update(sellers, Seller.RATING_FIELDS, batch_size=self.batch_size)
+
+        memberships = CategorySeller.compute()
+        self.insert(CategorySeller, (
+            CategorySeller(category_id=category, seller_id=seller, product_count=count)
+            for (category, seller), count in memberships.items() if seller in self.sellers
+        ))
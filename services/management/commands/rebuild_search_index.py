@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from services.models import Product
+from services.search import index_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        products = Product.objects.select_related('seller', 'category').order_by('pk')
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            batch = list(products.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                index_products(batch)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS('Indexed {0} product(s).'.format(indexed)))
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from services.models import Service, ServiceStatistics, Seller, CategorySeller
+
+
+class Command(BaseCommand):
+    help = 'Recounts the denormalized service counters, seller ratings and category memberships and fixes the ones that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report counters that are out of date, exit with an error if any are found.',
+        )
+
+    def handle(self, *args, **options):
+        self.verify = options['verify']
+
+        with transaction.atomic():
+            mismatches = self.rebuild_service_statistics()
+            mismatches += self.rebuild_seller_ratings()
+            mismatches += self.rebuild_category_sellers()
+
+        if self.verify and mismatches:
+            raise CommandError('{0} row(s) have stale statistics.'.format(mismatches))
+
+        if self.verify:
+            self.stdout.write(self.style.SUCCESS('All statistics are up to date.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Rebuilt statistics, {0} row(s) fixed.'.format(mismatches)))
+
+    def rebuild_service_statistics(self):
+        mismatches = 0
+        expected = ServiceStatistics.compute()
+        stored = {stats.service_id: stats for stats in ServiceStatistics.objects.all()}
+
+        for service in Service.objects.filter(pk__in=expected.keys()).order_by('pk'):
+            counters = expected[service.pk]
+            stats = stored.get(service.pk)
+            if stats is None:
+                self.stdout.write('{0}: statistics missing'.format(service))
+                mismatches += 1
+                if not self.verify:
+                    ServiceStatistics.objects.create(service=service, **counters)
+                continue
+
+            if self.compare(service, stats, counters):
+                mismatches += 1
+
+        return mismatches
+
+    def rebuild_seller_ratings(self):
+        mismatches = 0
+        expected = Seller.compute_ratings()
+
+        for seller in Seller.objects.order_by('pk'):
+            if self.compare(seller, seller, expected[seller.pk]):
+                mismatches += 1
+
+        return mismatches
+
+    def rebuild_category_sellers(self):
+        mismatches = 0
+        expected = CategorySeller.compute()
+        stored = {(membership.category_id, membership.seller_id): membership for membership in CategorySeller.objects.all()}
+
+        for key in sorted(set(expected) | set(stored)):
+            membership = stored.get(key)
+            if membership is None:
+                self.stdout.write('category {0}, seller {1}: membership missing'.format(*key))
+                mismatches += 1
+                if not self.verify:
+                    CategorySeller.objects.create(category_id=key[0], seller_id=key[1], product_count=expected[key])
+            elif key not in expected:
+                self.stdout.write('{0}: membership without products'.format(membership))
+                mismatches += 1
+                if not self.verify:
+                    membership.delete()
+            elif self.compare(membership, membership, {'product_count': expected[key]}):
+                mismatches += 1
+
+        return mismatches
+
+    def compare(self, label, instance, values):
+        """Reports every field of instance that differs from values, saves the fix unless verifying."""
+        changed = [field for field, value in values.items() if getattr(instance, field) != value]
+        for field in changed:
+            self.stdout.write('{0}: {1} is {2}, expected {3}'.format(
+                label, field, getattr(instance, field), values[field]))
+
+        # update() rather than save() so Seller.save() doesn't resize images and signals don't fire.
+        if changed and not self.verify:
+            type(instance).objects.filter(pk=instance.pk).update(**{field: values[field] for field in changed})
+
+        return bool(changed)
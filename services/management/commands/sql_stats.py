@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import sqlstats
+
+
+class Command(BaseCommand):
+    help = 'Lists the SQL statements that took the most time, merged over every process that collected statistics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', choices=sqlstats.ORDERS, default='total')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--reset', action='store_true', help='Delete the collected statistics instead.')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            sqlstats.clear(settings.SQL_STATS_DIR)
+            self.stdout.write(self.style.SUCCESS('Statistics cleared.'))
+            return
+
+        statements = sqlstats.top(settings.SQL_STATS_DIR, options['order'], options['limit'])
+        if not statements:
+            self.stdout.write('No statements recorded in {0}.'.format(settings.SQL_STATS_DIR))
+            return
+
+        self.stdout.write('{0:>8} {1:>11} {2:>9} {3:>9} {4:>10}  statement'.format('calls', 'total ms', 'mean ms', 'max ms', 'rows'))
+        for statement in statements:
+            self.stdout.write('{calls:>8} {total:>11.1f} {mean:>9.2f} {max:>9.1f} {rows:>10}  {sql}'.format(**statement))
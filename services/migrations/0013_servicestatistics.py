@@ -0,0 +1,53 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_statistics(apps, schema_editor):
+    Service = apps.get_model('services', 'Service')
+    Seller = apps.get_model('services', 'Seller')
+    Category = apps.get_model('services', 'Category')
+    ServiceStatistics = apps.get_model('services', 'ServiceStatistics')
+
+    counters = {pk: {} for pk in Service.objects.values_list('pk', flat=True)}
+    querysets = {
+        'sellers': Seller.objects.values('service').annotate(n=models.Count('pk')),
+        'categories': Category.objects.values('service').annotate(n=models.Count('pk')),
+        'products': Seller.objects.values('service').annotate(n=models.Count('products')),
+        'reviews': Seller.objects.values('service').annotate(n=models.Count('reviews')),
+    }
+    for counter, queryset in querysets.items():
+        for row in queryset:
+            counters[row['service']][counter] = row['n']
+
+    ServiceStatistics.objects.bulk_create([
+        ServiceStatistics(service_id=pk, **values) for pk, values in counters.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0012_auto_20210302_0914'),
+        ('bookings', '0007_booking_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sellers', models.IntegerField(default=0)),
+                ('categories', models.IntegerField(default=0)),
+                ('products', models.IntegerField(default=0)),
+                ('reviews', models.IntegerField(default=0)),
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='services.service')),
+            ],
+            options={
+                'verbose_name': 'service statistics',
+                'verbose_name_plural': 'service statistics',
+            },
+        ),
+        migrations.RunPython(populate_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:33
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def populate_ratings(apps, schema_editor):
+    Seller = apps.get_model('services', 'Seller')
+
+    sellers = {}
+    rows = Seller.objects.filter(reviews__isnull=False).values('pk', 'reviews__rating').annotate(n=models.Count('reviews'))
+    for row in rows:
+        if row['pk'] not in sellers:
+            sellers[row['pk']] = Seller.objects.get(pk=row['pk'])
+        seller = sellers[row['pk']]
+        rating = Decimal(row['reviews__rating'])
+        star = int(rating.quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+        star_field = 'rating_{0}'.format(min(max(star, 1), 5))
+        seller.review_count += row['n']
+        seller.rating_sum += rating * row['n']
+        setattr(seller, star_field, getattr(seller, star_field) + row['n'])
+
+    for seller in sellers.values():
+        seller.save(update_fields=['review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0013_servicestatistics'),
+        ('bookings', '0007_booking_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='rating_1',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='rating_2',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='rating_3',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='rating_4',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='rating_5',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=1, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='review_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:34
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copy of the tokenizer in services.search at the time of this migration, which mustn't
+# depend on app code that changes later.
+TOKEN_RE = re.compile(r'\w+')
+FIELD_WEIGHTS = (('name', 8), ('category', 4), ('seller', 4), ('description', 1))
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        token = token[:50]
+        if len(token) >= 2 and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def product_tokens(product):
+    texts = {
+        'name': product.name,
+        'category': product.category.name if product.category_id else '',
+        'seller': product.seller.name,
+        'description': product.description,
+    }
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(texts[field]):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def build_search_index(apps, schema_editor):
+    Product = apps.get_model('services', 'Product')
+    ProductSearchToken = apps.get_model('services', 'ProductSearchToken')
+
+    ProductSearchToken.objects.bulk_create([
+        ProductSearchToken(product=product, token=token, weight=weight)
+        for product in Product.objects.select_related('seller', 'category').iterator()
+        for token, weight in product_tokens(product).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0014_seller_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50)),
+                ('weight', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='services.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productsearchtoken',
+            index=models.Index(fields=['token', 'product', 'weight'], name='product_search_token_idx'),
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0015_productsearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='services.category')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='popularity', to='services.product')),
+            ],
+            options={
+                'verbose_name_plural': 'product popularities',
+            },
+        ),
+        migrations.CreateModel(
+            name='PopularProduct',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField()),
+                ('score', models.FloatField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='popular_products', to='services.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='services.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productpopularity',
+            index=models.Index(fields=['category', 'score'], name='product_popularity_rank_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='popularproduct',
+            unique_together={('category', 'rank')},
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_memberships(apps, schema_editor):
+    Product = apps.get_model('services', 'Product')
+    CategorySeller = apps.get_model('services', 'CategorySeller')
+
+    rows = Product.objects.filter(category__isnull=False).values('category', 'seller').annotate(n=models.Count('pk'))
+    CategorySeller.objects.bulk_create([
+        CategorySeller(category_id=row['category'], seller_id=row['seller'], product_count=row['n']) for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0016_product_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySeller',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seller_memberships', to='services.category')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_memberships', to='services.seller')),
+            ],
+            options={
+                'unique_together': {('category', 'seller')},
+            },
+        ),
+        migrations.RunPython(populate_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copy of services.opening.compile_intervals at the time of this migration, which mustn't
+# depend on app code that changes later.
+def minute_of_week(time, weekday):
+    return weekday * 24 * 60 + time.hour * 60 + time.minute
+
+
+def compile_intervals(hours):
+    intervals = []
+    for weekday, open_time, close_time in hours:
+        start = minute_of_week(open_time, weekday)
+        end = minute_of_week(close_time, weekday)
+        if end <= start:
+            end += 24 * 60
+        if end > 7 * 24 * 60:
+            intervals.append((0, end - 7 * 24 * 60))
+            end = 7 * 24 * 60
+        intervals.append((start, end))
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def compile_daily_hours(apps, schema_editor):
+    Seller = apps.get_model('services', 'Seller')
+    OpeningInterval = apps.get_model('services', 'OpeningInterval')
+
+    intervals = []
+    for seller in Seller.objects.only('open_time', 'close_time'):
+        hours = [(weekday, seller.open_time, seller.close_time) for weekday in range(7)]
+        intervals += [OpeningInterval(seller=seller, start=start, end=end) for start, end in compile_intervals(hours)]
+    OpeningInterval.objects.bulk_create(intervals, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0017_categoryseller'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningInterval',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.IntegerField()),
+                ('end', models.IntegerField()),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_intervals', to='services.seller')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OpeningHours',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.IntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('open_time', models.TimeField()),
+                ('close_time', models.TimeField()),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opening_hours', to='services.seller')),
+            ],
+            options={
+                'verbose_name_plural': 'opening hours',
+                'ordering': ('weekday', 'open_time'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='openinginterval',
+            index=models.Index(fields=['start', 'end', 'seller'], name='opening_interval_idx'),
+        ),
+        migrations.RunPython(compile_daily_hours, migrations.RunPython.noop),
+    ]
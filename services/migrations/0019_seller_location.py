@@ -0,0 +1,38 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:47
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0018_opening_hours'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='grid_column',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='grid_row',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='seller',
+            index=models.Index(fields=['service', 'grid_row', 'grid_column', 'latitude', 'longitude'], name='seller_grid_idx'),
+        ),
+    ]
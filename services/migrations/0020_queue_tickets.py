@@ -0,0 +1,33 @@
+# Generated by Django 3.1.6 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0019_seller_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='active_bookings',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='next_ticket',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='serving_started_time',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='serving_ticket',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
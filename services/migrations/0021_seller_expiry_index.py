@@ -0,0 +1,17 @@
+# Generated by Django 3.1.6 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0020_queue_tickets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='seller',
+            index=models.Index(fields=['wait_time', 'serving_started_time'], name='seller_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.6 on 2026-10-18 14:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0021_seller_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productsearchtoken',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='services.product'),
+        ),
+        migrations.AddIndex(
+            model_name='productsearchtoken',
+            index=models.Index(fields=['product', 'token', 'weight'], name='product_search_product_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.6 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0022_product_search_product_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='skipped_tickets',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
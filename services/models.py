@@ -1,13 +1,17 @@
 import os
 import datetime
+from decimal import Decimal, ROUND_HALF_UP
 
 from django.db import models
 from django.urls import reverse
 from django.conf import settings
-from django.db.models import Avg
+from django.db.models import Count
+from django.core.validators import MinValueValidator, MaxValueValidator
 
 from autoslug import AutoSlugField
 from core.utils import resize_image
+from services.opening import minute_of_week, compile_intervals
+from services.geo import grid_cell
 
 
 class Service(models.Model):
@@ -27,11 +31,54 @@ class Service(models.Model):
         return self.name
 
 
+class ServiceStatistics(models.Model):
+    """Denormalized per-service counters, kept up to date by services.signals."""
+    service = models.OneToOneField(Service, related_name="statistics", on_delete=models.CASCADE)
+    sellers = models.IntegerField(default=0)
+    categories = models.IntegerField(default=0)
+    products = models.IntegerField(default=0)
+    reviews = models.IntegerField(default=0)
+
+    COUNTERS = ('sellers', 'categories', 'products', 'reviews')
+
+    class Meta:
+        verbose_name = 'service statistics'
+        verbose_name_plural = 'service statistics'
+
+    def __str__(self):
+        return "{0} statistics".format(self.service.name)
+
+    @classmethod
+    def compute(cls):
+        """Counts everything from scratch, returns {service_id: {counter: value}}."""
+        counters = {pk: dict.fromkeys(cls.COUNTERS, 0) for pk in Service.objects.values_list('pk', flat=True)}
+        querysets = {
+            'sellers': Seller.objects.values('service').annotate(n=Count('pk')),
+            'categories': Category.objects.values('service').annotate(n=Count('pk')),
+            'products': Seller.objects.values('service').annotate(n=Count('products')),
+            'reviews': Seller.objects.values('service').annotate(n=Count('reviews')),
+        }
+        for counter, queryset in querysets.items():
+            for row in queryset:
+                counters[row['service']][counter] = row['n']
+        return counters
+
+
 DELIVERY_TYPES = (
     ('F', 'Free Delivery'),
     ('P', 'Paid Delivery'),
 )
 
+WEEKDAYS = (
+    (0, 'Monday'),
+    (1, 'Tuesday'),
+    (2, 'Wednesday'),
+    (3, 'Thursday'),
+    (4, 'Friday'),
+    (5, 'Saturday'),
+    (6, 'Sunday'),
+)
+
 def seller_image_path(instance, filename):
     return 'sellers/{0}/{1}'.format(instance.service.name, filename)
 
@@ -55,6 +102,38 @@ class Seller(models.Model):
     open_time = models.TimeField(default=datetime.time(9, 00))
     close_time = models.TimeField(default=datetime.time(22, 00))
     delivery = models.CharField(choices=DELIVERY_TYPES, max_length=1, default='F')
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    # Grid bucket of the location for nearby searches, see services.geo.
+    grid_row = models.IntegerField(null=True, editable=False)
+    grid_column = models.IntegerField(null=True, editable=False)
+
+    # Running review aggregate and 1-5 star histogram, maintained by services.signals.
+    review_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.DecimalField(default=0, max_digits=10, decimal_places=1, editable=False)
+    rating_1 = models.IntegerField(default=0, editable=False)
+    rating_2 = models.IntegerField(default=0, editable=False)
+    rating_3 = models.IntegerField(default=0, editable=False)
+    rating_4 = models.IntegerField(default=0, editable=False)
+    rating_5 = models.IntegerField(default=0, editable=False)
+
+    # Booking queue of tickets, maintained by bookings.queue. Waiting bookings hold the tickets
+    # after serving_ticket up to next_ticket, the last one issued, but skipped_tickets of them
+    # that bookings left while waiting.
+    next_ticket = models.IntegerField(default=0, editable=False)
+    serving_ticket = models.IntegerField(default=0, editable=False)
+    active_bookings = models.IntegerField(default=0, editable=False)
+    serving_started_time = models.DateTimeField(null=True, editable=False)
+    skipped_tickets = models.IntegerField(default=0, editable=False)
+
+    RATING_FIELDS = ('review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+    QUEUE_FIELDS = ('next_ticket', 'serving_ticket', 'active_bookings', 'serving_started_time', 'skipped_tickets')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['service', 'grid_row', 'grid_column', 'latitude', 'longitude'], name='seller_grid_idx'),
+            models.Index(fields=['wait_time', 'serving_started_time'], name='seller_expiry_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -63,6 +142,15 @@ class Seller(models.Model):
         return '/seller/{0}/'.format(self.service.slug)
 
     def save(self, *args, **kwargs):
+        self.grid_row, self.grid_column = (None, None)
+        if self.latitude is not None and self.longitude is not None:
+            self.grid_row, self.grid_column = grid_cell(self.latitude, self.longitude)
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            # Counters are updated in place by other requests, a stale instance must not write them back.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS + self.QUEUE_FIELDS
+            ]
         super().save(*args, **kwargs)
         resize_image(self.image, size=(1000, 300), thumbnail=True)
 
@@ -75,10 +163,78 @@ class Seller(models.Model):
 
     @property
     def rating(self):
-        if self.reviews.exists():
-            return float("{:.1f}".format(self.reviews.aggregate(Avg('rating'))['rating__avg']))
+        if self.review_count:
+            return float("{:.1f}".format(self.rating_sum / self.review_count))
         return 0.0
 
+    def is_open_at(self, now):
+        minute = minute_of_week(now)
+        return self.open_intervals.filter(start__lte=minute, end__gt=minute).exists()
+
+    def compile_opening_hours(self):
+        """Rebuilds open_intervals from the weekly hours, or from open_time/close_time every day without them."""
+        hours = [(day.weekday, day.open_time, day.close_time) for day in self.opening_hours.all()]
+        if not hours:
+            hours = [(weekday, self.open_time, self.close_time) for weekday, name in WEEKDAYS]
+        self.open_intervals.all().delete()
+        OpeningInterval.objects.bulk_create([
+            OpeningInterval(seller=self, start=start, end=end) for start, end in compile_intervals(hours)
+        ])
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, 'rating_{0}'.format(star)) for star in range(1, 6)}
+
+    @staticmethod
+    def star_field(rating):
+        """Histogram column a rating falls into, half stars round up."""
+        star = int(Decimal(rating).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+        return 'rating_{0}'.format(min(max(star, 1), 5))
+
+    @classmethod
+    def compute_ratings(cls):
+        """Aggregates reviews from scratch, returns {seller_id: {field: value}}."""
+        ratings = {}
+        rows = cls.objects.values('pk', 'reviews__rating').annotate(n=Count('reviews'))
+        for row in rows:
+            values = ratings.setdefault(row['pk'], dict.fromkeys(cls.RATING_FIELDS, 0))
+            if row['n']:
+                rating = Decimal(row['reviews__rating'])
+                values['review_count'] += row['n']
+                values['rating_sum'] += rating * row['n']
+                values[cls.star_field(rating)] += row['n']
+        return ratings
+
+
+class OpeningHours(models.Model):
+    """Weekly schedule of a seller, hours closing at or before they open run past midnight."""
+    seller = models.ForeignKey(Seller, related_name="opening_hours", on_delete=models.CASCADE)
+    weekday = models.IntegerField(choices=WEEKDAYS)
+    open_time = models.TimeField()
+    close_time = models.TimeField()
+
+    class Meta:
+        verbose_name_plural = 'opening hours'
+        ordering = ('weekday', 'open_time')
+
+    def __str__(self):
+        return "{0} {1} {2}-{3}".format(self.seller, self.get_weekday_display(), self.open_time, self.close_time)
+
+
+class OpeningInterval(models.Model):
+    """Compiled opening hours as [start, end) minutes since Monday 00:00, see Seller.compile_opening_hours."""
+    seller = models.ForeignKey(Seller, related_name="open_intervals", on_delete=models.CASCADE)
+    start = models.IntegerField()
+    end = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start', 'end', 'seller'], name='opening_interval_idx'),
+        ]
+
+    def __str__(self):
+        return "{0} {1}-{2}".format(self.seller, self.start, self.end)
+
 
 class Category(models.Model):
     service = models.ForeignKey(Service, related_name="categories", on_delete=models.CASCADE)
@@ -127,3 +283,74 @@ class Product(models.Model):
         basename = os.path.basename(image_path)
         return os.path.join(dirname, 'thumbnail', basename)
 
+
+
+class CategorySeller(models.Model):
+    """Sellers having products in a category, kept up to date by services.signals."""
+    category = models.ForeignKey(Category, related_name="seller_memberships", on_delete=models.CASCADE)
+    seller = models.ForeignKey(Seller, related_name="category_memberships", on_delete=models.CASCADE)
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('category', 'seller')
+
+    def __str__(self):
+        return "{0} - {1} ({2})".format(self.category, self.seller, self.product_count)
+
+    @classmethod
+    def compute(cls):
+        """Counts products from scratch, returns {(category_id, seller_id): product_count}."""
+        rows = Product.objects.filter(category__isnull=False).values('category', 'seller').annotate(n=Count('pk'))
+        return {(row['category'], row['seller']): row['n'] for row in rows}
+
+
+class ProductSearchToken(models.Model):
+    """Inverted index over product text, one row per (token, product), see services.search."""
+    # Indexed by product_search_product_idx, which also serves the foreign key.
+    product = models.ForeignKey(Product, related_name="search_tokens", on_delete=models.CASCADE, db_index=False)
+    token = models.CharField(max_length=50)
+    weight = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'product', 'weight'], name='product_search_token_idx'),
+            models.Index(fields=['product', 'token', 'weight'], name='product_search_product_idx'),
+        ]
+
+    def __str__(self):
+        return "{0} ({1})".format(self.token, self.product_id)
+
+
+class ProductPopularity(models.Model):
+    """
+    Time-decayed popularity of a product, see services.popularity.
+
+    score is kept as log(weight) + t / tau, summed with logaddexp, so older events fade
+    without ever rewriting existing rows and comparing scores compares decayed popularity.
+    """
+    product = models.OneToOneField(Product, related_name="popularity", on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name="+", on_delete=models.SET_NULL, null=True)
+    score = models.FloatField()
+
+    class Meta:
+        verbose_name_plural = 'product popularities'
+        indexes = [
+            models.Index(fields=['category', 'score'], name='product_popularity_rank_idx'),
+        ]
+
+    def __str__(self):
+        return "{0} ({1:.2f})".format(self.product, self.score)
+
+
+class PopularProduct(models.Model):
+    """Stored top-N list of a category, rebuilt from ProductPopularity."""
+    category = models.ForeignKey(Category, related_name="popular_products", on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name="+", on_delete=models.CASCADE)
+    rank = models.IntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('category', 'rank')
+
+    def __str__(self):
+        return "{0} #{1}: {2}".format(self.category, self.rank, self.product)
@@ -0,0 +1,35 @@
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_week(time, weekday=0):
+    """Minutes since Monday 00:00 of a datetime, or of a time on the given weekday."""
+    if hasattr(time, 'weekday'):
+        weekday, time = time.weekday(), time.time()
+    return weekday * MINUTES_PER_DAY + time.hour * 60 + time.minute
+
+
+def compile_intervals(hours):
+    """
+    Turns (weekday, open_time, close_time) rows into sorted, merged [start, end) minute of
+    week intervals. A close time at or before the open time runs into the next day, equal
+    times mean open around the clock, and Sunday night wraps around to Monday morning.
+    """
+    intervals = []
+    for weekday, open_time, close_time in hours:
+        start = minute_of_week(open_time, weekday)
+        end = minute_of_week(close_time, weekday)
+        if end <= start:
+            end += MINUTES_PER_DAY
+        if end > MINUTES_PER_WEEK:
+            intervals.append((0, end - MINUTES_PER_WEEK))
+            end = MINUTES_PER_WEEK
+        intervals.append((start, end))
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,128 @@
+import logging
+import math
+import random
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+
+from services.models import ProductPopularity, PopularProduct
+from bookings.models import Booking, OrderItem
+
+
+logger = logging.getLogger(__name__)
+
+# An order from a week ago counts half as much as one from today.
+HALF_LIFE = timedelta(days=7)
+TAU = HALF_LIFE.total_seconds() / math.log(2)
+EPOCH = datetime(2021, 1, 1)
+
+QUANTITY_WEIGHT = 1.0   # per ordered unit
+BOOKING_WEIGHT = 2.0    # per completed booking the product was part of
+
+TOP_N = 27              # products stored per category, the bucket popular lists are sampled from
+BATCH_SIZE = 5000
+
+# Held for a whole run so overlapping runs don't score the same bookings twice. Expires in
+# case a run dies without releasing it, long after any run would have finished.
+LOCK_KEY = 'lock:update-popularity'
+LOCK_TIMEOUT = 60 * 60
+
+
+def logaddexp(a, b):
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def event_score(weight, time):
+    """Log-scale score of an event, later events get a proportionally higher score."""
+    return math.log(weight) + (time - EPOCH).total_seconds() / TAU
+
+
+def update_popularity(batch_size=BATCH_SIZE):
+    """
+    Adds paid bookings that haven't been scored yet to product popularity and refreshes
+    the top lists of the categories that changed. Returns the number of bookings processed,
+    None if another run is still going.
+    """
+    if not cache.add(LOCK_KEY, True, LOCK_TIMEOUT):
+        logger.info('Popularity update skipped, another run holds the lock.')
+        return None
+    try:
+        return score_bookings(batch_size)
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def score_bookings(batch_size):
+    processed = 0
+    categories = set()
+
+    while True:
+        with transaction.atomic():
+            bookings = list(
+                Booking.objects.filter(status='paid', scored=False).values_list('pk', flat=True)[:batch_size]
+            )
+            if not bookings:
+                break
+
+            items = OrderItem.objects.filter(order__booking__in=bookings).values_list(
+                'product', 'product__category', 'quantity', 'order__booking__booked_time'
+            )
+            gains = {}
+            for product, category, quantity, time in items:
+                score = event_score(QUANTITY_WEIGHT * quantity + BOOKING_WEIGHT, time)
+                if product in gains:
+                    score = logaddexp(gains[product][1], score)
+                gains[product] = (category, score)
+
+            existing = ProductPopularity.objects.in_bulk(gains.keys(), field_name='product_id')
+            created = []
+            for product, (category, score) in gains.items():
+                if product in existing:
+                    popularity = existing[product]
+                    popularity.score = logaddexp(popularity.score, score)
+                    popularity.category_id = category
+                else:
+                    created.append(ProductPopularity(product_id=product, category_id=category, score=score))
+                categories.add(category)
+
+            ProductPopularity.objects.bulk_update(existing.values(), ['score', 'category'], batch_size=1000)
+            ProductPopularity.objects.bulk_create(created, batch_size=1000)
+            Booking.objects.filter(pk__in=bookings).update(scored=True)
+            processed += len(bookings)
+
+    categories.discard(None)
+    rebuild_popular_products(categories)
+    return processed
+
+
+def rebuild_popular_products(categories):
+    """Replaces the stored top-N lists of the given category ids."""
+    for category in categories:
+        top = ProductPopularity.objects.filter(category=category).order_by('-score', 'product').values_list(
+            'product', 'score'
+        )[:TOP_N]
+        with transaction.atomic():
+            PopularProduct.objects.filter(category=category).delete()
+            PopularProduct.objects.bulk_create([
+                PopularProduct(category_id=category, product_id=product, rank=rank, score=score)
+                for rank, (product, score) in enumerate(top, 1)
+            ])
+
+
+def sample_popular(entries, k, rng=random):
+    """
+    Picks k entries without replacement, each with probability proportional to its
+    decayed popularity (Efraimidis-Spirakis), so the list varies but favours the top.
+    """
+    if len(entries) <= k:
+        return list(entries)
+    top_score = max(entry.score for entry in entries)
+    # Clamped so that weights of long forgotten products don't underflow to zero.
+    keyed = [
+        (math.log(1.0 - rng.random()) / math.exp(max(entry.score - top_score, -700)), entry)
+        for entry in entries
+    ]
+    keyed.sort(key=lambda pair: pair[0], reverse=True)
+    return [entry for key, entry in keyed[:k]]
@@ -0,0 +1,145 @@
+import re
+
+from django.db.models import Case, F, IntegerField, Max, Q, Value, When
+
+from services.models import Product, ProductSearchToken
+
+
+TOKEN_RE = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 50
+MAX_QUERY_TOKENS = 5
+MAX_CANDIDATES = 2000   # products of the rarest query token a search looks at
+
+# A hit in the name counts twice as much as one in the category or seller name, and so on.
+FIELD_WEIGHTS = (
+    ('name', 8),
+    ('category', 4),
+    ('seller', 4),
+    ('description', 1),
+)
+
+
+def tokenize(text):
+    """Lowercased word tokens of text, in order, without duplicates."""
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        token = token[:MAX_TOKEN_LENGTH]
+        if len(token) >= MIN_TOKEN_LENGTH and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def product_tokens(product):
+    """Returns {token: weight} for a product with seller and category already loaded."""
+    texts = {
+        'name': product.name,
+        'category': product.category.name if product.category_id else '',
+        'seller': product.seller.name,
+        'description': product.description,
+    }
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(texts[field]):
+            weights[token] = weights.get(token, 0) + weight
+    return weights
+
+
+def index_products(products):
+    """(Re)builds the index rows of the given products with one delete and one insert."""
+    products = list(products)
+    ProductSearchToken.objects.filter(product__in=[product.pk for product in products]).delete()
+    ProductSearchToken.objects.bulk_create([
+        ProductSearchToken(product=product, token=token, weight=weight)
+        for product in products
+        for token, weight in product_tokens(product).items()
+    ], batch_size=1000)
+
+
+def prefix(token):
+    return Q(token__gte=token, token__lt=token + '\uffff')
+
+
+def matches(keyword, products=None, bounded=True):
+    """
+    (index rows of the products matching keyword grouped per product with their score,
+    whether candidates were left out), None instead of rows if keyword has no tokens.
+
+    Every query token is matched as a prefix, so "piz" finds "pizza", and a product must
+    match all of them. The score sums the field weights of the best hit per query token.
+    The intersection starts from the rarest token. When bounded, only MAX_CANDIDATES of its
+    products are candidates, the ones it weighs the most in, so common words cost about the
+    same as rare ones. products is a Product queryset to search in, applied before the bound.
+    """
+    tokens = tokenize(keyword)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return None, False
+
+    postings = ProductSearchToken.objects.all()
+    if products is not None:
+        postings = postings.filter(product__in=products.values('pk'))
+
+    # Posting list lengths, counted no further than the bound.
+    counts = {token: postings.filter(prefix(token))[:MAX_CANDIDATES + 1].count() for token in tokens}
+    tokens.sort(key=counts.get)
+
+    rarest = postings.filter(prefix(tokens[0]))
+    candidates = rarest.values('product')
+    truncated = False
+    if bounded and counts[tokens[0]] > MAX_CANDIDATES:
+        # The products the rarest token weighs the most in. A prefix that hits several tokens
+        # can list a product more than once, those are ranked by their best hit.
+        truncated = candidates.distinct()[:MAX_CANDIDATES + 1].count() > MAX_CANDIDATES
+        tokens_hit = rarest.order_by('token').values_list('token', flat=True)
+        if tokens_hit.first() == tokens_hit.last():
+            candidates = candidates.order_by('-weight', 'product')[:MAX_CANDIDATES]
+        else:
+            candidates = candidates.annotate(best=Max('weight')).order_by('-best', 'product').values('product')[:MAX_CANDIDATES]
+
+    hits = {
+        'hit{0}'.format(i): Max(Case(When(prefix(token), then=F('weight')), default=Value(0), output_field=IntegerField()))
+        for i, token in enumerate(tokens)
+    }
+    any_token = prefix(tokens[0])
+    for token in tokens[1:]:
+        any_token |= prefix(token)
+
+    rows = (
+        postings
+        .filter(any_token, product__in=candidates)
+        .values('product')
+        .annotate(**hits)
+        .filter(**{'{0}__gt'.format(name): 0 for name in hits})
+        .annotate(score=sum((F(name) for name in hits), Value(0)))
+    )
+    return rows, truncated
+
+
+def search(keyword, offset=0, limit=20):
+    """
+    Returns a list of (product_id, score) ordered by relevance and whether matches were left
+    out, see matches(). Only index rows are touched, the products table is read afterwards
+    for the page alone.
+    """
+    rows, truncated = matches(keyword)
+    if rows is None:
+        return [], False
+    return list(rows.order_by('-score', 'product').values_list('product', 'score')[offset:offset + limit]), truncated
+
+
+def search_filter(keyword, products=None):
+    """
+    Q limiting a product queryset to the ones matching keyword, unranked. Every match is
+    included, pass the queryset as products to keep the scan to it.
+    """
+    rows, truncated = matches(keyword, products, bounded=False)
+    if rows is None:
+        return Q(pk__in=[])
+    return Q(pk__in=rows.values('product'))
+
+
+def search_products(keyword, offset=0, limit=20):
+    """Same as search() but returns Product instances with seller and category loaded."""
+    ranking, truncated = search(keyword, offset, limit)
+    products = Product.objects.select_related('seller', 'category').in_bulk([pk for pk, score in ranking])
+    return [products[pk] for pk, score in ranking if pk in products], truncated
@@ -1,4 +1,3 @@
-from django.db.models import Avg
 from rest_framework import serializers
 from datetime import datetime
 
@@ -7,30 +6,57 @@ from bookings.models import Review, OrderItem, Order, Booking
 from variants.models import Table, TimeSlot
 
 
-class ServiceSerializer(serializers.ModelSerializer):
-    sellers = serializers.SerializerMethodField('get_seller_count')
-    categories = serializers.SerializerMethodField('get_category_count')
-    products = serializers.SerializerMethodField('get_product_count')
-    reviews = serializers.SerializerMethodField('get_review_count')
+def query_list(request, name):
+    """Comma separated query parameter as a list, None when it isn't given at all."""
+    if name not in request.query_params:
+        return None
+    return [value.strip() for value in request.query_params[name].split(',') if value.strip()]
+
+
+class DynamicFieldsMixin:
+    """
+    Lets clients choose fields with ?fields=name,slug and ?expand=variants.
+
+    Meta.expandable_fields are the expensive ones. Without parameters everything is returned
+    but Meta.optional_fields, which are only returned when asked for; with ?fields= only the
+    listed fields are, expandable and optional ones included when listed in either parameter;
+    with ?expand= alone the cheap fields plus the listed expandable and optional ones are.
+    Fields are dropped before serialization, so unrequested method fields never run.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        optional = set(getattr(self.Meta, 'optional_fields', ()))
+        fields = query_list(request, 'fields') if request is not None else None
+        expand = query_list(request, 'expand') if request is not None else None
+
+        expandable = set(getattr(self.Meta, 'expandable_fields', ())) | optional
+        if fields is None and expand is None:
+            allowed = set(self.fields) - optional
+        elif fields is None:
+            allowed = set(self.fields) - expandable
+        else:
+            allowed = set(fields)
+        allowed |= set(expand or ()) & expandable
+
+        for name in list(self.fields):
+            if name not in allowed:
+                self.fields.pop(name)
+
+
+class ServiceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """ Counters come from ServiceStatistics, select_related('statistics') to avoid a query per service. """
+    sellers = serializers.IntegerField(source='statistics.sellers')
+    categories = serializers.IntegerField(source='statistics.categories')
+    products = serializers.IntegerField(source='statistics.products')
+    reviews = serializers.IntegerField(source='statistics.reviews')
     
     class Meta:
         model = Service
         fields = ('name', 'slug', 'image', 'sellers', 'categories', 'products', 'reviews')
-    
-    def get_review_count(self, service):
-        return Review.objects.filter(seller__service=service).count()
-    
-    def get_seller_count(self, service):
-        return service.sellers.count()
-    
-    def get_category_count(self, service):
-        return service.categories.count()
-    
-    def get_product_count(self, service):
-        return Product.objects.filter(seller__service=service).count()
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sellers = serializers.SerializerMethodField('get_seller_count')
 
     class Meta:
@@ -38,10 +64,13 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ('name', 'slug', 'image', 'sellers')
 
     def get_seller_count(self, category):
-        return Seller.objects.filter(products__category=category).distinct().count()
+        # Annotated by CategoryListAPIView, counted from the memberships otherwise.
+        if hasattr(category, 'seller_count'):
+            return category.seller_count
+        return category.seller_memberships.count()
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     seller = serializers.SerializerMethodField()
 
     class Meta:
@@ -52,7 +81,18 @@ class ProductSerializer(serializers.ModelSerializer):
         return product.seller.slug
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductSearchSerializer(serializers.ModelSerializer):
+    """ Lightweight search hit, expects seller and category to be loaded already. """
+    image = serializers.CharField(source='thumbnail')
+    seller = serializers.CharField(source='seller.slug')
+    category = serializers.CharField(source='category.name', default=None)
+
+    class Meta:
+        model = Product
+        fields = ('name', 'slug', 'image', 'price', 'seller', 'category')
+
+
+class ProductDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     related_products = serializers.SerializerMethodField()
     variants = serializers.SerializerMethodField()
     seller = serializers.SerializerMethodField()
@@ -60,13 +100,14 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ('name', 'slug', 'seller', 'image', 'description', 'price', 'related_products', 'variants')
+        expandable_fields = ('related_products', 'variants')
 
     def get_seller(self, product):
         return product.seller.slug
     
+    # Related objects are read through .all() so prefetched querysets need no extra queries.
     def get_related_products(self, product):
-        seller = product.seller
-        products = seller.products.filter(seller=seller).exclude(id=product.id)
+        products = [related for related in product.seller.products.all() if related.id != product.id]
         serializer = ProductThumbnailSerializer(instance=products, many=True)
         return serializer.data
 
@@ -74,7 +115,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         variants_dict = dict()
         variations = product.variations.all()
         for variation in variations:
-            product_variations = variation.product_variations.all().values('id', 'value')
+            product_variations = [{'id': v.id, 'value': v.value} for v in variation.product_variations.all()]
             variants_dict[variation.name] = product_variations
 
         return variants_dict
@@ -89,10 +130,10 @@ class ProductThumbnailSerializer(serializers.ModelSerializer):
         fields = ('name', 'image', 'slug', 'category')
     
     def get_category(self, product):
-        return product.category.name
+        return product.category.name if product.category_id else None
 
 
-class SellerSerializer(serializers.ModelSerializer):
+class SellerSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     rating = serializers.SerializerMethodField('get_rating')
     reviews = serializers.SerializerMethodField('get_reviews')
     image = serializers.CharField(source='thumbnail')
@@ -103,18 +144,27 @@ class SellerSerializer(serializers.ModelSerializer):
         fields = ('name', 'slug', 'image', 'address', 'rating', 'reviews', 'delivery')
     
     def get_rating(self, seller):
-        if seller.reviews.all().exists():
-            return "{:.1f}".format(Review.objects.filter(seller=seller).aggregate(Avg('rating'))['rating__avg'])
-        else:
-            return "0.0"
+        return "{:.1f}".format(seller.rating)
     
     def get_reviews(self, seller):
-        return seller.reviews.count()
+        return seller.review_count
+
 
+class NearbySellerSerializer(SellerSerializer):
+    """ Expects the distance attribute set by services.geo.nearest_sellers. """
+    distance = serializers.SerializerMethodField()
 
-class SellerDetailSerializer(serializers.ModelSerializer):
+    class Meta(SellerSerializer.Meta):
+        fields = SellerSerializer.Meta.fields + ('latitude', 'longitude', 'distance')
+
+    def get_distance(self, seller):
+        return round(seller.distance, 3)
+
+
+class SellerDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     reviews = serializers.SerializerMethodField()
     products = serializers.SerializerMethodField()
+    menu = serializers.SerializerMethodField()
     categories = serializers.SerializerMethodField()
     has_tables = serializers.SerializerMethodField()
     open = serializers.SerializerMethodField('is_open')
@@ -122,27 +172,40 @@ class SellerDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Seller
-        fields = ('image', 'name', 'description', 'address', 'rating', 'reviews', 'has_tables', 'open', 'products', 'categories', 'delivery')
+        fields = ('image', 'name', 'description', 'address', 'rating', 'reviews', 'has_tables', 'open', 'products', 'menu', 'categories', 'delivery')
+        expandable_fields = ('products', 'categories')
+        # The products again grouped by category, only with ?expand=menu.
+        optional_fields = ('menu',)
     
     def get_reviews(self, seller):
-        return seller.reviews.count()
+        return seller.review_count
     
+    # SellerDetailAPIView prefetches products with their category, so the menu size costs no queries.
     def get_products(self, seller):
-        products = seller.products
-        serializer = ProductThumbnailSerializer(instance=products, many=True)
+        serializer = ProductThumbnailSerializer(instance=seller.products.all(), many=True)
         return serializer.data
+
+    def get_menu(self, seller):
+        """Products grouped by category, categories by name and uncategorized products last."""
+        groups = {}
+        for product in seller.products.all():
+            groups.setdefault(product.category, []).append(product)
+
+        categories = sorted(groups, key=lambda category: (category is None, category.name if category else ''))
+        return [
+            {
+                'category': category.name if category else None,
+                'slug': category.slug if category else None,
+                'products': ProductThumbnailSerializer(instance=groups[category], many=True).data,
+            }
+            for category in categories
+        ]
     
     def get_categories(self, seller):
-        categories = Category.objects.filter(products__seller=seller).distinct()
-        return [category.name for category in categories]
+        return [membership.category.name for membership in seller.category_memberships.all()]
     
     def is_open(self, seller):
-        open_time = seller.open_time
-        close_time = seller.close_time
-        now = datetime.now().time()
-        if now >= open_time and now <= close_time:
-            return True
-        return False
+        return seller.is_open_at(datetime.now())
 
     def get_has_tables(self, seller):
         return seller.tables.exists()
@@ -154,7 +217,7 @@ class TableListSerializer(serializers.ModelSerializer):
         fields = ('id', 'row', 'col', 'seats')
 
 
-class TimeslotListSerializer(serializers.ModelSerializer):
+class TimeslotListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     start = serializers.SerializerMethodField()
     class Meta:
         model = TimeSlot
@@ -164,20 +227,20 @@ class TimeslotListSerializer(serializers.ModelSerializer):
         return timeslot.start.strftime('%H:%M')
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     seller = serializers.SerializerMethodField()
     order_items = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
         fields = ('seller', 'order_items')
+        expandable_fields = ('order_items',)
     
     def get_seller(self, order):
         return order.seller.name
     
     def get_order_items(self, order):
-        order_items = order.order_items
-        serializer = OrderItemSerializer(instance=order_items, many=True)
+        serializer = OrderItemSerializer(instance=order.order_items.all(), many=True)
         return serializer.data
 
 
@@ -191,11 +254,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ('id', 'product', 'image', 'quantity', 'price', 'total')
     
+    # Read through .all() so order_items_prefetch() in services.views covers every item.
     def get_product(self, order_item):
         product_name = order_item.product.name
-        if order_item.product_variations.exists():
+        product_variations = order_item.product_variations.all()
+        if product_variations:
             variations = []
-            for v in order_item.product_variations.all():
+            for v in product_variations:
                 variations.append("{0}: {1}".format(v.variation.name, v.value))
             variation_name = ', '.join(variations)
             return product_name + " (" + variation_name + ")"
@@ -209,7 +274,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return order_item.product.price
 
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     seller = serializers.SerializerMethodField()
     order_items = serializers.SerializerMethodField()
     status = serializers.CharField(source='get_status_display')
@@ -217,11 +282,11 @@ class BookingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Booking
         fields = ('id', 'seller', 'status', 'order_items')
+        expandable_fields = ('order_items',)
     
     def get_seller(self, booking):
         return booking.seller.name
     
     def get_order_items(self, booking):
-        order_items = booking.order.order_items
-        serializer = OrderItemSerializer(instance=order_items, many=True)
+        serializer = OrderItemSerializer(instance=booking.order.order_items.all(), many=True)
         return serializer.data
\ No newline at end of file
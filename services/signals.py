@@ -1,32 +1,289 @@
 import os
-from django.db.models.signals import pre_save
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
 
-from services.models import Service, Seller, Category, Product
+from services.models import (
+    Service, ServiceStatistics, Seller, OpeningHours, Category, CategorySeller, Product, ProductPopularity,
+    PopularProduct,
+)
+from services.search import index_products
+from bookings.models import Booking, Review
+from bookings import queue
+from variants.models import Table, TimeSlot, Variation, ProductVariation
 from users.models import User
+from core.cache import (
+    bump_versions, SERVICES_SCOPE, SERVICE_SELLERS_SCOPE, SERVICE_CATEGORIES_SCOPE, SERVICE_PRODUCTS_SCOPE, SELLER_SCOPE,
+    NAVIGATION_SCOPE,
+)
 
 
 @receiver(pre_save, sender=Service)
 @receiver(pre_save, sender=Seller)
 @receiver(pre_save, sender=Category)
 @receiver(pre_save, sender=Product)
-def delete_old_image_file(sender, instance, **kwargs):
+def remember_old_instance(sender, instance, **kwargs):
+    """Loads the stored row once, for the handlers comparing it with the new values."""
+    instance._old_instance = sender.objects.filter(pk=instance.pk).first() if instance.pk else None
+    delete_old_image_file(instance._old_instance, instance)
+
+
+def delete_old_image_file(old_instance, instance):
+    if old_instance is not None:
+        old_image = old_instance.image
+        new_image = instance.image
+        if old_image and old_image.url != new_image.url:
+            img_path = old_image.path
+            old_image.delete(save=False)
+            
+            dirname = os.path.dirname(img_path)
+            filename = os.path.basename(img_path)
+            thumb_path = os.path.join(dirname, "thumbnail", filename)
+            if os.path.exists(thumb_path):
+                os.remove(thumb_path)
+
+
+@receiver(post_save, sender=Service)
+def create_service_statistics(sender, instance, created, **kwargs):
+    if created:
+        ServiceStatistics.objects.get_or_create(service=instance)
+
+
+def change_service_statistics(instance, delta):
+    """Products and reviews only know their seller, so filter through it instead of loading it."""
+    if isinstance(instance, Seller):
+        counter, lookup = 'sellers', {'service_id': instance.service_id}
+    elif isinstance(instance, Category):
+        counter, lookup = 'categories', {'service_id': instance.service_id}
+    elif isinstance(instance, Product):
+        counter, lookup = 'products', {'service__sellers': instance.seller_id}
+    else:
+        counter, lookup = 'reviews', {'service__sellers': instance.seller_id}
+    ServiceStatistics.objects.filter(**lookup).update(**{counter: F(counter) + delta})
+
+
+@receiver(post_save, sender=Seller)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Review)
+def increase_service_statistics(sender, instance, created, **kwargs):
+    if created:
+        change_service_statistics(instance, 1)
+
+
+@receiver(post_delete, sender=Seller)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Review)
+def decrease_service_statistics(sender, instance, **kwargs):
+    change_service_statistics(instance, -1)
+
+
+def change_seller_rating(seller_id, rating, delta):
+    star = Seller.star_field(rating)
+    Seller.objects.filter(pk=seller_id).update(
+        review_count=F('review_count') + delta,
+        rating_sum=F('rating_sum') + Decimal(rating) * delta,
+        **{star: F(star) + delta}
+    )
+
+
+@receiver(pre_save, sender=Review)
+def remember_old_rating(sender, instance, **kwargs):
+    instance._old_rating = None
     if instance.pk:
-        try:
-            old_image = sender.objects.get(pk=instance.pk).image
-        except sender.DoesNotExist:
-            return
-        else:
-            new_image = instance.image
-            if old_image and old_image.url != new_image.url:
-                img_path = old_image.path
-                old_image.delete(save=False)
-                
-                dirname = os.path.dirname(img_path)
-                filename = os.path.basename(img_path)
-                thumb_path = os.path.join(dirname, "thumbnail", filename)
-                if os.path.exists(thumb_path):
-                    os.remove(thumb_path)
+        instance._old_rating = Review.objects.filter(pk=instance.pk).values_list('seller_id', 'rating').first()
+
+
+@receiver(post_save, sender=Review)
+def update_seller_rating(sender, instance, created, **kwargs):
+    """Review.save() runs in a transaction, so the seller aggregate moves together with the review."""
+    old_rating = getattr(instance, '_old_rating', None)
+    if old_rating:
+        change_seller_rating(*old_rating, -1)
+    change_seller_rating(instance.seller_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def remove_seller_rating(sender, instance, **kwargs):
+    change_seller_rating(instance.seller_id, instance.rating, -1)
+
+
+@receiver(post_delete, sender=Booking)
+def remove_from_queue(sender, instance, **kwargs):
+    """Bookings deleted with their order or user leave the queue like canceled ones."""
+    queue.remove(instance)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    index_products([instance])
+
+
+@receiver(post_save, sender=Seller)
+@receiver(post_save, sender=Category)
+def reindex_products(sender, instance, created, **kwargs):
+    """Seller and category names are indexed with their products."""
+    old_instance = getattr(instance, '_old_instance', None)
+    if not created and (old_instance is None or old_instance.name != instance.name):
+        index_products(instance.products.select_related('seller', 'category'))
+
+
+@receiver(post_save, sender=Product)
+def move_product_popularity(sender, instance, created, **kwargs):
+    """A product moved to another category takes its popularity along and leaves the old top list."""
+    if not created:
+        ProductPopularity.objects.filter(product=instance).exclude(category=instance.category_id).update(category=instance.category_id)
+        PopularProduct.objects.filter(product=instance).exclude(category=instance.category_id).delete()
+
+
+def change_category_seller(category_id, seller_id, delta):
+    if category_id is None:
+        return
+    memberships = CategorySeller.objects.filter(category_id=category_id, seller_id=seller_id)
+    if not memberships.update(product_count=F('product_count') + delta) and delta > 0:
+        # The first products of a pair saved at once all get here, get_or_create() settles on one row.
+        CategorySeller.objects.get_or_create(category_id=category_id, seller_id=seller_id)
+        memberships.update(product_count=F('product_count') + delta)
+    elif delta < 0:
+        memberships.filter(product_count__lte=0).delete()
+
+
+@receiver(post_save, sender=Product)
+def update_category_seller(sender, instance, created, **kwargs):
+    membership = (instance.category_id, instance.seller_id)
+    old_instance = getattr(instance, '_old_instance', None)
+    old_membership = (old_instance.category_id, old_instance.seller_id) if old_instance else None
+    if old_membership == membership:
+        return
+    if old_membership:
+        change_category_seller(*old_membership, -1)
+    change_category_seller(*membership, 1)
+
+
+@receiver(post_delete, sender=Product)
+def remove_category_seller(sender, instance, **kwargs):
+    change_category_seller(instance.category_id, instance.seller_id, -1)
+
+
+@receiver(post_save, sender=Seller)
+def compile_seller_hours(sender, instance, created, **kwargs):
+    """Sellers without weekly hours are open from open_time to close_time every day."""
+    old_instance = getattr(instance, '_old_instance', None)
+    if created or old_instance is None or \
+            (old_instance.open_time, old_instance.close_time) != (instance.open_time, instance.close_time):
+        instance.compile_opening_hours()
+
+
+@receiver(post_save, sender=OpeningHours)
+@receiver(post_delete, sender=OpeningHours)
+def compile_opening_hours(sender, instance, **kwargs):
+    """
+    Recompiles the intervals and drops the seller's cached responses. Deletes wait for the
+    commit because they also cascade from deleting the seller, which mustn't get new intervals.
+    """
+    def compile():
+        seller = Seller.objects.filter(pk=instance.seller_id).first()
+        if seller:
+            seller.compile_opening_hours()
+            bump_versions(SELLER_SCOPE.format(seller.slug), SERVICE_SELLERS_SCOPE.format(service_slug(seller.service_id)))
+
+    if 'created' in kwargs:
+        compile()
+    else:
+        transaction.on_commit(compile)
+
+
+# Response cache invalidation, see core.cache. post_delete has no created flag, so
+# kwargs.get('created', True) treats deletes like creates: both change the service counters.
+def service_slug(service_id):
+    return Service.objects.filter(pk=service_id).values_list('slug', flat=True).first()
+
+
+def seller_slugs(**lookup):
+    return Seller.objects.filter(**lookup).values_list('slug', 'service__slug').first() or (None, None)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def invalidate_service(sender, instance, **kwargs):
+    bump_versions(SERVICES_SCOPE, NAVIGATION_SCOPE)
+
+
+@receiver(post_save, sender=Seller)
+@receiver(post_delete, sender=Seller)
+def invalidate_seller(sender, instance, **kwargs):
+    service = service_slug(instance.service_id)
+    scopes = [SELLER_SCOPE.format(instance.slug), SERVICE_SELLERS_SCOPE.format(service), SERVICE_PRODUCTS_SCOPE.format(service)]
+    if kwargs.get('created', True):
+        scopes.append(SERVICES_SCOPE)
+    bump_versions(*scopes)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    service = service_slug(instance.service_id)
+    scopes = [SERVICE_CATEGORIES_SCOPE.format(service), SERVICE_PRODUCTS_SCOPE.format(service)]
+    if kwargs.get('created', True):
+        scopes.append(SERVICES_SCOPE)
+    else:
+        # A renamed category shows up in the menus of every seller using it.
+        sellers = Seller.objects.filter(products__category=instance).values_list('slug', flat=True).distinct()
+        scopes += [SELLER_SCOPE.format(slug) for slug in sellers]
+    bump_versions(*scopes)
+
+
+@receiver(pre_delete, sender=Category)
+def invalidate_category_sellers(sender, instance, **kwargs):
+    """Products lose their category on delete, so their sellers must be found beforehand."""
+    sellers = Seller.objects.filter(products__category=instance).values_list('slug', flat=True).distinct()
+    bump_versions(*[SELLER_SCOPE.format(slug) for slug in sellers])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    seller, service = seller_slugs(pk=instance.seller_id)
+    scopes = [SELLER_SCOPE.format(seller), SERVICE_CATEGORIES_SCOPE.format(service), SERVICE_PRODUCTS_SCOPE.format(service)]
+    old_instance = getattr(instance, '_old_instance', None)
+    if old_instance and old_instance.seller_id != instance.seller_id:
+        scopes.append(SELLER_SCOPE.format(seller_slugs(pk=old_instance.seller_id)[0]))
+    if kwargs.get('created', True):
+        scopes.append(SERVICES_SCOPE)
+    bump_versions(*scopes)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review(sender, instance, **kwargs):
+    seller, service = seller_slugs(pk=instance.seller_id)
+    scopes = [SELLER_SCOPE.format(seller), SERVICE_SELLERS_SCOPE.format(service)]
+    if kwargs.get('created', True):
+        scopes.append(SERVICES_SCOPE)
+    bump_versions(*scopes)
+
+
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+@receiver(post_save, sender=TimeSlot)
+@receiver(post_delete, sender=TimeSlot)
+def invalidate_seller_layout(sender, instance, **kwargs):
+    bump_versions(SELLER_SCOPE.format(seller_slugs(pk=instance.seller_id)[0]))
+
+
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+def invalidate_variation(sender, instance, **kwargs):
+    bump_versions(SELLER_SCOPE.format(seller_slugs(products=instance.product_id)[0]))
+
+
+@receiver(post_save, sender=ProductVariation)
+@receiver(post_delete, sender=ProductVariation)
+def invalidate_product_variation(sender, instance, **kwargs):
+    bump_versions(SELLER_SCOPE.format(seller_slugs(products__variations=instance.variation_id)[0]))
 
 
 # @receiver(pre_save, sender=User)
@@ -0,0 +1,513 @@
+import io
+from importlib import import_module
+from datetime import datetime, time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from bookings.models import Booking, Order, OrderItem, Review
+from core.cache import get_versions, SELLER_SCOPE
+from core.testing import FixturesMixin, run_on_commit
+from services.models import (
+    CategorySeller, OpeningHours, PopularProduct, ProductPopularity, ProductSearchToken, Seller, ServiceStatistics,
+)
+from services.opening import compile_intervals
+from services import facets, popularity, search
+from services.popularity import update_popularity
+
+
+@run_on_commit()
+class SellerMenuTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.api_client()
+        self.service = self.create_service()
+        self.seller = self.create_seller(self.service, 'pizzeria')
+        self.categories = [self.create_category(self.service, name) for name in ('Pizza', 'Drinks', 'Desserts')]
+
+    def add_products(self, count):
+        start = self.seller.products.count()
+        for i in range(start, start + count):
+            category = self.categories[i % 4] if i % 4 < 3 else None
+            self.create_product(self.seller, category, 'item-{0}'.format(i))
+
+    def get_menu(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/seller/pizzeria/detail/?expand=products,menu')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_query_count_does_not_grow_with_menu_size(self):
+        self.add_products(4)
+        small_menu, small_queries = self.get_menu()
+        self.add_products(40)
+        large_menu, large_queries = self.get_menu()
+
+        self.assertEqual(len(small_menu['products']), 4)
+        self.assertEqual(len(large_menu['products']), 44)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_menu_groups_products_by_category(self):
+        self.add_products(8)
+        menu, queries = self.get_menu()
+
+        self.assertEqual([group['category'] for group in menu['menu']], ['Desserts', 'Drinks', 'Pizza', None])
+        self.assertEqual(
+            [product['slug'] for product in menu['menu'][2]['products']], ['item-0', 'item-4'],
+        )
+        self.assertEqual(
+            [product['category'] for product in menu['menu'][3]['products']], [None, None],
+        )
+
+    def test_menu_only_when_asked_for(self):
+        self.add_products(2)
+        detail = self.client.get('/api/v1/seller/pizzeria/detail/').json()
+        self.assertNotIn('menu', detail)
+        self.assertEqual(len(detail['products']), 2)
+        self.assertEqual(list(self.client.get('/api/v1/seller/pizzeria/detail/?fields=menu').json()), ['menu'])
+
+    def test_prefetches_only_the_requested_fields(self):
+        self.add_products(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/v1/seller/pizzeria/detail/?fields=name,rating')
+        self.assertFalse([query['sql'] for query in queries if 'services_product' in query['sql']])
+        self.assertFalse([query['sql'] for query in queries if 'services_categoryseller' in query['sql']])
+
+
+class ServiceStatisticsTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.service = self.create_service()
+
+    def counters(self):
+        return ServiceStatistics.objects.values_list(*ServiceStatistics.COUNTERS).get(service=self.service)
+
+    def test_counters_follow_creates_and_deletes(self):
+        self.assertEqual(self.counters(), (0, 0, 0, 0))
+        seller = self.create_seller(self.service, 'pizzeria')
+        category = self.create_category(self.service, 'Pizza')
+        self.create_product(seller, category, 'margherita')
+        self.create_product(seller, None, 'cola')
+        Review.objects.create(user=self.user, seller=seller, rating=Decimal(4))
+        self.assertEqual(self.counters(), (1, 1, 2, 1))
+
+        # Products and reviews cascade with the seller.
+        seller.delete()
+        self.assertEqual(self.counters(), (0, 1, 0, 0))
+        call_command('rebuild_statistics', '--verify', stdout=io.StringIO())
+
+    def test_service_list_reads_the_counters(self):
+        self.create_seller(self.service, 'pizzeria')
+        with self.assertNumQueries(1):
+            response = self.api_client(self.user).get('/api/v1/services/')
+        self.assertEqual(response.json()[0]['sellers'], 1)
+
+    def test_rebuild_fixes_drifted_counters(self):
+        self.create_seller(self.service, 'pizzeria')
+        ServiceStatistics.objects.filter(service=self.service).update(sellers=5, products=3)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_statistics', '--verify', stdout=io.StringIO())
+        call_command('rebuild_statistics', stdout=io.StringIO())
+        self.assertEqual(self.counters(), (1, 0, 0, 0))
+
+
+class SellerRatingTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [self.create_user('user{0}@example.com'.format(i)) for i in range(2)]
+        self.seller = self.create_seller(self.create_service(), 'pizzeria')
+
+    def rating(self):
+        seller = Seller.objects.get(pk=self.seller.pk)
+        return seller.review_count, seller.rating, seller.rating_histogram
+
+    def test_reviews_move_the_aggregate(self):
+        first = Review.objects.create(user=self.users[0], seller=self.seller, rating=Decimal(4))
+        second = Review.objects.create(user=self.users[1], seller=self.seller, rating=Decimal('2.5'))
+        self.assertEqual(self.rating(), (2, 3.2, {1: 0, 2: 0, 3: 1, 4: 1, 5: 0}))
+
+        second.rating = Decimal(5)
+        second.save()
+        self.assertEqual(self.rating(), (2, 4.5, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1}))
+
+        first.delete()
+        self.assertEqual(self.rating(), (1, 5.0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1}))
+        call_command('rebuild_statistics', '--verify', stdout=io.StringIO())
+
+    def test_saving_a_stale_seller_keeps_the_rating(self):
+        stale = Seller.objects.get(pk=self.seller.pk)
+        Review.objects.create(user=self.users[0], seller=self.seller, rating=Decimal(4))
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.rating()[:2], (1, 4.0))
+
+    def test_seller_list_reads_the_aggregate(self):
+        Review.objects.create(user=self.users[0], seller=self.seller, rating=Decimal(3))
+        with self.assertNumQueries(1):
+            response = self.api_client(self.users[0]).get('/api/v1/sellers/{0}/'.format(self.seller.service.slug))
+        self.assertEqual(response.json()['results'][0]['rating'], '3.0')
+
+
+class OpeningHoursTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.create_service()
+        self.client = self.api_client()
+
+    def intervals(self, seller):
+        return list(seller.open_intervals.order_by('start').values_list('start', 'end'))
+
+    def open_sellers(self, now):
+        with mock.patch('services.views.datetime') as clock:
+            clock.now.return_value = now
+            response = self.client.get('/api/v1/sellers/{0}/?open_now=1'.format(self.service.slug))
+        return [seller['slug'] for seller in response.json()['results']]
+
+    def test_compile_intervals(self):
+        # Sunday night wraps to Monday morning and merges with Monday's hours, equal times are open all day.
+        self.assertEqual(
+            compile_intervals([(6, time(22), time(2)), (0, time(1), time(3)), (2, time(9), time(9))]),
+            [(0, 180), (3420, 4860), (9960, 10080)],
+        )
+
+    def test_sellers_without_weekly_hours_open_every_day(self):
+        seller = self.create_seller(self.service, 'bar', open_time=time(20), close_time=time(2))
+        intervals = self.intervals(seller)
+        self.assertEqual(len(intervals), 8)
+        self.assertEqual(intervals[:2], [(0, 120), (1200, 1560)])
+
+    def test_weekly_hours_replace_the_daily_ones(self):
+        seller = self.create_seller(self.service, 'bar')
+        OpeningHours.objects.create(seller=seller, weekday=6, open_time=time(22), close_time=time(3))
+        self.assertEqual(self.intervals(seller), [(0, 180), (9960, 10080)])
+
+        with run_on_commit():
+            seller.opening_hours.get().delete()
+        self.assertEqual(len(self.intervals(seller)), 7)
+
+    def test_only_hour_changes_recompile(self):
+        seller = self.create_seller(self.service, 'bar')
+        with mock.patch.object(Seller, 'compile_opening_hours') as compile_opening_hours:
+            seller.name = 'Night Bar'
+            seller.save()
+            self.assertFalse(compile_opening_hours.called)
+            seller.close_time = time(23)
+            seller.save()
+            self.assertTrue(compile_opening_hours.called)
+
+    def test_migration_compiles_the_same_intervals(self):
+        migration = import_module('services.migrations.0018_opening_hours')
+        hours = [(6, time(22), time(2)), (0, time(1), time(3)), (2, time(9), time(9)), (4, time(8), time(17))]
+        self.assertEqual(migration.compile_intervals(hours), compile_intervals(hours))
+
+    def test_open_now(self):
+        self.create_seller(self.service, 'cafe')
+        night = self.create_seller(self.service, 'bar')
+        OpeningHours.objects.create(seller=night, weekday=6, open_time=time(22), close_time=time(3))
+
+        # 2026-10-19 is a Monday.
+        self.assertEqual(self.open_sellers(datetime(2026, 10, 19, 1, 30)), ['bar'])
+        self.assertEqual(self.open_sellers(datetime(2026, 10, 19, 3, 30)), [])
+        self.assertEqual(self.open_sellers(datetime(2026, 10, 20, 12)), ['cafe'])
+
+
+class PopularityTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        service = self.create_service()
+        self.seller = self.create_seller(service, 'pizzeria')
+        self.category = self.create_category(service, 'Pizza')
+        self.products = [self.create_product(self.seller, self.category, 'pizza-{0}'.format(i)) for i in range(3)]
+
+    def pay(self, *products):
+        order = Order.objects.create(user=self.user, seller=self.seller, complete=True)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product)
+        return Booking.objects.create(user=self.user, seller=self.seller, order=order, status='paid')
+
+    def scores(self):
+        return dict(ProductPopularity.objects.values_list('product', 'score'))
+
+    def test_scoring_the_same_products_again(self):
+        self.pay(self.products[0], self.products[1])
+        self.assertEqual(update_popularity(), 1)
+        first = self.scores()
+
+        self.pay(self.products[0])
+        self.pay(self.products[2])
+        self.assertEqual(update_popularity(), 2)
+        second = self.scores()
+
+        self.assertEqual(ProductPopularity.objects.count(), 3)
+        self.assertGreater(second[self.products[0].pk], first[self.products[0].pk])
+        self.assertEqual(second[self.products[1].pk], first[self.products[1].pk])
+        self.assertEqual(
+            list(PopularProduct.objects.order_by('rank').values_list('product', flat=True))[0], self.products[0].pk)
+        self.assertEqual(update_popularity(), 0)
+
+    def test_overlapping_runs_are_skipped(self):
+        self.pay(self.products[0])
+        cache.add(popularity.LOCK_KEY, True)
+        self.assertIsNone(update_popularity())
+        self.assertEqual(self.scores(), {})
+
+        cache.delete(popularity.LOCK_KEY)
+        self.assertEqual(update_popularity(), 1)
+        self.assertTrue(cache.add(popularity.LOCK_KEY, True))
+
+    def test_batches_score_the_same_products(self):
+        for i in range(3):
+            self.pay(self.products[0])
+        self.assertEqual(update_popularity(batch_size=1), 3)
+        self.assertEqual(ProductPopularity.objects.count(), 1)
+
+
+class SearchTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        service = self.create_service()
+        self.pizzeria = self.create_seller(service, 'mario', name='Mario Pizzeria')
+        self.burgers = self.create_seller(service, 'hut', name='Burger Hut')
+        self.italian = self.create_category(service, 'Italian')
+        self.margherita = self.create_product(
+            self.pizzeria, self.italian, 'margherita', name='Pizza Margherita', description='tomato cheese basil')
+        self.cheeseburger = self.create_product(self.burgers, None, 'cheeseburger', name='Cheese Burger', description='beef')
+        self.veggie = self.create_product(self.burgers, None, 'veggie', name='Veggie Burger', description='with cheese')
+
+    def slugs(self, keyword):
+        products, truncated = search.search_products(keyword)
+        return [product.slug for product in products]
+
+    def test_every_token_must_match(self):
+        self.assertEqual(self.slugs('cheese burger'), ['cheeseburger', 'veggie'])
+        self.assertEqual(self.slugs('italian piz'), ['margherita'])
+        self.assertEqual(self.slugs('pizza burger'), [])
+        self.assertEqual(self.slugs('sushi'), [])
+
+    def test_the_bound_keeps_the_best_matches(self):
+        for i in range(5):
+            self.create_product(self.pizzeria, None, 'calzone-{0}'.format(i), description='burger sized')
+        self.create_product(self.pizzeria, None, 'deluxe', name='Burger Deluxe')
+        with mock.patch.object(search, 'MAX_CANDIDATES', 3):
+            self.assertEqual(search.search_products('burger')[1], True)
+            # Ranked by weight, not by age: name hits come before the descriptions.
+            self.assertEqual(self.slugs('burger'), ['cheeseburger', 'veggie', 'deluxe'])
+            self.assertEqual(self.slugs('burg'), ['cheeseburger', 'veggie', 'deluxe'])
+            # veggie is the rarest token, so its products are complete whatever the bound.
+            self.assertEqual(search.search_products('burger veggie'), ([self.veggie], False))
+
+    def test_renames_reindex_the_products(self):
+        self.italian.name = 'Napoli'
+        self.italian.save()
+        self.pizzeria.name = 'Luigi'
+        self.pizzeria.save()
+        self.assertEqual(self.slugs('napoli luigi'), ['margherita'])
+        self.assertEqual(self.slugs('mario'), [])
+
+    def test_other_changes_dont_reindex(self):
+        with mock.patch('services.signals.index_products') as index_products:
+            self.pizzeria.address = 'Other Street 2'
+            self.pizzeria.save()
+            self.italian.save()
+        self.assertFalse(index_products.called)
+
+    def test_migration_tokenizer_matches(self):
+        migration = import_module('services.migrations.0015_productsearchtoken')
+        for product in (self.margherita, self.cheeseburger):
+            self.assertEqual(migration.product_tokens(product), search.product_tokens(product))
+        self.assertTrue(ProductSearchToken.objects.filter(product=self.margherita, token='tomato').exists())
+
+
+class CacheInvalidationTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.client = self.api_client(self.user)
+        self.service = self.create_service()
+        self.seller = self.create_seller(self.service, 'pizzeria')
+        self.category = self.create_category(self.service, 'Pizza')
+        self.product = self.create_product(self.seller, self.category, 'margherita')
+        self.committed = []
+        on_commit = mock.patch('django.db.transaction.on_commit', self.committed.append)
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+
+    def commit(self):
+        while self.committed:
+            self.committed.pop(0)()
+
+    def get(self, path):
+        """Response and number of queries."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_versions_are_bumped_on_commit(self):
+        self.commit()
+        version, = get_versions(SELLER_SCOPE.format('pizzeria'))
+        with transaction.atomic():
+            self.product.name = 'Marinara'
+            self.product.save()
+            self.assertEqual(get_versions(SELLER_SCOPE.format('pizzeria')), [version])
+        self.commit()
+        self.assertNotEqual(get_versions(SELLER_SCOPE.format('pizzeria')), [version])
+
+    def test_responses_are_cached_until_a_change_commits(self):
+        self.commit()
+        path = '/api/v1/product/margherita/detail/'
+        detail, queries = self.get(path)
+        self.assertGreater(queries, 1)
+        # Cache hits only look up the seller the response is versioned with.
+        self.assertEqual(self.get(path), (detail, 1))
+
+        self.product.name = 'Marinara'
+        self.product.save()
+        self.assertEqual(self.get(path), (detail, 1))
+        self.commit()
+        detail, queries = self.get(path)
+        self.assertEqual(detail['name'], 'Marinara')
+
+    def test_reviews_update_the_seller_list(self):
+        self.commit()
+        path = '/api/v1/sellers/{0}/'.format(self.service.slug)
+        self.get(path)
+        Review.objects.create(user=self.user, seller=self.seller, rating=Decimal(5))
+        self.commit()
+        self.assertEqual(self.get(path)[0]['results'][0]['rating'], '5.0')
+        self.assertEqual(self.get('/api/v1/services/')[0][0]['reviews'], 1)
+
+    def test_moving_a_product_invalidates_both_sellers(self):
+        other = self.create_seller(self.service, 'trattoria')
+        self.commit()
+        self.get('/api/v1/seller/pizzeria/detail/')
+        self.get('/api/v1/seller/trattoria/detail/')
+
+        self.product.seller = other
+        self.product.save()
+        self.commit()
+        self.assertEqual(self.get('/api/v1/seller/pizzeria/detail/')[0]['products'], [])
+        self.assertEqual(len(self.get('/api/v1/seller/trattoria/detail/')[0]['products']), 1)
+
+    def test_deleting_a_category_invalidates_its_sellers(self):
+        self.commit()
+        self.get('/api/v1/seller/pizzeria/detail/')
+        self.category.delete()
+        self.commit()
+        detail, queries = self.get('/api/v1/seller/pizzeria/detail/')
+        self.assertGreater(queries, 0)
+        self.assertEqual(detail['products'][0]['category'], None)
+
+
+class CategorySellerTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        service = self.create_service()
+        self.seller = self.create_seller(service, 'pizzeria')
+        self.pizza, self.drinks = self.create_category(service, 'Pizza'), self.create_category(service, 'Drinks')
+
+    def memberships(self):
+        return dict(CategorySeller.objects.values_list('category__name', 'product_count'))
+
+    def test_moving_products_between_categories(self):
+        products = [self.create_product(self.seller, self.pizza, 'pizza-{0}'.format(i)) for i in range(2)]
+        self.assertEqual(self.memberships(), {'Pizza': 2})
+
+        products[0].category = self.drinks
+        with CaptureQueriesContext(connection) as queries:
+            products[0].save()
+        self.assertEqual(self.memberships(), {'Pizza': 1, 'Drinks': 1})
+        # The stored row is loaded once and shared by every pre_save comparison.
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT "services_product"."id"')]), 1)
+
+        products[1].delete()
+        self.assertEqual(self.memberships(), {'Drinks': 1})
+
+    def test_first_products_saved_at_once(self):
+        get_or_create = CategorySeller.objects.get_or_create
+
+        def racing(**kwargs):
+            # Another request inserts the membership between the update and the insert.
+            CategorySeller.objects.create(product_count=1, **kwargs)
+            return get_or_create(**kwargs)
+
+        with mock.patch.object(CategorySeller.objects, 'get_or_create', racing):
+            self.create_product(self.seller, self.pizza, 'margherita')
+        self.assertEqual(self.memberships(), {'Pizza': 2})
+
+
+class SellerNearbyTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = self.create_service()
+        self.create_seller(self.service, 'near', latitude=52.52, longitude=13.40)
+        self.create_seller(self.service, 'far', latitude=48.14, longitude=11.58)
+        self.client = self.api_client()
+
+    def nearby(self, query):
+        return self.client.get('/api/v1/sellers/{0}/nearby/?{1}'.format(self.service.slug, query))
+
+    def test_nearest_first_within_the_radius(self):
+        response = self.nearby('lat=52.5&lng=13.4&radius=10')
+        self.assertEqual([seller['slug'] for seller in response.json()['results']], ['near'])
+
+    def test_invalid_numbers(self):
+        for query in ('lat=nan&lng=13.4', 'lat=52.5&lng=inf', 'lat=52.5&lng=13.4&radius=nan',
+                      'lat=52.5&lng=13.4&radius=-1', 'lat=91&lng=13.4', 'lng=13.4', 'lat=52.5&lng=13.4&limit=x'):
+            with self.subTest(query=query):
+                self.assertEqual(self.nearby(query).status_code, 400)
+
+
+class ProductBrowseTests(FixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        service = self.create_service()
+        pizza, drinks = self.create_category(service, 'Pizza'), self.create_category(service, 'Drinks')
+        sellers = [self.create_seller(service, 'mario'), self.create_seller(service, 'luigi', delivery='P')]
+        for i, (seller, category, name, price) in enumerate([
+            (sellers[0], pizza, 'Pizza Margherita', 5), (sellers[0], pizza, 'Pizza Funghi', 12),
+            (sellers[0], drinks, 'Cola', 3), (sellers[1], pizza, 'Large Pizza', 30), (sellers[1], drinks, 'Lemonade', 9),
+        ]):
+            self.create_product(seller, category, 'product-{0}'.format(i), name=name, price=Decimal(price))
+        self.client = self.api_client()
+
+    def browse(self, query=''):
+        return self.client.get('/api/v1/products/{0}/browse/?{1}'.format('food', query)).json()
+
+    def test_facet_counts(self):
+        data = self.browse('category=pizza')
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([(value['value'], value['count']) for value in data['facets']['category']], [('pizza', 3), ('drinks', 2)])
+        self.assertEqual([(value['value'], value['count']) for value in data['facets']['seller']], [('mario', 2), ('luigi', 1)])
+
+    def test_keyword_uses_the_search_index(self):
+        data = self.browse('q=piz')
+        self.assertEqual(sorted(product['name'] for product in data['results']), ['Large Pizza', 'Pizza Funghi', 'Pizza Margherita'])
+        # Seller names are indexed with the products, which name__icontains never matched.
+        self.assertEqual(self.browse('q=pizza+mario')['count'], 2)
+        self.assertEqual(self.browse('q=sushi')['count'], 0)
+
+    def test_keyword_finds_every_match_of_the_service(self):
+        other = self.create_seller(self.create_service('Market'), 'market', name='Pizza Market')
+        for i in range(3):
+            self.create_product(other, None, 'market-pizza-{0}'.format(i), name='Pizza {0}'.format(i), description='pizza')
+        # The market's products weigh more, a search bounded before the service filter finds none of food's.
+        with mock.patch.object(search, 'MAX_CANDIDATES', 2):
+            data = self.browse('q=pizza')
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(sum(value['count'] for value in data['facets']['seller']), 3)
+
+    def test_facet_values_are_capped(self):
+        with mock.patch.object(facets, 'MAX_FACET_VALUES', 1):
+            data = self.browse('seller=luigi')
+        self.assertEqual([value['value'] for value in data['facets']['category']], ['drinks'])
+        # Selected values stay listed.
+        self.assertEqual([value['value'] for value in data['facets']['seller']], ['mario', 'luigi'])
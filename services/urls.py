@@ -8,8 +8,8 @@ from services.views import (
     ProductListView, ProductCreateView, ProductUpdateView, ProductDeleteView, ProductDetailView,
     SellerProductCreateView, SellerProductUpdateView, SellerProductDeleteView,
 
-    ServiceListAPIView, CategoryListAPIView, SellerListAPIView, SellerDetailAPIView,
-    ProductPopularListAPIView, ProductDetailAPIView, ProductSearchListAPIView,
+    ServiceListAPIView, CategoryListAPIView, SellerListAPIView, SellerNearbyAPIView, SellerDetailAPIView,
+    ProductPopularListAPIView, ProductDetailAPIView, ProductBatchAPIView, ProductBrowseAPIView, ProductSearchListAPIView,
     AddToCartView,  OrderListAPIView, OrderDetailAPIView,
     IncreaseOrderItemView, DecreaseOrderItemView,
     TableListAPIView, TimeslotListAPIView,
@@ -51,11 +51,14 @@ urlpatterns = [
     path('api/v1/services/', ServiceListAPIView.as_view()),
     path('api/v1/categories/<slug:slug>/', CategoryListAPIView.as_view()),
     path('api/v1/sellers/<slug:service_slug>/', SellerListAPIView.as_view()),
+    path('api/v1/sellers/<slug:service_slug>/nearby/', SellerNearbyAPIView.as_view()),
     path('api/v1/seller/<slug:seller_slug>/detail/', SellerDetailAPIView.as_view()),
 
     # Product URLs
     path('api/v1/<slug:category_slug>/products/popular/', ProductPopularListAPIView.as_view()),
     path('api/v1/products/search/', ProductSearchListAPIView.as_view()),
+    path('api/v1/products/batch/', ProductBatchAPIView.as_view()),
+    path('api/v1/products/<slug:service_slug>/browse/', ProductBrowseAPIView.as_view()),
     path('api/v1/product/<slug:product_slug>/detail/', ProductDetailAPIView.as_view()),
 
     # Order URLs
@@ -1,3 +1,4 @@
+import math
 from datetime import datetime
 
 from django.urls import reverse
@@ -5,23 +6,34 @@ from django.shortcuts import render, get_object_or_404
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView, MultipleObjectMixin
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.db.models import Avg, Max, Q
+from django.db.models import Avg, Count, Exists, Max, OuterRef, Q, Prefetch, prefetch_related_objects
 
 from rest_framework import generics, viewsets, status
 from rest_framework.views import APIView
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from core.utils import PAGINATE_BY
-from services.models import Service, Seller, Category, Product
-from bookings.models import Order, OrderItem, Booking, Review
+from core.utils import (
+    PAGINATE_BY, SEARCH_PAGE_SIZE, POPULAR_PAGE_SIZE, API_PAGE_SIZE, API_MAX_PAGE_SIZE, NEARBY_RADIUS, NEARBY_MAX_RADIUS,
+)
+from core.pagination import CursorPagination, BookingCursorPagination, TimeslotCursorPagination
+from core.mixins import VersionedCacheMixin
+from core.cache import SERVICES_SCOPE, SERVICE_SELLERS_SCOPE, SERVICE_CATEGORIES_SCOPE, SERVICE_PRODUCTS_SCOPE, SELLER_SCOPE
+from services.models import Service, Seller, OpeningInterval, Category, CategorySeller, Product, PopularProduct
+from bookings.models import Order, OrderItem, Booking, Review, BOOKING_STATUS
+from bookings import queue
 from variants.models import Table, ProductVariation
 from services.forms import SellerForm, ServiceProductForm, SellerProductForm
 from services.filters import ProductFilter, ServiceProductFilter, CategoryFilter
+from services.search import search_filter, search_products
+from services.opening import minute_of_week
+from services.geo import nearest_sellers
+from services.facets import FACETS, facet_filter, facet_counts
+from services.popularity import sample_popular
 from services.serializers import (
-    ServiceSerializer, CategorySerializer, SellerSerializer, SellerDetailSerializer,
-    ProductSerializer, ProductDetailSerializer, TableListSerializer, TimeslotListSerializer,
-    OrderSerializer, OrderItemSerializer, BookingSerializer,
+    ServiceSerializer, CategorySerializer, SellerSerializer, NearbySellerSerializer, SellerDetailSerializer,
+    ProductSerializer, ProductDetailSerializer, ProductSearchSerializer, TableListSerializer, TimeslotListSerializer,
+    OrderSerializer, OrderItemSerializer, BookingSerializer, query_list,
 )
 from users.views import AdminRequiredMixin
 
@@ -108,15 +120,16 @@ class SellerDetailView(AdminRequiredMixin, DetailView, MultipleObjectMixin):
         return Seller.objects.get(slug=self.kwargs['seller_slug'])
 
     def get_context_data(self, **kwargs):
-        object_list = ProductFilter(self.request.GET, queryset=Product.objects.filter(seller=self.get_object()).order_by('pk')).qs
-        if self.get_object().reviews.all().exists():
-            rating = "{:.1f}".format(Review.objects.filter(seller=self.get_object()).aggregate(Avg('rating'))['rating__avg'])
+        object_list = ProductFilter(self.request.GET, queryset=Product.objects.filter(seller=self.object).order_by('pk')).qs
+        if self.object.review_count:
+            rating = "{:.1f}".format(self.object.rating)
         else:
             rating = None
         context = super(SellerDetailView, self).get_context_data(
             object_list=object_list,
             product_filter=ProductFilter(self.request.GET, service=self.object.service.slug),
             rating=rating,
+            rating_histogram=self.object.rating_histogram,
             **kwargs)
         return context
 
@@ -309,35 +322,104 @@ class SellerProductDeleteView(AdminRequiredMixin, DeleteView):
 
 
 ''' ============================================== Service API ================================================= '''
-class ServiceListAPIView(generics.ListAPIView):
+class ServiceListAPIView(VersionedCacheMixin, generics.ListAPIView):
     serializer_class = ServiceSerializer
-    queryset = Service.objects.all()
+    queryset = Service.objects.select_related('statistics')
+
+    def get_cache_scopes(self):
+        return [SERVICES_SCOPE]
 
 
 ''' =============================================== Seller API ================================================= '''
-class SellerListAPIView(generics.ListAPIView):
+class SellerListAPIView(VersionedCacheMixin, generics.ListAPIView):
     serializer_class = SellerSerializer
+    pagination_class = CursorPagination
 
     def get_queryset(self):
         service_slug = self.kwargs['service_slug']
-        return Seller.objects.filter(service__slug=service_slug)
+        queryset = Seller.objects.filter(service__slug=service_slug)
+        if self.open_now():
+            minute = minute_of_week(datetime.now())
+            queryset = queryset.filter(Exists(
+                OpeningInterval.objects.filter(seller=OuterRef('pk'), start__lte=minute, end__gt=minute)
+            ))
+        return queryset
+
+    def open_now(self):
+        return self.request.query_params.get('open_now') in ('1', 'true')
+
+    def get_cache_scopes(self):
+        return [SERVICE_SELLERS_SCOPE.format(self.kwargs['service_slug'])]
+
+    def get_cache_variant(self):
+        # Who is open changes by the minute, not only when a seller does.
+        return [str(minute_of_week(datetime.now()))] if self.open_now() else []
 
 
-class SellerDetailAPIView(generics.RetrieveAPIView):
+class SellerNearbyAPIView(APIView):
+    def get(self, request, *args, **kwargs):
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lng'])
+            radius = float(request.query_params.get('radius', NEARBY_RADIUS))
+            limit = int(request.query_params.get('limit', API_PAGE_SIZE))
+        except (KeyError, ValueError):
+            return Response({'message': 'lat and lng must be given, radius and limit must be numbers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # NaN passes every comparison below, so non-finite values are ruled out first.
+        if not all(map(math.isfinite, (latitude, longitude, radius))) \
+                or not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or radius <= 0 or limit <= 0:
+            return Response({'message': 'Invalid location, radius or limit.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        sellers = nearest_sellers(
+            Seller.objects.filter(service__slug=self.kwargs['service_slug']),
+            latitude, longitude, min(radius, NEARBY_MAX_RADIUS), min(limit, API_MAX_PAGE_SIZE),
+        )
+        serializer = NearbySellerSerializer(instance=sellers, many=True, context={'request': request})
+        return Response(data={'results': serializer.data}, status=status.HTTP_200_OK)
+
+
+class SellerDetailAPIView(VersionedCacheMixin, generics.RetrieveAPIView):
     serializer_class = SellerDetailSerializer
 
+    def get_seller(self):
+        if not hasattr(self, 'seller'):
+            self.seller = Seller.objects.get(slug=self.kwargs['seller_slug'])
+        return self.seller
+
     def get_object(self):
-        slug = self.kwargs['seller_slug']
-        return Seller.objects.get(slug=slug)
+        # Prefetched only once the response is rendered, cache hits just need the opening hours,
+        # and only for the fields requested.
+        seller = self.get_seller()
+        fields = self.get_serializer().fields
+        lookups = []
+        if 'products' in fields or 'menu' in fields:
+            lookups.append(Prefetch('products', queryset=Product.objects.select_related('category').order_by('pk')))
+        if 'categories' in fields:
+            lookups.append(Prefetch(
+                'category_memberships', queryset=CategorySeller.objects.select_related('category').order_by('category')))
+        prefetch_related_objects([seller], *lookups)
+        return seller
+
+    def get_cache_scopes(self):
+        return [SELLER_SCOPE.format(self.kwargs['seller_slug'])]
+
+    def get_cache_variant(self):
+        # The payload says whether the seller is open right now.
+        return ['open' if self.get_seller().is_open_at(datetime.now()) else 'closed']
 
 
 ''' ============================================== Category API ================================================ '''
-class CategoryListAPIView(generics.ListAPIView):
+class CategoryListAPIView(VersionedCacheMixin, generics.ListAPIView):
     serializer_class = CategorySerializer
+    pagination_class = CursorPagination
 
     def get_queryset(self):
         slug = self.kwargs['slug']
-        return Category.objects.filter(service__slug=slug)
+        return Category.objects.filter(service__slug=slug).annotate(seller_count=Count('seller_memberships'))
+
+    def get_cache_scopes(self):
+        return [SERVICE_CATEGORIES_SCOPE.format(self.kwargs['slug'])]
 
 
 ''' =============================================== Product API ================================================ '''
@@ -346,14 +428,104 @@ class ProductPopularListAPIView(generics.ListAPIView):
 
     def get_queryset(self):
         category_slug = self.kwargs.get('category_slug')
-        return Product.objects.filter(category__slug=category_slug).order_by('?')[:9]
+        popular = list(
+            PopularProduct.objects.filter(category__slug=category_slug).select_related('product__seller').order_by('rank')
+        )
+        if not popular:
+            # Nothing has been ordered from this category yet.
+            return Product.objects.filter(category__slug=category_slug).select_related('seller').order_by('pk')[:POPULAR_PAGE_SIZE]
+
+        if self.request.query_params.get('sample') == '0':
+            popular = popular[:POPULAR_PAGE_SIZE]
+        else:
+            popular = sample_popular(popular, POPULAR_PAGE_SIZE)
+        return [entry.product for entry in popular]
+
+
+def product_detail_queryset():
+    """ Everything ProductDetailSerializer reads, loaded in a fixed number of queries. """
+    return Product.objects.select_related('seller', 'category').prefetch_related(
+        Prefetch('seller__products', queryset=Product.objects.select_related('category').order_by('pk')),
+        'variations__product_variations',
+    )
+
+
+class ProductBrowseAPIView(VersionedCacheMixin, generics.ListAPIView):
+    """
+    Products of a service filtered by ?q= and the comma separated facets ?category=, ?seller=,
+    ?price= and ?delivery=, with the counts of every facet value next to the first page.
+    """
+    serializer_class = ProductSerializer
+    pagination_class = CursorPagination
+
+    def get_selected(self):
+        selected = {facet: query_list(self.request, facet) for facet in FACETS}
+        return {facet: values for facet, values in selected.items() if values}
+
+    def get_products(self):
+        products = Product.objects.filter(seller__service__slug=self.kwargs['service_slug'])
+        keyword = self.request.query_params.get('q', '').strip()
+        if keyword:
+            # Kept so the page and the facet counts share the posting list counts. Not bounded
+            # like a search, the counts must cover every match of the service.
+            if not hasattr(self, 'keyword_filter'):
+                self.keyword_filter = search_filter(keyword, products)
+            products = products.filter(self.keyword_filter)
+        return products
+
+    def get_queryset(self):
+        return self.get_products().filter(facet_filter(self.get_selected())).select_related('seller')
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not request.query_params.get(self.paginator.cursor_query_param):
+            response.data['count'], response.data['facets'] = facet_counts(self.get_products(), self.get_selected())
+        return response
+
+    def get_cache_scopes(self):
+        return [SERVICE_PRODUCTS_SCOPE.format(self.kwargs['service_slug'])]
 
 
-class ProductDetailAPIView(generics.RetrieveAPIView):
+class ProductDetailAPIView(VersionedCacheMixin, generics.RetrieveAPIView):
     serializer_class = ProductDetailSerializer
 
     def get_object(self):
-        return Product.objects.get(slug=self.kwargs['product_slug'])
+        return product_detail_queryset().get(slug=self.kwargs['product_slug'])
+
+    def get_cache_scopes(self):
+        # The detail lists the seller's other products, so it is versioned with the seller.
+        seller_slug = Product.objects.filter(slug=self.kwargs['product_slug']).values_list('seller__slug', flat=True).first()
+        if seller_slug is None:
+            return None
+        return [SELLER_SCOPE.format(seller_slug)]
+
+
+class ProductBatchAPIView(APIView):
+    """ Details of several products at once, in the order asked for. Takes either slugs or ids. """
+    def post(self, request, *args, **kwargs):
+        slugs = request.data.get('slugs', None)
+        ids = request.data.get('ids', None)
+        if slugs is None and ids is None:
+            return Response({'message': 'Product slugs or ids must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        field, keys = ('slug', slugs) if slugs is not None else ('id', ids)
+        if not isinstance(keys, list):
+            return Response({'message': 'Product slugs or ids must be a list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(keys) > API_MAX_PAGE_SIZE:
+            return Response({'message': 'At most {0} products can be requested at once.'.format(API_MAX_PAGE_SIZE)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            keys = [str(key) if field == 'slug' else int(key) for key in keys]
+        except (TypeError, ValueError):
+            return Response({'message': 'Invalid product ids.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = product_detail_queryset().in_bulk(keys, field_name=field)
+        found = [products[key] for key in keys if key in products]
+        serializer = ProductDetailSerializer(instance=found, many=True, context={'request': request})
+        return Response({
+            'results': serializer.data,
+            'missing': [key for key in keys if key not in products],
+        }, status=status.HTTP_200_OK)
 
 
 class ProductSearchListAPIView(APIView):
@@ -362,13 +534,26 @@ class ProductSearchListAPIView(APIView):
         if keyword is None:
             return Response({'message': 'Search keyword must be provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            page = max(int(request.data.get('page', 1)), 1)
+        except (TypeError, ValueError):
+            return Response({'message': 'Page must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
         keyword = keyword.strip()
         if len(keyword) <= 3:
-            return Response(data=[], status=status.HTTP_200_OK)
+            return Response(data={'page': page, 'next': None, 'truncated': False, 'results': []}, status=status.HTTP_200_OK)
 
-        products = Product.objects.filter(name__icontains=keyword)
-        serializer = ProductDetailSerializer(instance=products, many=True)
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        # One extra hit tells whether there is a next page without counting every match.
+        offset = (page - 1) * SEARCH_PAGE_SIZE
+        products, truncated = search_products(keyword, offset=offset, limit=SEARCH_PAGE_SIZE + 1)
+        serializer = ProductSearchSerializer(instance=products[:SEARCH_PAGE_SIZE], many=True)
+        # truncated: the keyword matched more products than a search ranks, refining it finds the rest.
+        return Response(data={
+            'page': page,
+            'next': page + 1 if len(products) > SEARCH_PAGE_SIZE else None,
+            'truncated': truncated,
+            'results': serializer.data,
+        }, status=status.HTTP_200_OK)
 
 
 ''' ============================================== Order API =================================================== '''
@@ -424,12 +609,20 @@ class AddToCartView(APIView):
         return Response(status=status.HTTP_200_OK)
 
 
+def order_items_prefetch(lookup='order_items'):
+    """Loads order items with what OrderItemSerializer reads in two queries for any number of orders."""
+    return Prefetch(lookup, queryset=OrderItem.objects.select_related('product').prefetch_related(
+        Prefetch('product_variations', queryset=ProductVariation.objects.select_related('variation'))
+    ))
+
+
 class OrderListAPIView(generics.ListAPIView):
     serializer_class = OrderSerializer
+    pagination_class = CursorPagination
 
     def get_queryset(self):
         user = self.request.user
-        queryset = user.orders.filter(complete=False)
+        queryset = user.orders.filter(complete=False).select_related('seller').prefetch_related(order_items_prefetch())
         if queryset.exists():
             return queryset.exclude(order_items__isnull=True)
         return queryset
@@ -443,7 +636,7 @@ class OrderDetailAPIView(generics.RetrieveAPIView):
         seller = get_object_or_404(Seller, slug=slug)
 
         user = self.request.user
-        return Order.objects.filter(user=user, seller=seller, complete=False).first()
+        return Order.objects.filter(user=user, seller=seller, complete=False).prefetch_related(order_items_prefetch()).first()
 
 
 ''' ========================================== OrderItem API ================================================= '''
@@ -526,11 +719,7 @@ class BookingAPIView(APIView):
         booking_kwars['user'] = request.user
         booking_kwars['order'] = order
 
-        prev_booking_qs = Booking.objects.filter(status='booked', seller=seller)
-        if not prev_booking_qs.exists():
-            booking_kwars['started_time'] = datetime.now()
-        
-        mybooking = Booking.objects.create(**booking_kwars)
+        mybooking = queue.enqueue(**booking_kwars)
         
         order.complete = True
         order.save()
@@ -541,48 +730,31 @@ class BookingAPIView(APIView):
 class BookingQueueAPIView(APIView):
     def get(self, request, *args, **kwargs):
         id = self.kwargs.get('pk')
-        booking = Booking.objects.get(id=id)
+        booking = get_object_or_404(Booking.objects.select_related('seller'), id=id)
         user = request.user
 
-        if booking.user.id != user.id and user.is_superuser == False:
+        if booking.user_id != user.id and user.is_superuser == False:
             return Response({'message': 'This booking doesn\'t belong to current user.'}, status=status.HTTP_200_OK)
 
-        seller_wait_time = booking.seller.wait_time * 60    # seller wait time in seconds
-        people_on_queue = booking.seller.bookings.filter(
-            Q(status='booked'),
-            Q(booked_time__lt=booking.booked_time),
-            Q(started_time__isnull=True)
-        ).count()
-        wait_time = people_on_queue * seller_wait_time
-
-        active_booking_qs = booking.seller.bookings.filter(
-            Q(status='booked'),
-            # Q(booked_time__lt=booking.booked_time),
-            Q(started_time__isnull=False)
-        )
-        if active_booking_qs.exists():
-            active_booking = active_booking_qs[0]
-            collapsed = datetime.now() - active_booking.started_time
-            left = seller_wait_time - int(collapsed.total_seconds())
-            if left < 0:
-                left = 0
-            wait_time += left
-
+        people_on_queue, wait_time = queue.position(booking, booking.seller)
         return Response({'people': people_on_queue, 'time': wait_time}, status=status.HTTP_200_OK)
 
 
 class BookingListAPIView(generics.ListAPIView):
     serializer_class = BookingSerializer
+    pagination_class = BookingCursorPagination
 
     def get_queryset(self):
         user = self.request.user
         status = self.kwargs.get('status')
+        bookings = user.bookings.select_related('seller', 'order').prefetch_related(order_items_prefetch('order__order_items'))
         if status == 'active':
-            return user.bookings.filter(status='booked').order_by('-booked_time')
+            return bookings.filter(status='booked')
         elif status == 'previous':
-            return user.bookings.exclude(status='booked').order_by('-booked_time')
+            # IN rather than exclude() so the (user, status, booked_time) index applies.
+            return bookings.filter(status__in=[key for key, label in BOOKING_STATUS if key != 'booked'])
         else:
-            return []
+            return Booking.objects.none()
 
 
 class BookingPayAPIView(APIView):
@@ -593,7 +765,7 @@ class BookingPayAPIView(APIView):
 
         booking = Booking.objects.get(id=id)
         user = request.user
-        if user.id != booking.user.id:
+        if user.id != booking.user_id:
             return Response({'message': 'This booking can\'t be processed by current user.'}, status=status.HTTP_400_BAD_REQUEST)
 
         if booking.status != 'booked':
@@ -602,24 +774,18 @@ class BookingPayAPIView(APIView):
         if booking.started_time is None:
             return Response({'message': 'This booking can\'be paid as there are more guests ahead.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        seller = booking.seller
-
-        booking.status = 'paid'
-        booking.save()
-
-        now = datetime.now()
-        next_booking_qs = seller.bookings.filter(Q(status='booked'), Q(started_time__isnull=True))
-        if next_booking_qs.exists():
-            next_booking = next_booking_qs.earliest('booked_time')
-            next_booking.started_time = now
-            next_booking.save()
+        if not queue.finish(booking, 'paid'):
+            return Response({'message': 'This booking can\'t be paid as its status was changed.'}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response(status=status.HTTP_200_OK)
 
 
 ''' ============================== Table API ================================= '''
-class TableListAPIView(APIView):
-    def get(self, request, *args, **kwargs):
+class TableListAPIView(VersionedCacheMixin, generics.ListAPIView):
+    def get_cache_scopes(self):
+        return [SELLER_SCOPE.format(self.kwargs.get('seller_slug'))]
+
+    def list(self, request, *args, **kwargs):
         seller = Seller.objects.get(slug=self.kwargs.get('seller_slug'))
         tables = seller.tables.all()
         response = {}
@@ -633,12 +799,16 @@ class TableListAPIView(APIView):
 
 
 ''' ============================ Timeslot API ================================ '''
-class TimeslotListAPIView(generics.ListAPIView):
+class TimeslotListAPIView(VersionedCacheMixin, generics.ListAPIView):
     serializer_class = TimeslotListSerializer
+    pagination_class = TimeslotCursorPagination
+
+    def get_cache_scopes(self):
+        return [SELLER_SCOPE.format(self.kwargs.get('seller_slug'))]
 
     def get_queryset(self):
         seller = Seller.objects.get(slug=self.kwargs.get('seller_slug'))
-        return seller.timeslots.order_by('start')
+        return seller.timeslots.all()
 
 
 # =================================================================================================== #
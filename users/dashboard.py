@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db import transaction
+
+from users.models import User, DashboardSnapshot
+from services.models import Seller, Product, ProductPopularity
+from bookings.models import Booking, OrderItem, BOOKING_STATUS
+
+
+POPULAR_COUNT = 10
+
+
+def revenue_since(time):
+    """Total price of the items of bookings paid since time."""
+    total = OrderItem.objects.filter(
+        order__booking__status='paid', order__booking__booked_time__gte=time
+    ).aggregate(total=Sum(ExpressionWrapper(
+        F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2)
+    )))['total']
+    return total or 0
+
+
+def take_snapshot():
+    """Computes the dashboard statistics and replaces the stored snapshot with them."""
+    now = datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week = today - timedelta(days=today.weekday())
+
+    bookings = {status: 0 for status, label in BOOKING_STATUS}
+    bookings.update(Booking.objects.values_list('status').annotate(count=Count('pk')).order_by())
+
+    sellers = (
+        Seller.objects.annotate(paid=Count('bookings', filter=Q(bookings__status='paid')))
+        .filter(paid__gt=0)
+        .order_by('-paid', 'pk')
+        .values('name', 'description', 'paid')[:POPULAR_COUNT]
+    )
+    # Products ranked by the decayed popularity of services.popularity.
+    products = (
+        ProductPopularity.objects.order_by('-score', 'product')
+        .values('product__name', 'product__description', 'product__seller__name')[:POPULAR_COUNT]
+    )
+
+    with transaction.atomic():
+        snapshot = DashboardSnapshot.objects.create(
+            users=User.objects.count(),
+            sellers=Seller.objects.count(),
+            products=Product.objects.count(),
+            bookings=bookings,
+            revenue_today=revenue_since(today),
+            revenue_week=revenue_since(week),
+            popular_sellers=[
+                {'name': seller['name'], 'description': seller['description'], 'bookings': seller['paid']}
+                for seller in sellers
+            ],
+            popular_products=[
+                {'name': product['product__name'], 'description': product['product__description'],
+                 'seller': product['product__seller__name']}
+                for product in products
+            ],
+        )
+        DashboardSnapshot.objects.exclude(pk=snapshot.pk).delete()
+    return snapshot
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.6 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20210316_0922'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_time', models.DateTimeField(auto_now_add=True)),
+                ('users', models.IntegerField(default=0)),
+                ('sellers', models.IntegerField(default=0)),
+                ('products', models.IntegerField(default=0)),
+                ('bookings', models.JSONField(default=dict)),
+                ('revenue_today', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('revenue_week', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('popular_sellers', models.JSONField(default=list)),
+                ('popular_products', models.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -71,3 +71,19 @@ class User(AbstractUser):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         resize_image(self.avatar)
+
+
+class DashboardSnapshot(models.Model):
+    """Admin dashboard statistics, taken periodically by users.dashboard.take_snapshot."""
+    taken_time = models.DateTimeField(auto_now_add=True)
+    users = models.IntegerField(default=0)
+    sellers = models.IntegerField(default=0)
+    products = models.IntegerField(default=0)
+    bookings = models.JSONField(default=dict)           # {status: count}
+    revenue_today = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    revenue_week = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    popular_sellers = models.JSONField(default=list)    # [{name, description, bookings}]
+    popular_products = models.JSONField(default=list)   # [{name, description, seller}]
+
+    def __str__(self):
+        return str(self.taken_time)
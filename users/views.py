@@ -17,9 +17,10 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from core import sqlstats
 from core.utils import PAGINATE_BY
-from users.models import User
-from services.models import Product, Seller
+from users.models import User, DashboardSnapshot
+from users.dashboard import take_snapshot
 from users.filters import UserFilter
 from users.forms import CreateUserForm, ChangeUserForm, UserLoginForm
 from users.serializers import LoginSerializer, UserSerializer, PasswordResetSerializer, UserVerifySerializer
@@ -147,11 +148,21 @@ class DashboardView(AdminRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['users'] = User.objects.count()
-        context['sellers'] = Seller.objects.count()
-        context['products'] = Product.objects.count()
-        context['popular_sellers'] = Seller.objects.all()[:10]
-        context['popular_products'] = Product.objects.all()[:10]
+        # Refreshed by the refresh_dashboard beat task, taken here only before its first run.
+        context['snapshot'] = DashboardSnapshot.objects.order_by('-pk').first() or take_snapshot()
+        return context
+
+
+class QueryStatsView(AdminRequiredMixin, TemplateView):
+    template_name = "users/queries.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        order = self.request.GET.get('order')
+        context['order'] = order if order in sqlstats.ORDERS else 'total'
+        context['orders'] = sqlstats.ORDERS
+        context['enabled'] = settings.SQL_STATS_ENABLED
+        context['statements'] = sqlstats.top(settings.SQL_STATS_DIR, context['order'], limit=50)
         return context
 
 